@@ -1,11 +1,13 @@
 import google.generativeai as genai
 from dotenv import load_dotenv
 import os
+from modelRouter import ModelRouter
+from chatSessionStore import SessionStore
 
 load_dotenv()
 api_key = os.getenv("GOOGLE_API_KEY")
 genai.configure(api_key=api_key)
-model = genai.GenerativeModel("gemini-1.5-flash")
+router = ModelRouter(routes=[("gemini-1.5-flash", 8.0), ("gemini-1.5-flash-8b", 8.0)]) # Fallback when flash is slow or failing
 
 generation_config = genai.types.GenerationConfig(
     temperature=0.9,
@@ -17,9 +19,14 @@ history = [
        {'role':'user', 'parts': [{'text':'Briefly tell me about the Roman Empire.'}]},
        {'role':'model', 'parts': [{'text':'The Roman Empire was vast...'}]}
     ]
-chat = model.start_chat(history=history)
-
-print('Starting new chat session...! Enter "exit" to end the chat.')
+# Persisted: restarting the script resumes the conversation (CHAT_SESSION_ID picks another one).
+session_store = SessionStore()
+chat = session_store.session(os.getenv("CHAT_SESSION_ID", "roman-empire"), router.start_chat, history=history)
+
+if len(chat.history) > len(history):
+    print(f'Resuming chat session ({len(chat.history)} messages)...! Enter "exit" to end the chat.')
+else:
+    print('Starting new chat session...! Enter "exit" to end the chat.')
 
 while True:
     user_input = input('You: ')
@@ -3,6 +3,7 @@ from dotenv import load_dotenv
 import os
 import numpy as np
 from sklearn.metrics.pairwise import cosine_similarity
+from usageMetrics import metered_embed_content, metered_generate_content
 
 load_dotenv()
 
@@ -31,7 +32,8 @@ try:
     # --- Phase 1: Indexing (Generate and "Store" Embeddings for our Documents) ---
     # In a real app, this is done once and stored in a vector DB.
     print("--- Indexing Documents (Generating Embeddings) ---")
-    document_embeddings = genai.embed_content(
+    document_embeddings = metered_embed_content(
+        stage="embed_documents",
         model=embedding_model_name,
         content=documents,
         task_type="RETRIEVAL_DOCUMENT"
@@ -48,7 +50,8 @@ try:
 
     # 1. Embed the User Query
     print("Embedding user query...")
-    query_embedding = genai.embed_content(
+    query_embedding = metered_embed_content(
+        stage="embed_query",
         model=embedding_model_name,
         content=user_query,
         task_type="RETRIEVAL_QUERY"
@@ -94,7 +97,7 @@ Answer:
     # 5. Generate Response using the Generative LLM
     print("--- Generating Final Answer using LLM ---")
     generative_model = genai.GenerativeModel(generative_model_name)
-    final_response = generative_model.generate_content(augmented_prompt)
+    final_response = metered_generate_content(generative_model, augmented_prompt, stage="generate_answer")
 
     print("\n--- Final Answer from LLM ---")
     print(final_response.text)
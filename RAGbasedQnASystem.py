@@ -2,8 +2,18 @@ import google.generativeai as genai
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
 from dotenv import load_dotenv
 import os
+import time
 import chromadb
 import uuid # For unique IDs
+from safetyPrefilter import SafetyPrefilter
+from usageMetrics import metered_embed_content, start_metrics_server, CLEAN_FINISH_REASONS
+from modelRouter import ModelRouter, DEFAULT_ROUTES
+from pipelineTracing import TRACER # Enable with TRACE_PATH=trace.json
+from reindexEmbeddings import live_collection_name, reset_live_collection, collection_embedding_model, EMBEDDING_MODEL_KEY
+from mmrRerank import mmr_rerank_results, DEFAULT_FETCH_K, DEFAULT_LAMBDA
+from chatSessionStore import SessionStore
+from documentTextStore import TEXT_STORE_KEY, text_store_path, collection_text_store, add_documents, fill_documents
+from nearDuplicates import deduplicate_chunks, print_deduplication
 
 # --- Configuration ---
 load_dotenv()
@@ -14,6 +24,7 @@ genai.configure(api_key=GOOGLE_API_KEY)
 
 EMBEDDING_MODEL_NAME = "text-embedding-004"
 GENERATIVE_MODEL_NAME = 'gemini-1.5-flash-latest' # Or 'gemini-pro' for text-only generation if preferred
+GENERATION_LATENCY_SLO = 8.0 # seconds; slower models are routed around (see modelRouter.py)
 CHROMA_PERSIST_PATH = "./scientist_db_store"
 CHROMA_COLLECTION_NAME = "pioneering_scientists_collection"
 
@@ -60,46 +71,72 @@ def get_document_summary(topic: str):
         return {"summary": f"No pre-defined summary available for '{topic}'. I can only summarize Marie Curie, Nikola Tesla, or Ada Lovelace."}
 
 # --- ChromaDB Setup and Indexing ---
+def prepare_documents():
+    """
+    Documents, metadatas and ids to index, with near-duplicates already dropped.
+
+    Returns:
+        tuple: (documents, metadatas, ids, number of documents before deduplication)
+    """
+    docs_to_embed = []
+    metadatas_to_store = []
+    ids_to_store = []
+
+    for key, data in DOCUMENTS_DATA.items():
+        docs_to_embed.append(data["text"])
+        metadatas_to_store.append({"scientist_name": key.replace("_", " ").title(), "source": data["source"]})
+        ids_to_store.append(key) # Use scientist key as ID
+
+    # Drop near-duplicate documents before paying to embed and store them
+    docs_to_embed, metadatas_to_store, ids_to_store = deduplicate_chunks(docs_to_embed, metadatas_to_store, ids_to_store)
+    return docs_to_embed, metadatas_to_store, ids_to_store, len(DOCUMENTS_DATA)
+
+
 def setup_chroma_collection():
     print("--- Initializing ChromaDB Client and Collection ---")
     client = chromadb.PersistentClient(path=CHROMA_PERSIST_PATH)
+    docs_to_embed, metadatas_to_store, ids_to_store, documents_before = prepare_documents()
     
     try:
-        collection = client.get_collection(name=CHROMA_COLLECTION_NAME)
-        print(f"Retrieved existing collection: '{CHROMA_COLLECTION_NAME}' with {collection.count()} items.")
-        if collection.count() == len(DOCUMENTS_DATA): # Basic check if already populated
+        collection = client.get_collection(name=live_collection_name(CHROMA_PERSIST_PATH, CHROMA_COLLECTION_NAME))
+        print(f"Retrieved existing collection: '{collection.name}' with {collection.count()} items.")
+        if collection.count() == len(ids_to_store): # Basic check if already populated (after deduplication)
             print("Collection appears to be already populated.")
             return collection
         elif collection.count() > 0: # If partially populated, best to recreate for this example
             print(f"Collection exists but has unexpected item count ({collection.count()}). Recreating for consistency in this example.")
-            client.delete_collection(name=CHROMA_COLLECTION_NAME)
+            client.delete_collection(name=collection.name)
             raise chromadb.errors.CollectionNotFoundError("Recreating collection") # Force recreation
             
     except Exception: # Handles CollectionNotFoundError and others during get
         print(f"Creating and populating new collection: '{CHROMA_COLLECTION_NAME}'...")
-        collection = client.create_collection(name=CHROMA_COLLECTION_NAME)
-
-        docs_to_embed = []
-        metadatas_to_store = []
-        ids_to_store = []
-
-        for key, data in DOCUMENTS_DATA.items():
-            docs_to_embed.append(data["text"])
-            metadatas_to_store.append({"scientist_name": key.replace("_", " ").title(), "source": data["source"]})
-            ids_to_store.append(key) # Use scientist key as ID
+        try:
+            # After a re-index the live collection is a shadow, and the logical one is kept for rollback.
+            client.delete_collection(name=CHROMA_COLLECTION_NAME)
+        except Exception:
+            pass # Not there (first run)
+        # Text goes to an offset-indexed text store; Chroma keeps only ids, embeddings and metadata
+        collection = client.create_collection(name=CHROMA_COLLECTION_NAME, metadata={
+            EMBEDDING_MODEL_KEY: EMBEDDING_MODEL_NAME,
+            TEXT_STORE_KEY: text_store_path(CHROMA_PERSIST_PATH, CHROMA_COLLECTION_NAME),
+        })
+        reset_live_collection(CHROMA_PERSIST_PATH, CHROMA_COLLECTION_NAME)
+        print_deduplication(documents_before, len(docs_to_embed))
 
         print("Generating document embeddings for Chroma...")
-        document_embeddings = genai.embed_content(
+        document_embeddings = metered_embed_content(
+            stage="embed_documents",
             model=EMBEDDING_MODEL_NAME,
             content=docs_to_embed,
             task_type="RETRIEVAL_DOCUMENT"
         )['embedding']
 
-        collection.add(
+        add_documents(
+            collection,
+            ids=ids_to_store,
             embeddings=document_embeddings,
             documents=docs_to_embed,
-            metadatas=metadatas_to_store,
-            ids=ids_to_store
+            metadatas=metadatas_to_store
         )
         print(f"Added {len(ids_to_store)} documents to Chroma collection '{CHROMA_COLLECTION_NAME}'.")
     
@@ -108,7 +145,10 @@ def setup_chroma_collection():
 
 # --- Main Q&A Bot Logic ---
 def run_qna_bot():
+    start_metrics_server() # Only if METRICS_PORT is set
     chroma_collection = setup_chroma_collection()
+    query_embedding_model = collection_embedding_model(chroma_collection, EMBEDDING_MODEL_NAME) # Must match the stored documents
+    text_store = collection_text_store(chroma_collection) # None for collections that keep their text in Chroma
 
     safety_settings_config = [
         {"category": HarmCategory.HARM_CATEGORY_HARASSMENT, "threshold": HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE},
@@ -117,13 +157,21 @@ def run_qna_bot():
         {"category": HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT, "threshold": HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE}, # Stricter now
     ]
 
-    generative_model_instance = genai.GenerativeModel(
-        GENERATIVE_MODEL_NAME,
-        safety_settings=safety_settings_config,
-        tools=[get_document_summary] # Provide the function for automatic calling
+    # GENERATIVE_MODEL_NAME first; fallbacks (same safety settings and tools) take over when it breaches its SLO
+    model_router = ModelRouter(
+        routes=[(GENERATIVE_MODEL_NAME, GENERATION_LATENCY_SLO)] + [route for route in DEFAULT_ROUTES if route[0] != GENERATIVE_MODEL_NAME],
+        model_factory=lambda model_name: genai.GenerativeModel(
+            model_name,
+            safety_settings=safety_settings_config,
+            tools=[get_document_summary] # Provide the function for automatic calling
+        )
     )
 
-    chat_session = generative_model_instance.start_chat(enable_automatic_function_calling=True)
+    # Persisted: each turn is appended to the session log, so a restart resumes the conversation
+    session_store = SessionStore()
+    chat_session = session_store.session(os.getenv("CHAT_SESSION_ID", "scientist-qna"), model_router.start_chat, enable_automatic_function_calling=True)
+    prefilter = SafetyPrefilter(safety_settings=safety_settings_config) # Answers known-blocked prompts locally, before any API call
+    context_chars_saved = 0 # Retrieved context not stored in (and so not re-sent with) the chat history
 
     print("\n--- Responsible Document Q&A Bot ---")
     print("Ask me questions about Marie Curie, Nikola Tesla, or Ada Lovelace.")
@@ -163,62 +211,79 @@ def run_qna_bot():
         # If it doesn't use the function, its response will be based on its general knowledge.
 
         # Send user input, LLM might use a tool OR answer from general knowledge
-        try:
-            llm_response = chat_session.send_message(user_input)
+        turn_start = time.perf_counter()
+        with TRACER.span("qna_turn", user_chars=len(user_input)) as turn_span:
+            try:
+                llm_response, decision = prefilter.guard(user_input, lambda: chat_session.send_message(user_input, stage="chat_tool_turn"))
+                turn_span.set(prefilter_layer=decision.layer)
+                if llm_response is None:
+                    print(f"Bot: {prefilter.refusal}")
+                    print("-" * 50)
+                    continue
             
-            # If the LLM didn't use the function call (indicated by no specific print from our function)
-            # and the answer seems generic or "I don't know", we can then try RAG.
-            # For this example, we'll make the RAG step more explicit if no tool was used.
-            # A more sophisticated agent would have a loop here.
-
-            # We need to inspect the llm_response to see if a function was called.
-            # The chat_session.history will show the function call and response parts if it happened.
-            called_function_this_turn = False
-            if len(chat_session.history) > 1: # Need at least user input and model response
-                last_model_turn = chat_session.history[-1] # The model's most recent complete turn
-                if last_model_turn.role == 'model':
-                    for part in last_model_turn.parts:
-                        if hasattr(part, 'function_call') or hasattr(part, 'function_response'): # Check previous parts in history
-                            # A bit tricky to check if *this current interaction* involved an auto-call
-                            # without seeing the intermediate steps which are hidden by auto-mode.
-                            # We rely on our print statement inside get_document_summary for now.
-                            # A better check would be if the response text *is* the summary.
-                            # For simplicity, if the response is short and "No pre-defined summary...", we know tool was tried.
-                            if "No pre-defined summary available for" in llm_response.text or \
-                               any(summary_text in llm_response.text for summary_text in [
-                                   "Marie Curie was a pioneering", "Nikola Tesla was a Serbian-American", "Ada Lovelace was an English mathematician"
-                               ]):
-                                called_function_this_turn = True
+                # If the LLM didn't use the function call (indicated by no specific print from our function)
+                # and the answer seems generic or "I don't know", we can then try RAG.
+                # For this example, we'll make the RAG step more explicit if no tool was used.
+                # A more sophisticated agent would have a loop here.
+
+                # We need to inspect the llm_response to see if a function was called.
+                # The chat_session.history will show the function call and response parts if it happened.
+                called_function_this_turn = False
+                if len(chat_session.history) > 1: # Need at least user input and model response
+                    last_model_turn = chat_session.history[-1] # The model's most recent complete turn
+                    if last_model_turn.role == 'model':
+                        for part in last_model_turn.parts:
+                            if hasattr(part, 'function_call') or hasattr(part, 'function_response'): # Check previous parts in history
+                                # A bit tricky to check if *this current interaction* involved an auto-call
+                                # without seeing the intermediate steps which are hidden by auto-mode.
+                                # We rely on our print statement inside get_document_summary for now.
+                                # A better check would be if the response text *is* the summary.
+                                # For simplicity, if the response is short and "No pre-defined summary...", we know tool was tried.
+                                if "No pre-defined summary available for" in llm_response.text or \
+                                   any(summary_text in llm_response.text for summary_text in [
+                                       "Marie Curie was a pioneering", "Nikola Tesla was a Serbian-American", "Ada Lovelace was an English mathematician"
+                                   ]):
+                                    called_function_this_turn = True
             
-            # If a function was called and provided a summary, we print its response.
-            # If not, or if the user asked a general question, we proceed to RAG.
-            if called_function_this_turn:
-                print(f"Bot: {llm_response.text}") # This is the LLM's response after using the tool
-            else:
-                # --- Perform RAG if no function was called or if LLM didn't answer well ---
-                print("Bot: (Didn't use summary tool, attempting RAG...)")
-                query_embedding = genai.embed_content(
-                    model=EMBEDDING_MODEL_NAME,
-                    content=user_input,
-                    task_type="RETRIEVAL_QUERY"
-                )['embedding']
-
-                rag_results = chroma_collection.query(
-                    query_embeddings=[query_embedding],
-                    n_results=2 # Get top 2
-                )
-                retrieved_docs = rag_results.get('documents', [[]])[0]
-
-                if not retrieved_docs:
-                    context_for_llm = "No specific context found in documents."
+                # If a function was called and provided a summary, we print its response.
+                # If not, or if the user asked a general question, we proceed to RAG.
+                if called_function_this_turn:
+                    print(f"Bot: {llm_response.text}") # This is the LLM's response after using the tool
                 else:
-                    context_for_llm = "\n\n".join(retrieved_docs)
-
-                # Now, send a new message to the chat session WITH the RAG context.
-                # The LLM will use this context. It still has access to tools if relevant.
-                rag_augmented_input = f"""Please answer the following user question based ONLY on the provided context.
+                    # --- Perform RAG if no function was called or if LLM didn't answer well ---
+                    print("Bot: (Didn't use summary tool, attempting RAG...)")
+                    query_embedding = metered_embed_content(
+                        stage="embed_query",
+                        model=query_embedding_model,
+                        content=user_input,
+                        task_type="RETRIEVAL_QUERY"
+                    )['embedding']
+
+                    with TRACER.span("retrieve", top_k=DEFAULT_FETCH_K) as retrieve_span:
+                        rag_candidates = chroma_collection.query(
+                            query_embeddings=[query_embedding],
+                            n_results=DEFAULT_FETCH_K, # Over-fetch, then keep a diverse top 2
+                            include=['metadatas', 'distances', 'embeddings'] + ([] if text_store else ['documents'])
+                        )
+                        retrieve_span.set(documents=len(rag_candidates['ids'][0]))
+
+                    with TRACER.span("rerank", top_k=2, mmr_lambda=DEFAULT_LAMBDA) as rerank_span:
+                        rag_results, rerank_ms = mmr_rerank_results(rag_candidates, query_embedding, 2, DEFAULT_LAMBDA)
+                        if text_store:
+                            fill_documents(rag_results, text_store) # Read only the 2 chunks that go into the prompt
+                        retrieved_docs = rag_results.get('documents', [[]])[0]
+                        rerank_span.set(rerank_ms=rerank_ms, documents=len(retrieved_docs))
+
+                    with TRACER.span("pack_prompt") as pack_span:
+                        if not retrieved_docs:
+                            context_for_llm = "No specific context found in documents."
+                        else:
+                            context_for_llm = "\n\n".join(retrieved_docs)
+
+                        # Now, send a new message to the chat session WITH the RAG context.
+                        # The LLM will use this context. It still has access to tools if relevant.
+                        rag_augmented_input = f"""Please answer the following user question based ONLY on the provided context.
 If the answer is not in the context, state that you don't have enough information from the documents.
-You can still use your 'get_document_summary' tool if the user explicitly asks for a summary of a known person, even with this context.
 
 Context from Documents:
 {context_for_llm}
@@ -226,13 +291,39 @@ Context from Documents:
 Original User Question: {user_input}
 
 Answer:"""
-                print("Bot: Thinking with RAG context...")
-                final_rag_response = chat_session.send_message(rag_augmented_input)
-                print(f"Bot: {final_rag_response.text}")
-
-        except Exception as e:
-            print(f"Bot: I encountered an issue: {e}")
-            # Potentially log the error or provide a more user-friendly message
+                        pack_span.set(context_chars=len(context_for_llm), prompt_chars=len(rag_augmented_input))
+                    print("Bot: Thinking with RAG context...")
+                    # The retrieved context goes with this request only; the history keeps just the question,
+                    # so later turns don't keep re-sending every earlier context block.
+                    # Streamed, so the answer appears as it is generated (function calling is off for this turn).
+                    final_rag_response = chat_session.send_message(rag_augmented_input, stage="generate_answer", history_content=user_input, stream=True)
+                    print("Bot: ", end="", flush=True)
+                    first_token_seconds = None
+                    for chunk in final_rag_response:
+                        if first_token_seconds is None:
+                            first_token_seconds = time.perf_counter() - turn_start
+                        finish_reason = chunk.candidates[0].finish_reason if chunk.candidates else None
+                        if finish_reason not in CLEAN_FINISH_REASONS: # chunk.text would raise
+                            print(f"\n(answer stopped: {getattr(finish_reason, 'name', 'blocked')})", end="")
+                            break # The router rewinds the broken turn when the stream closes
+                        if chunk.parts:
+                            print(chunk.text, end="", flush=True)
+                    print()
+                    chat_session.flush() # The streamed turn is complete; append it to the session log
+                    turn_span.set(ttft_ms=round((first_token_seconds or 0.0) * 1000, 1))
+                    print(f"(time to first token {(first_token_seconds or 0.0) * 1000:.0f} ms, "
+                          f"answer complete after {(time.perf_counter() - turn_start) * 1000:.0f} ms)")
+                    context_chars_saved += len(rag_augmented_input) - len(user_input)
+                    if final_rag_response.usage_metadata:
+                        print(f"(prompt tokens this turn: {final_rag_response.usage_metadata.prompt_token_count}, "
+                              f"history: {len(chat_session.history)} messages, context kept out of history so far: {context_chars_saved} chars)")
+
+            except Exception as e:
+                print(f"Bot: I encountered an issue: {e}")
+                if chat_session.last is not None: # A stream that didn't finish would break every later history read
+                    chat_session.rewind()
+                chat_session.flush()
+                # Potentially log the error or provide a more user-friendly message
 
         # Safety Feedback (Optional: can be verbose for chat)
         # if llm_response.prompt_feedback: print(f"DEBUG: Prompt Feedback: {llm_response.prompt_feedback}")
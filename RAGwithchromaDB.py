@@ -1,8 +1,18 @@
 import google.generativeai as genai
 from dotenv import load_dotenv
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 import chromadb # Import Chroma
 import uuid # To generate unique IDs for documents
+from usageMetrics import metered_embed_content, metered_generate_content, start_metrics_server, CLEAN_FINISH_REASONS
+from pipelineTracing import TRACER # Enable with TRACE_PATH=trace.json
+from mmrRerank import mmr_rerank_results, DEFAULT_FETCH_K
+from partitionRouter import PartitionRouter, centroids_path
+from reindexEmbeddings import live_collection_name, reset_live_collection, collection_embedding_model, EMBEDDING_MODEL_KEY
+from cachedContext import CorpusContextCache
+from documentTextStore import TEXT_STORE_KEY, text_store_path, collection_text_store, add_documents, fill_documents
+from nearDuplicates import deduplicate_chunks, print_deduplication
 
 load_dotenv()
 
@@ -11,11 +21,19 @@ try:
     if not api_key:
         raise ValueError("GOOGLE_API_KEY not found.")
     genai.configure(api_key=api_key)
+    start_metrics_server() # Only if METRICS_PORT is set
 
     # --- 0. Configuration ---
     embedding_model_name = "text-embedding-004"
     generative_model_name = 'gemini-1.5-flash-latest'
     collection_name = "rag_eiffel_japan_collection" # Name for our Chroma collection
+    chroma_persist_path = "./chroma_db_store"
+    top_k = 2 # Chunks that go into the prompt
+    fetch_k = DEFAULT_FETCH_K # Candidates over-fetched for MMR re-ranking (same as run_qna_bot)
+    mmr_lambda = 0.5 # 1.0 = pure relevance, lower = more diverse context
+    use_cached_context = os.getenv("CACHED_CONTEXT") == "1" # Answer from the whole corpus (no retrieval) while it is small
+    stream_answers = True # Print the answer as it is generated
+    prefetch_depth = 1 # Queries whose embedding + retrieval run ahead while an answer streams (0 = sequential)
 
     # --- 1. Our "Knowledge Base" ---
     documents_kb = [ # Renamed to avoid conflict with chromadb 'documents' parameter
@@ -31,13 +49,18 @@ try:
     metadatas_kb = [{"doc_id": f"doc_{i+1}", "topic": "eiffel" if "eiffel" in doc.lower() else ("japan" if "japan" in doc.lower() else "other")} for i, doc in enumerate(documents_kb)]
     ids_kb = [str(uuid.uuid4()) for _ in documents_kb] # Generate unique IDs
 
+    # Near-duplicate chunks are dropped before embedding; each kept chunk records the doc_ids it absorbed
+    chunks_before = len(documents_kb)
+    documents_kb, metadatas_kb, ids_kb = deduplicate_chunks(documents_kb, metadatas_kb, ids_kb, sources=[m["doc_id"] for m in metadatas_kb])
+    print_deduplication(chunks_before, len(documents_kb))
+
     print(f"Knowledge Base has {len(documents_kb)} documents.\n")
 
     # --- Phase 1: Indexing with ChromaDB ---
     print("--- Initializing ChromaDB Client and Collection ---")
     # Create a persistent client (stores data on disk in a 'chroma_db' directory)
     # Or use: client = chromadb.Client() for an in-memory client (data lost on script exit)
-    client = chromadb.PersistentClient(path="./chroma_db_store") # Data will be saved in this folder
+    client = chromadb.PersistentClient(path=chroma_persist_path) # Data will be saved in this folder
 
     # Get or create the collection.
     # Chroma can automatically handle embedding generation if you provide an embedding function
@@ -49,8 +72,11 @@ try:
     # A real app would use get_or_create_collection and then potentially update/upsert logic.
     # For simplicity, let's try to get it, and if it fails (e.g. not found), create it.
     try:
-        collection = client.get_collection(name=collection_name)
-        print(f"Retrieved existing collection: '{collection_name}' with {collection.count()} items.")
+        # The alias file picks the live physical collection (it changes after a re-index)
+        collection = client.get_collection(name=live_collection_name(chroma_persist_path, collection_name))
+        # Queries must be embedded with the same model as the stored documents
+        embedding_model_name = collection_embedding_model(collection, embedding_model_name)
+        print(f"Retrieved existing collection: '{collection.name}' ({embedding_model_name}) with {collection.count()} items.")
         # If collection exists, we might want to skip adding documents if they are already there
         # For this example, if it exists and is not empty, we assume it's populated.
         # A more robust check would involve checking if specific IDs exist.
@@ -58,39 +84,54 @@ try:
              print("Collection exists but is empty. Populating...")
              # Generate embeddings for our documents
              print("Generating document embeddings for Chroma...")
-             document_embeddings_for_chroma = genai.embed_content(
+             document_embeddings_for_chroma = metered_embed_content(
+                stage="embed_documents",
                 model=embedding_model_name,
                 content=documents_kb,
                 task_type="RETRIEVAL_DOCUMENT"
              )['embedding']
-             collection.add(
+             add_documents(
+                collection,
+                ids=ids_kb,
                 embeddings=document_embeddings_for_chroma,
                 documents=documents_kb,
-                metadatas=metadatas_kb,
-                ids=ids_kb
+                metadatas=metadatas_kb
              )
              print(f"Added {len(ids_kb)} documents to Chroma collection '{collection_name}'.")
 
     except Exception as e: # Catches if collection doesn't exist or other issues
         print(f"Collection '{collection_name}' not found or error: {e}. Creating and populating...")
-        collection = client.create_collection(name=collection_name) # Add metadata for embedding function if Chroma handles it
+        # Record the embedding model; the text goes to an offset-indexed store, not into Chroma
+        collection = client.create_collection(name=collection_name, metadata={
+            EMBEDDING_MODEL_KEY: embedding_model_name,
+            TEXT_STORE_KEY: text_store_path(chroma_persist_path, collection_name),
+        })
+        reset_live_collection(chroma_persist_path, collection_name)
         
         print("Generating document embeddings for Chroma...")
-        document_embeddings_for_chroma = genai.embed_content(
+        document_embeddings_for_chroma = metered_embed_content(
+            stage="embed_documents",
             model=embedding_model_name,
             content=documents_kb,
             task_type="RETRIEVAL_DOCUMENT"
         )['embedding']
 
-        collection.add(
+        add_documents(
+            collection,
+            ids=ids_kb,                   # Unique IDs for each document
             embeddings=document_embeddings_for_chroma, # We provide the embeddings
-            documents=documents_kb,       # The text content
-            metadatas=metadatas_kb,       # Associated metadata
-            ids=ids_kb                    # Unique IDs for each document
+            documents=documents_kb,       # The text content (kept in the text store)
+            metadatas=metadatas_kb        # Associated metadata
         )
         print(f"Added {len(ids_kb)} documents to Chroma collection '{collection_name}'.")
 
     print(f"Chroma collection '{collection_name}' now has {collection.count()} items.\n")
+    text_store = collection_text_store(collection) # None for collections that keep their text in Chroma
+
+    # Per-topic centroids (saved next to the collection) route each query to its topic partition
+    router = PartitionRouter.load_or_build(collection, "topic", centroids_path(chroma_persist_path, collection.name, "topic"))
+    print(f"Routing queries across topic partitions: {router.partitions}\n")
+    context_cache = CorpusContextCache() if use_cached_context else None
 
 
     # --- Phase 2: Retrieval and Generation (For a User Query) ---
@@ -101,45 +142,98 @@ try:
         "What is the capital of Germany?" # Not in our KB
     ]
 
-    for user_query in queries_to_test:
-        print(f"\n--- Processing User Query: \"{user_query}\" ---")
+    def retrieve(user_query):
+        """Embeds, routes and re-ranks one query. Runs on the prefetch thread, so it doesn't print."""
+        start = time.perf_counter()
+        with TRACER.span("prefetch", query=user_query):
+            # 1. Embed the User Query
+            query_embedding = metered_embed_content(
+                stage="embed_query",
+                model=embedding_model_name,
+                content=user_query,
+                task_type="RETRIEVAL_QUERY"
+            )['embedding']
 
-        # 1. Embed the User Query
-        print("Embedding user query...")
-        query_embedding = genai.embed_content(
-            model=embedding_model_name,
-            content=user_query,
-            task_type="RETRIEVAL_QUERY"
-        )['embedding']
+            # 2. Semantic Search with ChromaDB
+            # Chroma returns a dictionary with lists for 'ids', 'documents', 'metadatas', 'distances' (or 'similarities')
+            # The router adds a `where` filter for the query's topic, or searches globally when unsure.
+            with TRACER.span("retrieve", top_k=fetch_k) as retrieve_span:
+                candidates, route = router.query(
+                    collection,
+                    query_embedding,
+                    n_results=fetch_k,
+                    include=['metadatas', 'distances', 'embeddings'] + ([] if text_store else ['documents']) # Embeddings are needed for MMR
+                )
+                retrieve_span.set(documents=len(candidates['ids'][0]), partitions=str(route["partitions"]), route_confidence=route["confidence"])
 
-        # 2. Semantic Search with ChromaDB
-        print("Querying ChromaDB...")
-        top_k = 2
-        # Query ChromaDB. We provide the query_embedding.
-        # Chroma returns a dictionary with lists for 'ids', 'documents', 'metadatas', 'distances' (or 'similarities')
-        results = collection.query(
-            query_embeddings=[query_embedding], # Chroma expects a list of query embeddings
-            n_results=top_k,
-            # include=['documents', 'metadatas', 'distances'] # Specify what to return
-        )
+            # Re-rank the candidates with MMR so near-duplicate chunks don't fill both slots
+            with TRACER.span("rerank", fetch_k=fetch_k, top_k=top_k, mmr_lambda=mmr_lambda) as rerank_span:
+                results, rerank_ms = mmr_rerank_results(candidates, query_embedding, top_k, mmr_lambda)
+                rerank_span.set(rerank_ms=rerank_ms)
+                if text_store:
+                    fill_documents(results, text_store) # Read only the top_k texts that go into the prompt
+        return results, route, rerank_ms, time.perf_counter() - start
+
+    # Retrieval for the next queries runs on this thread while the current answer streams.
+    prefetch_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rag-prefetch")
+    prefetched = {} # query index -> Future of retrieve(...)
+
+    def prefetch(index):
+        if index < len(queries_to_test) and index not in prefetched:
+            prefetched[index] = prefetch_pool.submit(retrieve, queries_to_test[index])
 
-        retrieved_chroma_documents = results.get('documents', [[]])[0] # Get the list of document texts for the first query
-        retrieved_chroma_metadatas = results.get('metadatas', [[]])[0]
-        retrieved_chroma_distances = results.get('distances', [[]])[0] # Chroma often returns distances (lower is better)
+    generative_model = genai.GenerativeModel(generative_model_name)
+    # Add safety settings to the generative model if desired
+    # generative_model.safety_settings = ...
+    timings = [] # (query, time to first token, total seconds)
+    retrieval_seconds = retrieval_wait_seconds = 0.0
+    loop_start = time.perf_counter()
 
-        print("\n--- Retrieved Top-K Relevant Chunks from ChromaDB ---")
-        if not retrieved_chroma_documents:
-            print("No relevant documents found in ChromaDB.")
-        for i, doc_text in enumerate(retrieved_chroma_documents):
-            print(f"Chunk {i+1} (Distance: {retrieved_chroma_distances[i]:.4f}): \"{doc_text}\" (Metadata: {retrieved_chroma_metadatas[i]})")
+    for query_index, user_query in enumerate(queries_to_test):
+        query_start = time.perf_counter()
+        with TRACER.span("rag_query", query=user_query) as request_span:
+            print(f"\n--- Processing User Query: \"{user_query}\" ---")
 
-        # 3. Augment Prompt (Stuff Context)
-        if not retrieved_chroma_documents:
-            context_for_llm = "No specific context found."
-        else:
-            context_for_llm = "\n".join(retrieved_chroma_documents)
+            # Small corpus: answer against the cached corpus and skip retrieval entirely.
+            # The collection size is re-checked every query, so a grown corpus falls back to RAG.
+            if context_cache and context_cache.sync_from_collection(collection) != "rag":
+                with TRACER.span("cached_context", mode=context_cache.mode) as cache_span:
+                    final_response = context_cache.generate_content(user_query)
+                    cache_span.set(prompt_tokens=final_response.usage_metadata.prompt_token_count)
+                print(f"\n--- Final Answer from LLM (cached context, {context_cache.mode}) ---")
+                print(final_response.text)
+                print("-" * 50)
+                timings.append((user_query, time.perf_counter() - query_start, time.perf_counter() - query_start))
+                continue
 
-        augmented_prompt = f"""You are a helpful AI assistant. Answer the user's question based ONLY on the following context.
+            print("Embedding and querying ChromaDB..." if query_index not in prefetched else "Using prefetched retrieval...")
+            prefetch(query_index)
+            wait_start = time.perf_counter()
+            results, route, rerank_ms, seconds = prefetched.pop(query_index).result()
+            retrieval_wait_seconds += time.perf_counter() - wait_start
+            retrieval_seconds += seconds
+            for next_index in range(query_index + 1, query_index + 1 + prefetch_depth):
+                prefetch(next_index)
+            print(f"Routed to partition(s) {route['partitions']} (confidence {route['confidence']:.2f}, searched {route['search_fraction']:.0%} of the collection)")
+
+            retrieved_chroma_documents = results.get('documents', [[]])[0] # Get the list of document texts for the first query
+            retrieved_chroma_metadatas = results.get('metadatas', [[]])[0]
+            retrieved_chroma_distances = results.get('distances', [[]])[0] # Chroma often returns distances (lower is better)
+
+            print(f"\n--- Retrieved Top-K Relevant Chunks from ChromaDB (MMR over {fetch_k} candidates, {rerank_ms:.2f} ms) ---")
+            if not retrieved_chroma_documents:
+                print("No relevant documents found in ChromaDB.")
+            for i, doc_text in enumerate(retrieved_chroma_documents):
+                print(f"Chunk {i+1} (Distance: {retrieved_chroma_distances[i]:.4f}): \"{doc_text}\" (Metadata: {retrieved_chroma_metadatas[i]})")
+
+            # 3. Augment Prompt (Stuff Context)
+            with TRACER.span("pack_prompt") as pack_span:
+                if not retrieved_chroma_documents:
+                    context_for_llm = "No specific context found."
+                else:
+                    context_for_llm = "\n".join(retrieved_chroma_documents)
+
+                augmented_prompt = f"""You are a helpful AI assistant. Answer the user's question based ONLY on the following context.
 If the answer is not found in the context or the context is 'No specific context found.', say "I don't have enough information from the provided documents to answer that."
 
 Context:
@@ -149,19 +243,46 @@ User Question: {user_query}
 
 Answer:
 """
-        print("\n--- Augmented Prompt for LLM ---")
-        # print(augmented_prompt) # Keep it short for cleaner output for now
-
-        # 4. Generate Response using the Generative LLM
-        print("--- Generating Final Answer using LLM ---")
-        generative_model = genai.GenerativeModel(generative_model_name)
-        # Add safety settings to the generative model if desired
-        # generative_model.safety_settings = ...
-        final_response = generative_model.generate_content(augmented_prompt)
-
-        print("\n--- Final Answer from LLM ---")
-        print(final_response.text)
-        print("-" * 50)
+                pack_span.set(context_chars=len(context_for_llm), prompt_chars=len(augmented_prompt))
+
+            # 4. Generate Response using the Generative LLM
+            print("\n--- Final Answer from LLM ---")
+            if stream_answers:
+                response_stream = metered_generate_content(generative_model, augmented_prompt, stage="generate_answer", stream=True)
+                first_token_seconds = None
+                for chunk in response_stream:
+                    if first_token_seconds is None:
+                        first_token_seconds = time.perf_counter() - query_start
+                    finish_reason = chunk.candidates[0].finish_reason if chunk.candidates else None
+                    if finish_reason not in CLEAN_FINISH_REASONS: # chunk.text would raise
+                        print(f"\n(answer stopped: {getattr(finish_reason, 'name', 'blocked')})", end="")
+                        break
+                    if chunk.parts:
+                        print(chunk.text, end="", flush=True)
+                print()
+            else:
+                final_response = metered_generate_content(generative_model, augmented_prompt, stage="generate_answer")
+                first_token_seconds = time.perf_counter() - query_start # Nothing is shown before the whole answer
+                print(final_response.text)
+            total_seconds = time.perf_counter() - query_start
+            timings.append((user_query, first_token_seconds if first_token_seconds is not None else total_seconds, total_seconds))
+            request_span.set(ttft_ms=round(timings[-1][1] * 1000, 1))
+            print(f"(time to first token {timings[-1][1] * 1000:.0f} ms, answer complete after {total_seconds * 1000:.0f} ms)")
+            if request_span.trace_id:
+                print(f"(trace id: {request_span.trace_id})")
+            print("-" * 50)
+
+    prefetch_pool.shutdown(wait=True)
+    wall_seconds = time.perf_counter() - loop_start
+    print(f"\n--- Latency ({'streaming' if stream_answers else 'non-streaming'}, prefetch depth {prefetch_depth}) ---")
+    for user_query, first_token_seconds, total_seconds in timings:
+        print(f"{user_query[:40]:<40}  TTFT {first_token_seconds * 1000:7.0f} ms  total {total_seconds * 1000:7.0f} ms")
+    print(f"Wall time for {len(timings)} queries: {wall_seconds:.2f}s; retrieval took {retrieval_seconds:.2f}s, "
+          f"of which {max(0.0, retrieval_seconds - retrieval_wait_seconds):.2f}s overlapped with answer streaming")
+
+    router.print_stats()
+    if context_cache:
+        context_cache.close()
 
 except Exception as e:
     print(f"An error occurred: {e}")
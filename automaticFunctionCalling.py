@@ -1,6 +1,7 @@
 import google.generativeai as genai
 from dotenv import load_dotenv
 import os
+from modelRouter import ModelRouter
 import json
 
 # 1. Define your Python function(s)
@@ -55,14 +56,15 @@ try:
         raise ValueError("GOOGLE_API_KEY not found.")
     genai.configure(api_key=api_key)
 
-    model = genai.GenerativeModel(
-        'gemini-1.5-flash-latest',
+    # Every fallback model gets the same tools
+    router = ModelRouter(model_factory=lambda model_name: genai.GenerativeModel(
+        model_name,
         # Pass the Python function(s) directly in a list.
         # The SDK will use these for execution and often try to infer their schema.
         tools=[get_current_weather]
-    )
+    ))
 
-    chat = model.start_chat(enable_automatic_function_calling=True)
+    chat = router.start_chat(enable_automatic_function_calling=True)
 
     print("AUTOMATIC Function Calling Chat. Ask about the weather. Type 'quit' to end.")
     print("-" * 30)
@@ -0,0 +1,240 @@
+import google.generativeai as genai
+from google.generativeai import caching
+from dotenv import load_dotenv
+import argparse
+import datetime
+import hashlib
+import os
+import time
+
+from usageMetrics import metered_embed_content, metered_generate_content
+from documentTextStore import collection_text_store, collection_documents, fill_documents, TEXT_HASH_KEY
+
+# --- Configuration ---
+# Small, hot corpora are answered from the whole corpus held as context, with no
+# per-question embedding or vector query. Larger corpora go back to retrieval.
+GENERATIVE_MODEL_NAME = 'gemini-1.5-flash-latest'
+CACHE_MODEL_NAME = "models/gemini-1.5-flash-002" # Server-side caching needs an explicit model version
+DEFAULT_MAX_CORPUS_TOKENS = 8000 # Local stand-in (corpus re-sent with every question) up to this size
+DEFAULT_MAX_SERVER_CACHE_TOKENS = 200_000 # Server-side cache (billed at the cached rate) up to this size
+SERVER_CACHE_MIN_TOKENS = 32768 # The API rejects smaller cached contents; below this a local stand-in is used
+RECHECK_SECONDS = 60 # Full change-marker scan at most this often; a count change is caught on every query
+SIZE_SAMPLE = 20 # Documents read to estimate the corpus size before reading all of it
+DEFAULT_TTL_SECONDS = 3600
+CHARS_PER_TOKEN = 4 # Same estimate the chunker uses
+
+SYSTEM_INSTRUCTION = """You are a helpful AI assistant. Answer the user's question based ONLY on the documents below.
+If the answer is not found in them, say "I don't have enough information from the provided documents to answer that."
+
+Documents:
+"""
+
+
+def estimate_tokens(texts):
+    return sum(len(text) for text in texts) // CHARS_PER_TOKEN
+
+
+def corpus_marker(collection):
+    """
+    Cheap change marker for a collection: a hash of its ids and each document's
+    TEXT_HASH_KEY metadata. Reads ids and metadata only, never the document text.
+    """
+    data = collection.get(include=["metadatas"])
+    digest = hashlib.sha256()
+    for doc_id, metadata in sorted(zip(data["ids"], data["metadatas"]), key=lambda pair: pair[0]):
+        digest.update(f"{doc_id}\x00{(metadata or {}).get(TEXT_HASH_KEY, '')}\x00".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class CorpusContextCache:
+    """
+    Holds a whole corpus as model context.
+
+    Corpora of SERVER_CACHE_MIN_TOKENS up to max_server_cache_tokens are uploaded once as
+    CachedContent with a TTL (cached tokens are billed at a reduced rate). Smaller ones,
+    up to max_corpus_tokens, use a local stand-in: a model with the corpus as its system
+    instruction, which still skips retrieval but re-sends the corpus with each question.
+    Anything else goes to retrieval ("rag").
+
+    Args:
+        max_corpus_tokens (int): Largest corpus held by the local stand-in.
+        max_server_cache_tokens (int): Largest corpus uploaded as CachedContent (0 disables
+                                       server-side caching).
+        ttl_seconds (int): Lifetime of the cache (and of a "rag" decision); it is
+                           recreated on first use after expiry.
+    """
+
+    def __init__(self, max_corpus_tokens=DEFAULT_MAX_CORPUS_TOKENS, max_server_cache_tokens=DEFAULT_MAX_SERVER_CACHE_TOKENS,
+                 ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.max_corpus_tokens = max_corpus_tokens
+        self.max_server_cache_tokens = max_server_cache_tokens
+        self.ttl_seconds = ttl_seconds
+        self.documents = []
+        self.fingerprint = None
+        self.marker = None # corpus_marker() of the collection the corpus was last read from
+        self.document_count = None
+        self.checked_at = 0.0
+        self.model = None
+        self.server_cache = None
+        self.expires_at = 0.0
+        self.mode = "rag"
+
+    def _mode_for(self, tokens):
+        if SERVER_CACHE_MIN_TOKENS <= tokens <= self.max_server_cache_tokens:
+            return "server_cache"
+        return "local_cache" if tokens <= self.max_corpus_tokens else "rag"
+
+    def _use_rag(self):
+        self._drop_server_cache()
+        self.documents, self.model, self.mode = [], None, "rag" # A large corpus isn't kept in memory
+
+    def set_corpus(self, documents):
+        """(Re)builds the cache if the corpus changed. Returns the mode: "server_cache", "local_cache" or "rag"."""
+        fingerprint = hashlib.sha256("\x00".join(documents).encode("utf-8")).hexdigest()
+        if fingerprint == self.fingerprint and time.time() < self.expires_at:
+            return self.mode
+        self._drop_server_cache()
+        self.documents = list(documents)
+        self.fingerprint = fingerprint
+        self.expires_at = time.time() + self.ttl_seconds
+        tokens = estimate_tokens(self.documents)
+        mode = self._mode_for(tokens)
+        if mode == "rag":
+            self._use_rag()
+            return self.mode
+
+        instruction = SYSTEM_INSTRUCTION + "\n\n".join(self.documents)
+        if mode == "server_cache":
+            try:
+                self.server_cache = caching.CachedContent.create(
+                    model=CACHE_MODEL_NAME,
+                    display_name=f"corpus-{fingerprint[:12]}",
+                    system_instruction=instruction,
+                    ttl=datetime.timedelta(seconds=self.ttl_seconds),
+                )
+                self.model = genai.GenerativeModel.from_cached_content(cached_content=self.server_cache)
+                self.mode = "server_cache"
+                return self.mode
+            except Exception as e:
+                print(f"Server-side context cache unavailable ({e}); using the local stand-in if the corpus fits.")
+                self.server_cache = None
+                if tokens > self.max_corpus_tokens:
+                    self._use_rag()
+                    return self.mode
+        self.model = genai.GenerativeModel(GENERATIVE_MODEL_NAME, system_instruction=instruction)
+        self.mode = "local_cache"
+        return self.mode
+
+    def sync_from_collection(self, collection):
+        """
+        Re-reads the corpus when documents were added, deleted or re-embedded with new
+        text (see corpus_marker), or when the cache expired.
+
+        Cheap per query: only count() runs on every call, the full marker scan at most
+        every RECHECK_SECONDS, and a corpus whose estimated size (count x average size
+        of a SIZE_SAMPLE sample) is too large for caching goes to "rag" without its
+        text being read.
+        """
+        now = time.time()
+        count = collection.count()
+        if count == self.document_count and now < min(self.checked_at + RECHECK_SECONDS, self.expires_at):
+            return self.mode
+        self.checked_at = now
+        marker = corpus_marker(collection)
+        if marker == self.marker and count == self.document_count and now < self.expires_at:
+            return self.mode
+        self.marker, self.document_count = marker, count
+        sample = collection_documents(collection, collection.get(limit=SIZE_SAMPLE, include=[])["ids"])[1]
+        if self._mode_for(estimate_tokens(sample) * count // max(1, len(sample))) == "rag":
+            self.fingerprint, self.expires_at = None, now + self.ttl_seconds
+            self._use_rag()
+            return self.mode
+        self.set_corpus(collection_documents(collection)[1])
+        return self.mode
+
+    @property
+    def active(self):
+        return self.mode != "rag"
+
+    def generate_content(self, question, stage="generate_cached_context", **kwargs):
+        if not self.active:
+            raise RuntimeError("Corpus is too large for cached-context mode; use retrieval.")
+        if time.time() >= self.expires_at:
+            self.fingerprint = None # Force re-creation of the expired cache
+            self.set_corpus(self.documents)
+        return metered_generate_content(self.model, question, stage=stage, **kwargs)
+
+    def _drop_server_cache(self):
+        if self.server_cache is not None:
+            try:
+                self.server_cache.delete()
+            except Exception:
+                pass # It may already have expired
+            self.server_cache = None
+
+    def close(self):
+        self._drop_server_cache()
+
+
+# --- Comparison with RAG ---
+def _rag_turn(collection, model, question, embedding_model_name, top_k=2):
+    query_embedding = metered_embed_content(stage="embed_query", model=embedding_model_name, content=question, task_type="RETRIEVAL_QUERY")['embedding']
+    results = collection.query(query_embeddings=[query_embedding], n_results=top_k)
+    text_store = collection_text_store(collection)
+    if text_store:
+        fill_documents(results, text_store)
+    context = "\n".join(results.get('documents', [[]])[0]) or "No specific context found."
+    prompt = f"{SYSTEM_INSTRUCTION}{context}\n\nUser Question: {question}\n\nAnswer:\n"
+    return metered_generate_content(model, prompt, stage="generate_answer")
+
+
+def compare_with_rag(collection, questions, cache, embedding_model_name):
+    """Runs every question through RAG and through the cached context; prints latency and tokens per turn."""
+    rag_model = genai.GenerativeModel(GENERATIVE_MODEL_NAME)
+    print(f"\n--- Cached context ({cache.mode}) vs RAG ---")
+    print("question | rag_ms | cached_ms | rag_prompt_tokens | cached_prompt_tokens | cached_content_tokens")
+    totals = [0.0, 0.0, 0, 0]
+    for question in questions:
+        start = time.perf_counter()
+        rag = _rag_turn(collection, rag_model, question, embedding_model_name)
+        rag_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        cached = cache.generate_content(question)
+        cached_ms = (time.perf_counter() - start) * 1000
+        rag_tokens = rag.usage_metadata.prompt_token_count
+        cached_tokens = cached.usage_metadata.prompt_token_count
+        cached_content_tokens = getattr(cached.usage_metadata, "cached_content_token_count", 0)
+        print(f"{question[:40]} | {rag_ms:.0f} | {cached_ms:.0f} | {rag_tokens} | {cached_tokens} | {cached_content_tokens}")
+        totals = [totals[0] + rag_ms, totals[1] + cached_ms, totals[2] + rag_tokens, totals[3] + cached_tokens]
+    n = len(questions)
+    print(f"Average latency: RAG {totals[0] / n:.0f} ms, cached context {totals[1] / n:.0f} ms")
+    print(f"Average prompt tokens: RAG {totals[2] / n:.0f}, cached context {totals[3] / n:.0f} "
+          f"({'billed at the cached rate' if cache.mode == 'server_cache' else 'local stand-in: corpus re-sent each turn'})")
+
+
+if __name__ == "__main__":
+    import chromadb
+    from reindexEmbeddings import live_collection_name, collection_embedding_model
+
+    parser = argparse.ArgumentParser(description="Compare cached-context answering with RAG on a persisted collection.")
+    parser.add_argument("--store", default="./chroma_db_store")
+    parser.add_argument("--collection", default="rag_eiffel_japan_collection")
+    parser.add_argument("--max-corpus-tokens", type=int, default=DEFAULT_MAX_CORPUS_TOKENS, help="Largest corpus for the local stand-in")
+    parser.add_argument("--max-server-cache-tokens", type=int, default=DEFAULT_MAX_SERVER_CACHE_TOKENS,
+                        help="Largest corpus uploaded as CachedContent (0 disables server-side caching)")
+    parser.add_argument("questions", nargs="*", default=["How tall is the Eiffel Tower?", "What currency is used in Japan?", "Who designed the Eiffel Tower?"])
+    args = parser.parse_args()
+
+    load_dotenv()
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if api_key:
+        genai.configure(api_key=api_key)
+
+    client = chromadb.PersistentClient(path=args.store)
+    collection = client.get_collection(live_collection_name(args.store, args.collection))
+    cache = CorpusContextCache(max_corpus_tokens=args.max_corpus_tokens, max_server_cache_tokens=args.max_server_cache_tokens)
+    mode = cache.sync_from_collection(collection)
+    print(f"Corpus: {collection.count()} documents, ~{estimate_tokens(cache.documents)} tokens -> mode '{mode}'")
+    if cache.active:
+        compare_with_rag(collection, args.questions, cache, collection_embedding_model(collection, "text-embedding-004"))
+    cache.close()
@@ -0,0 +1,340 @@
+from google.generativeai import protos
+import argparse
+import collections
+import json
+import os
+import re
+import struct
+import time
+
+# --- Configuration ---
+# Each session is an append-only log (<id>.log) of length-prefixed, protobuf-encoded
+# messages plus a snapshot (<id>.snap) of the full history and the log offset it covers. A turn only
+# appends its new messages; every SNAPSHOT_EVERY messages the history is snapshotted
+# so a resume reads one snapshot and a short log tail instead of replaying everything.
+# Scripts can keep a small JSON sidecar (<id>.json) with a session, e.g. the content
+# hashes of uploaded files its history refers to.
+SESSION_DIR = "./.chat_sessions"
+SNAPSHOT_EVERY = 50 # Messages appended between snapshots
+IDLE_SECONDS = 600.0 # Resident sessions unused this long are evicted from memory
+MAX_RESIDENT = 1000 # Least recently used sessions beyond this are evicted
+
+_SESSION_ID = re.compile(r"^[A-Za-z0-9_.-]{1,128}$")
+
+
+_LENGTH = struct.Struct("<I")
+_OFFSET = struct.Struct("<Q")
+
+
+def encode_messages(messages):
+    """Length-prefixed binary records (much faster to parse on resume than JSON)."""
+    records = []
+    for message in messages:
+        data = protos.Content.serialize(message)
+        records.append(_LENGTH.pack(len(data)) + data)
+    return b"".join(records)
+
+
+def decode_messages(data):
+    """
+    Parses records until the data runs out; an incomplete final record (torn write) is dropped.
+
+    Returns:
+        tuple: (messages, bytes consumed by complete records)
+    """
+    messages, position = [], 0
+    while position + _LENGTH.size <= len(data):
+        (length,) = _LENGTH.unpack_from(data, position)
+        end = position + _LENGTH.size + length
+        if end > len(data):
+            break
+        messages.append(protos.Content.deserialize(data[position + _LENGTH.size:end]))
+        position = end
+    return messages, position
+
+
+class PersistedChat:
+    """
+    A chat session whose history is persisted by a SessionStore.
+
+    Behaves like the wrapped chat (ChatSession or RoutedChat): send_message, history and
+    every other attribute are delegated. New messages are appended to the session log
+    after each non-streaming turn; for streaming turns call flush() once the stream has
+    been consumed (the SDK only adds a streamed answer to the history at that point).
+    After the store evicts the session, the next use reloads it from disk.
+    """
+
+    def __init__(self, store, session_id, start_chat, chat_kwargs):
+        self.store = store
+        self.session_id = session_id
+        self.start_chat = start_chat
+        self.chat_kwargs = chat_kwargs
+        self.chat = None
+        self.persisted = 0 # Messages of chat.history already on disk
+        self.since_snapshot = 0
+        self.last_used = time.monotonic()
+
+    def _live(self):
+        if self.chat is None:
+            history, self.since_snapshot = self.store.load(self.session_id)
+            if not history:
+                history = list(self.chat_kwargs.get("history") or [])
+            self.chat = self.start_chat(**dict(self.chat_kwargs, history=history))
+            if self.persisted == 0 and history and not self.store.exists(self.session_id):
+                self.store.snapshot(self.session_id, self.chat.history) # Seed history of a new session
+            self.persisted = len(self.chat.history)
+        self.last_used = time.monotonic()
+        self.store.touch(self)
+        return self.chat
+
+    def __getattr__(self, name):
+        if name in ("chat", "store"): # Not yet set during construction
+            raise AttributeError(name)
+        return getattr(self._live(), name)
+
+    @property
+    def history(self):
+        return self._live().history
+
+    def send_message(self, content, **kwargs):
+        chat = self._live()
+        self.flush()
+        response = chat.send_message(content, **kwargs)
+        if not kwargs.get("stream"):
+            self.flush()
+        return response
+
+    def flush(self):
+        """Appends messages added since the last flush (or snapshots, if the history was rewritten)."""
+        if self.chat is None:
+            return
+        history = self.chat.history
+        if len(history) < self.persisted: # rewind() or a replaced history
+            self.store.snapshot(self.session_id, history)
+            self.since_snapshot = 0
+        elif len(history) > self.persisted:
+            new_messages = history[self.persisted:]
+            self.since_snapshot += len(new_messages)
+            if self.since_snapshot >= self.store.snapshot_every:
+                self.store.snapshot(self.session_id, history)
+                self.since_snapshot = 0
+            else:
+                self.store.append(self.session_id, new_messages)
+        self.persisted = len(history)
+
+    def replace_history(self, history):
+        """Rewrites the history in place (same length or not) and snapshots it."""
+        chat = self._live()
+        chat.history = history
+        self.store.snapshot(self.session_id, chat.history)
+        self.persisted = len(chat.history)
+        self.since_snapshot = 0
+
+    def evict(self):
+        """Persists and drops the in-memory session; the next use reloads it."""
+        self.flush()
+        self.chat = None
+        self.persisted = 0
+
+
+class SessionStore:
+    """
+    Args:
+        root (str): Directory for the session logs and snapshots.
+        snapshot_every (int): Messages appended between snapshots.
+        idle_seconds (float): Evict sessions idle for longer than this.
+        max_resident (int): Keep at most this many sessions in memory (LRU).
+    """
+
+    def __init__(self, root=SESSION_DIR, snapshot_every=SNAPSHOT_EVERY, idle_seconds=IDLE_SECONDS, max_resident=MAX_RESIDENT):
+        self.root = root
+        self.snapshot_every = snapshot_every
+        self.idle_seconds = idle_seconds
+        self.max_resident = max_resident
+        self.resident = collections.OrderedDict() # session_id -> PersistedChat, least recently used first
+        self.stats = {"loads": 0, "evictions": 0, "snapshots": 0, "appends": 0}
+        os.makedirs(root, exist_ok=True)
+
+    def _paths(self, session_id):
+        if not _SESSION_ID.match(session_id):
+            raise ValueError(f"Invalid session id: {session_id!r}")
+        base = os.path.join(self.root, session_id)
+        return base + ".log", base + ".snap"
+
+    def _metadata_path(self, session_id):
+        return os.path.splitext(self._paths(session_id)[0])[0] + ".json"
+
+    def read_metadata(self, session_id):
+        """The session's JSON sidecar ({} if none)."""
+        path = self._metadata_path(session_id)
+        if not os.path.exists(path):
+            return {}
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def write_metadata(self, session_id, metadata):
+        """Replaces the session's JSON sidecar atomically."""
+        path = self._metadata_path(session_id)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(metadata, f, indent=2)
+        os.replace(path + ".tmp", path)
+
+    def exists(self, session_id):
+        log_path, snapshot_path = self._paths(session_id)
+        return os.path.exists(log_path) or os.path.exists(snapshot_path)
+
+    def sessions(self):
+        return sorted({os.path.splitext(name)[0] for name in os.listdir(self.root) if name.endswith((".log", ".snap"))})
+
+    # --- Disk format ---
+    def append(self, session_id, messages):
+        log_path, _ = self._paths(session_id)
+        with open(log_path, "ab") as f:
+            f.write(encode_messages(messages))
+            f.flush()
+            os.fsync(f.fileno())
+        self.stats["appends"] += 1
+
+    def snapshot(self, session_id, history):
+        """Writes the full history atomically, covering the log up to its current end."""
+        log_path, snapshot_path = self._paths(session_id)
+        log_offset = os.path.getsize(log_path) if os.path.exists(log_path) else 0
+        tmp_path = snapshot_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_OFFSET.pack(log_offset) + encode_messages(history))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, snapshot_path)
+        self.stats["snapshots"] += 1
+
+    def load(self, session_id):
+        """
+        Rebuilds a session's history from its snapshot plus the log tail written after it.
+
+        Returns:
+            tuple: (history as a list of protos.Content, messages in the log tail)
+        """
+        log_path, snapshot_path = self._paths(session_id)
+        history, log_offset = [], 0
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, "rb") as f:
+                data = f.read()
+            (log_offset,) = _OFFSET.unpack_from(data)
+            history, _ = decode_messages(memoryview(data)[_OFFSET.size:])
+        tail = []
+        if os.path.exists(log_path):
+            with open(log_path, "r+b") as f:
+                f.seek(log_offset)
+                data = f.read()
+                tail, consumed = decode_messages(data)
+                if consumed < len(data):
+                    f.truncate(log_offset + consumed) # Drop a torn final write so later appends stay readable
+        self.stats["loads"] += 1
+        return history + tail, len(tail)
+
+    # --- Resident sessions ---
+    def session(self, session_id, start_chat, **chat_kwargs):
+        """
+        Returns the session `session_id`, resumed from disk if it exists.
+
+        Args:
+            start_chat (callable): e.g. model.start_chat or router.start_chat; called with
+                                   history=... when the session is (re)loaded.
+            **chat_kwargs: Passed to start_chat. A `history` here only seeds a new session.
+        """
+        self.evict_idle()
+        chat = self.resident.get(session_id)
+        if chat is None:
+            chat = PersistedChat(self, session_id, start_chat, chat_kwargs)
+        chat._live()
+        return chat
+
+    def touch(self, chat):
+        self.resident[chat.session_id] = chat
+        self.resident.move_to_end(chat.session_id)
+
+    def evict_idle(self):
+        now = time.monotonic()
+        for session_id, chat in list(self.resident.items()):
+            if now - chat.last_used > self.idle_seconds or len(self.resident) > self.max_resident:
+                self.evict(session_id)
+
+    def evict(self, session_id):
+        chat = self.resident.pop(session_id, None)
+        if chat is not None:
+            chat.evict()
+            self.stats["evictions"] += 1
+
+    def close(self):
+        for session_id in list(self.resident):
+            self.evict(session_id)
+
+
+# --- Benchmark ---
+class _LocalChat:
+    """Minimal stand-in for ChatSession (only the history), so the benchmark needs no API key."""
+
+    def __init__(self, history=()):
+        self.history = list(history)
+
+
+def _synthetic_turn(i, chars):
+    return [
+        protos.Content(role="user", parts=[protos.Part(text=f"Question {i}: " + "q" * chars)]),
+        protos.Content(role="model", parts=[protos.Part(text=f"Answer {i}: " + "a" * chars)]),
+    ]
+
+
+def run_benchmark(root, turns=500, chars=400, sessions=200):
+    """Per-turn save cost (log + snapshots vs. rewriting the whole history) and resume / reload time."""
+    import shutil
+    shutil.rmtree(root, ignore_errors=True)
+    store = SessionStore(root)
+    chat = store.session("bench", _LocalChat)
+    append_seconds = rewrite_seconds = 0.0
+    for i in range(turns):
+        chat.history.extend(_synthetic_turn(i, chars))
+        start = time.perf_counter()
+        chat.flush()
+        append_seconds += time.perf_counter() - start
+        start = time.perf_counter()
+        store.snapshot("bench_full_rewrite", chat.history) # The naive approach: save everything every turn
+        rewrite_seconds += time.perf_counter() - start
+    print(f"--- {turns} turns, {chars}-char messages ---")
+    print(f"Save per turn: log + snapshots {append_seconds / turns * 1000:.2f} ms, full rewrite {rewrite_seconds / turns * 1000:.2f} ms")
+
+    start = time.perf_counter()
+    loaded, tail = store.load("bench")
+    print(f"Resume: {len(loaded)} messages ({tail} from the log tail) in {(time.perf_counter() - start) * 1000:.1f} ms")
+    assert loaded == chat.history
+
+    small = SessionStore(root, max_resident=sessions // 4)
+    for s in range(sessions):
+        chat = small.session(f"user{s}", _LocalChat)
+        chat.history.extend(_synthetic_turn(0, chars))
+        chat.flush()
+    start = time.perf_counter()
+    chat = small.session("user0", _LocalChat) # Evicted long ago: reloaded transparently
+    print(f"{sessions} sessions with at most {small.max_resident} resident: {small.stats['evictions']} evictions, "
+          f"reload of an evicted session {(time.perf_counter() - start) * 1000:.2f} ms ({len(chat.history)} messages)")
+    shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect persisted chat sessions or benchmark the session store.")
+    parser.add_argument("--root", default=SESSION_DIR)
+    parser.add_argument("--show", metavar="SESSION_ID", help="Print a session's history")
+    parser.add_argument("--benchmark", action="store_true")
+    parser.add_argument("--turns", type=int, default=500)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        run_benchmark(os.path.join(args.root, "_benchmark"), turns=args.turns)
+    elif args.show:
+        history, _ = SessionStore(args.root).load(args.show)
+        for message in history:
+            text = " ".join(part.text for part in message.parts if part.text)
+            print(f"{message.role}: {text[:200]}")
+    else:
+        for session_id in SessionStore(args.root).sessions():
+            print(session_id)
@@ -0,0 +1,217 @@
+import argparse
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import uuid
+
+import chromadb
+
+import geminiEmbeddingFunction
+
+geminiEmbeddingFunction.register() # Collections created with the project's embedding function can then be rebuilt
+
+# --- Configuration ---
+# Offline maintenance for persisted Chroma stores. Run it while no script has the store
+# open: it rewrites chroma.sqlite3 and replaces HNSW segment directories.
+DEFAULT_STORES = ["./chroma_db_store", "./scientist_db_store"]
+SQLITE_FILE = "chroma.sqlite3"
+REBUILD_BATCH_SIZE = 1000
+REBUILD_SUFFIX = "__rebuild"
+RETIRED_SUFFIX = "__retired" # The original, renamed aside until the rebuilt copy has taken its name
+
+# Opening a store in a fresh interpreter is the only fair load-time measurement:
+# Chroma caches clients per path inside a process.
+LOAD_TIME_SNIPPET = """
+import sys, time
+start = time.perf_counter()
+import chromadb
+client = chromadb.PersistentClient(path=sys.argv[1])
+for collection in client.list_collections():
+    collection = client.get_collection(getattr(collection, "name", collection))
+    sample = collection.peek(1)
+    if len(sample["ids"]):
+        collection.query(query_embeddings=[sample["embeddings"][0]], n_results=1) # Forces the HNSW index to load
+print(time.perf_counter() - start)
+"""
+
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def measure_load_time(persist_path):
+    """Seconds for a new process to open the store and run one query per collection."""
+    result = subprocess.run([sys.executable, "-c", LOAD_TIME_SNIPPET, persist_path], capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def _is_uuid(name):
+    try:
+        uuid.UUID(name)
+        return True
+    except ValueError:
+        return False
+
+
+def find_orphan_segments(persist_path):
+    """Segment directories on disk that no segment row in chroma.sqlite3 refers to."""
+    with sqlite3.connect(f"file:{os.path.join(persist_path, SQLITE_FILE)}?mode=ro", uri=True) as connection:
+        live = {row[0] for row in connection.execute("SELECT id FROM segments")}
+    return sorted(
+        name for name in os.listdir(persist_path)
+        if os.path.isdir(os.path.join(persist_path, name)) and _is_uuid(name) and name not in live
+    )
+
+
+def remove_orphan_segments(persist_path, dry_run=False):
+    """Returns [(directory name, bytes)] for the orphaned segment directories (removed unless dry_run)."""
+    removed = []
+    for name in find_orphan_segments(persist_path):
+        path = os.path.join(persist_path, name)
+        removed.append((name, directory_size(path)))
+        if not dry_run:
+            shutil.rmtree(path)
+    return removed
+
+
+def vacuum_sqlite(persist_path):
+    """ANALYZE refreshes the query planner statistics; VACUUM rewrites the file without free pages."""
+    connection = sqlite3.connect(os.path.join(persist_path, SQLITE_FILE))
+    try:
+        connection.execute("ANALYZE")
+        connection.execute("VACUUM")
+    finally:
+        connection.close()
+
+
+def rebuild_collection(client, collection_name):
+    """
+    Rebuilds a collection's HNSW index compactly (no tombstones from deletes/updates).
+
+    Copies everything into '<name>__rebuild' with the same metadata and configuration
+    (HNSW settings, embedding function) and checks the count. The original is then
+    renamed to '<name>__retired', the copy takes the name, and only then is the original
+    dropped; if the rename fails the original gets its name back.
+    """
+    original = client.get_collection(collection_name)
+    data = original.get(include=["embeddings", "documents", "metadatas"])
+    metadata = {key: value for key, value in (original.metadata or {}).items()} or None
+    try:
+        configuration = {key: value for key, value in (original.configuration or {}).items() if value is not None}
+    except ValueError as e: # e.g. an embedding function this process can't rebuild from its config
+        raise RuntimeError(f"Can't copy the configuration of '{collection_name}' ({e}); original kept.") from e
+
+    shadow_name = collection_name + REBUILD_SUFFIX
+    try:
+        client.delete_collection(shadow_name) # Leftover from an interrupted rebuild
+    except Exception:
+        pass
+    shadow = client.create_collection(shadow_name, configuration=configuration, metadata=metadata,
+                                      embedding_function=configuration.get("embedding_function"))
+    for i in range(0, len(data["ids"]), REBUILD_BATCH_SIZE):
+        batch = slice(i, i + REBUILD_BATCH_SIZE)
+        shadow.add(
+            ids=data["ids"][batch],
+            embeddings=data["embeddings"][batch],
+            documents=data["documents"][batch],
+            metadatas=data["metadatas"][batch],
+        )
+    if shadow.count() != original.count():
+        client.delete_collection(shadow_name)
+        raise RuntimeError(f"Rebuild of '{collection_name}' copied {shadow.count()} of {original.count()} items; original kept.")
+    retired_name = collection_name + RETIRED_SUFFIX
+    original.modify(name=retired_name)
+    try:
+        shadow.modify(name=collection_name)
+    except Exception:
+        original.modify(name=collection_name)
+        raise
+    client.delete_collection(retired_name)
+    return len(data["ids"])
+
+
+def recover_interrupted_rebuilds(client):
+    """
+    Finishes or undoes rebuilds that stopped part-way: a '__retired' original is dropped if
+    its rebuilt copy already has the name, and renamed back otherwise. Returns the names fixed.
+    """
+    names = {getattr(collection, "name", collection) for collection in client.list_collections()}
+    recovered = []
+    for name in sorted(names):
+        if not name.endswith(RETIRED_SUFFIX):
+            continue
+        collection_name = name[:-len(RETIRED_SUFFIX)]
+        if collection_name in names:
+            client.delete_collection(name)
+        else:
+            client.get_collection(name).modify(name=collection_name)
+        recovered.append(collection_name)
+    return recovered
+
+
+def run_maintenance(persist_path, rebuild=True, dry_run=False):
+    """
+    Orphan cleanup, optional HNSW rebuild of every collection, then VACUUM/ANALYZE.
+
+    Returns:
+        dict: Sizes and load times before/after, plus what was removed and rebuilt.
+    """
+    # The load probe itself writes HNSW files, so the size is taken after it.
+    report = {"store": persist_path, "load_before_s": measure_load_time(persist_path)}
+    report["size_before"] = directory_size(persist_path)
+    report["orphans"] = remove_orphan_segments(persist_path, dry_run)
+    report["rebuilt"], report["skipped"] = {}, {}
+    if not dry_run:
+        if rebuild:
+            client = chromadb.PersistentClient(path=persist_path)
+            report["recovered"] = recover_interrupted_rebuilds(client)
+            for collection in client.list_collections():
+                name = getattr(collection, "name", collection)
+                if name.endswith(REBUILD_SUFFIX): # Stale copy; rebuild_collection replaces it
+                    continue
+                try:
+                    report["rebuilt"][name] = rebuild_collection(client, name)
+                except RuntimeError as e:
+                    report["skipped"][name] = str(e)
+            del client
+            # Dropping a collection can leave its old segment directory behind.
+            report["orphans"] += remove_orphan_segments(persist_path)
+        vacuum_sqlite(persist_path)
+    report["size_after"] = directory_size(persist_path)
+    report["load_after_s"] = measure_load_time(persist_path)
+    return report
+
+
+def print_report(report):
+    print(f"\n--- Maintenance: {report['store']} ---")
+    for name, size in report["orphans"]:
+        print(f"Orphaned segment {name}: {size / 1024:.1f} KB")
+    if not report["orphans"]:
+        print("No orphaned segment directories.")
+    for name in report.get("recovered", []):
+        print(f"Recovered '{name}' from an interrupted rebuild")
+    for name, count in report["rebuilt"].items():
+        print(f"Rebuilt '{name}' ({count} items)")
+    for name, reason in report.get("skipped", {}).items():
+        print(f"Skipped '{name}': {reason}")
+    reclaimed = report["size_before"] - report["size_after"]
+    change = f"reclaimed {reclaimed / 1024:.1f} KB" if reclaimed >= 0 else f"grew {-reclaimed / 1024:.1f} KB"
+    print(f"Size: {report['size_before'] / 1024:.1f} KB -> {report['size_after'] / 1024:.1f} KB ({change})")
+    print(f"Load time: {report['load_before_s'] * 1000:.0f} ms -> {report['load_after_s'] * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Clean up, vacuum and rebuild persisted Chroma stores (run with the bots stopped).")
+    parser.add_argument("stores", nargs="*", default=DEFAULT_STORES)
+    parser.add_argument("--no-rebuild", action="store_true", help="Skip the HNSW rebuild")
+    parser.add_argument("--dry-run", action="store_true", help="Only report orphaned segments and load times")
+    args = parser.parse_args()
+
+    for store in args.stores:
+        print_report(run_maintenance(store, rebuild=not args.no_rebuild, dry_run=args.dry_run))
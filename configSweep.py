@@ -0,0 +1,231 @@
+import google.generativeai as genai
+from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import os
+import time
+
+from rateLimiter import get_shared_rate_limiter
+from safetyHarness import enum_name
+from usageMetrics import metered_generate_content
+
+# --- Configuration ---
+MODEL_NAME = 'gemini-1.5-flash-latest'
+SWEEP_CACHE_PATH = "./.sweep_cache.json"
+DEFAULT_MAX_WORKERS = 8
+SWEEP_PARAMETERS = ["temperature", "top_p", "top_k", "max_output_tokens", "candidate_count", "stop_sequences"]
+
+DEFAULT_PROMPTS = [
+    "Write a short, imaginative story (around 100 words) about a squirrel who dreams of flying to Mars.",
+]
+DEFAULT_GRID = {
+    "temperature": [0.1, 0.9],
+    "top_p": [0.7, 0.95],
+    "top_k": [20, 40],
+    "max_output_tokens": [150],
+    "candidate_count": [1, 3],
+}
+# The two experiments from setup.py, swept as explicit cells alongside the grid
+# (the grid's cartesian product does not contain the high-temperature one).
+SETUP_CONFIGS = [
+    {"temperature": 0.9, "top_p": 0.95, "top_k": 40, "max_output_tokens": 10, "candidate_count": 3},
+    {"temperature": 0.1, "top_p": 0.7, "top_k": 20, "max_output_tokens": 150},
+]
+
+TABLE_COLUMNS = (
+    ["cell"] + SWEEP_PARAMETERS
+    + ["prompts", "avg_latency_ms", "avg_prompt_tokens", "avg_output_tokens", "tokens_per_sec", "finish_reasons", "cached", "errors"]
+)
+
+
+def expand_grid(grid):
+    """
+    Turns {"temperature": [0.1, 0.9], "top_k": [20, 40]} into a list of
+    GenerationConfig keyword dicts, one per combination.
+    """
+    keys = [key for key in SWEEP_PARAMETERS if key in grid]
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[key] for key in keys))]
+
+
+def call_key(model_name, prompt, config):
+    """Stable cache key for one (model, prompt, config) call."""
+    payload = json.dumps({"model": model_name, "prompt": prompt, "config": config}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SweepCache:
+    """Results of previous (prompt, config) calls, persisted as JSON between runs."""
+
+    def __init__(self, path=SWEEP_CACHE_PATH):
+        self.path = path
+        self.entries = {}
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def put(self, key, result):
+        self.entries[key] = result
+
+    def save(self):
+        if self.path:
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f)
+
+
+def run_call(model, prompt, config, rate_limiter):
+    """
+    Performs one generate_content call and returns its measurements.
+
+    Returns:
+        dict: latency_ms, prompt/output/total tokens, finish_reasons and error.
+    """
+    rate_limiter.acquire()
+    result = {"latency_ms": 0.0, "prompt_tokens": 0, "output_tokens": 0, "total_tokens": 0, "finish_reasons": [], "error": ""}
+    start = time.perf_counter()
+    try:
+        response = metered_generate_content(model, prompt, stage="config_sweep", generation_config=genai.types.GenerationConfig(**config))
+        result["latency_ms"] = (time.perf_counter() - start) * 1000
+        result["finish_reasons"] = [enum_name(candidate.finish_reason) for candidate in response.candidates]
+        if response.usage_metadata:
+            result["prompt_tokens"] = response.usage_metadata.prompt_token_count
+            result["output_tokens"] = response.usage_metadata.candidates_token_count
+            result["total_tokens"] = response.usage_metadata.total_token_count
+    except Exception as e:
+        result["latency_ms"] = (time.perf_counter() - start) * 1000
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+
+def run_sweep(prompts, grid, model_name=MODEL_NAME, max_workers=DEFAULT_MAX_WORKERS, cache=None, rate_limiter=None, extra_configs=None):
+    """
+    Runs every prompt against every GenerationConfig in the grid concurrently.
+
+    Identical (prompt, config) calls are made once: duplicates inside this sweep
+    share one request, and results from earlier sweeps come from the cache.
+
+    Args:
+        prompts (list): Prompt strings.
+        grid (dict): Parameter name -> list of values to try.
+        model_name (str): Generative model to sweep.
+        max_workers (int): Upper bound on in-flight requests.
+        cache (SweepCache): Optional result cache (None disables caching).
+        rate_limiter (RateLimiter): Defaults to the process-wide shared limiter.
+        extra_configs (list): Explicit GenerationConfig dicts swept after the grid cells.
+
+    Returns:
+        list: One summary row per grid cell (see TABLE_COLUMNS).
+    """
+    rate_limiter = rate_limiter or get_shared_rate_limiter()
+    model = genai.GenerativeModel(model_name)
+    configs = expand_grid(grid)
+    configs += [config for config in extra_configs or [] if config not in configs]
+
+    # Collect the distinct calls that are not cached yet.
+    pending = {}
+    for config in configs:
+        for prompt in prompts:
+            key = call_key(model_name, prompt, config)
+            if (cache is None or cache.get(key) is None) and key not in pending:
+                pending[key] = (prompt, config)
+
+    print(f"--- Sweeping {len(configs)} configs x {len(prompts)} prompts: {len(pending)} new calls ---")
+    fresh = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {key: pool.submit(run_call, model, prompt, config, rate_limiter) for key, (prompt, config) in pending.items()}
+        for key, future in futures.items():
+            fresh[key] = future.result()
+            if cache is not None and not fresh[key]["error"]:
+                cache.put(key, fresh[key])
+    if cache is not None:
+        cache.save()
+
+    rows = []
+    for cell_index, config in enumerate(configs, start=1):
+        results, cached = [], 0
+        for prompt in prompts:
+            key = call_key(model_name, prompt, config)
+            if key in fresh:
+                results.append(fresh[key])
+            else:
+                results.append(cache.get(key))
+                cached += 1
+        ok = [r for r in results if not r["error"]]
+        latency_s = sum(r["latency_ms"] for r in ok) / 1000
+        output_tokens = sum(r["output_tokens"] for r in ok)
+        row = {"cell": cell_index, **{param: config.get(param, "") for param in SWEEP_PARAMETERS}}
+        row.update({
+            "prompts": len(results),
+            "avg_latency_ms": round(latency_s * 1000 / len(ok), 1) if ok else "",
+            "avg_prompt_tokens": round(sum(r["prompt_tokens"] for r in ok) / len(ok), 1) if ok else "",
+            "avg_output_tokens": round(output_tokens / len(ok), 1) if ok else "",
+            "tokens_per_sec": round(output_tokens / latency_s, 1) if latency_s else "",
+            "finish_reasons": "|".join(sorted({reason for r in ok for reason in r["finish_reasons"]})),
+            "cached": cached,
+            "errors": len(results) - len(ok),
+        })
+        rows.append(row)
+    return rows
+
+
+def print_table(rows):
+    print("\n--- Sweep Results ---")
+    print(" | ".join(TABLE_COLUMNS))
+    for row in rows:
+        print(" | ".join(str(row[column]) for column in TABLE_COLUMNS))
+
+
+def write_table(rows, output_path):
+    with open(output_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=TABLE_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep GenerationConfig parameters over a prompt set.")
+    parser.add_argument("--prompts", help="Text file with one prompt per line")
+    parser.add_argument("--grid", help='JSON file like {"temperature": [0.1, 0.9], "top_k": [20, 40]}')
+    parser.add_argument("--output", default="sweep_results.csv")
+    parser.add_argument("--workers", type=int, default=DEFAULT_MAX_WORKERS)
+    parser.add_argument("--rpm", type=int, help="Requests per minute for the shared rate limiter")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--model", default=MODEL_NAME)
+    args = parser.parse_args()
+
+    load_dotenv()
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        raise ValueError("GOOGLE_API_KEY not found.")
+    genai.configure(api_key=api_key)
+
+    prompts = DEFAULT_PROMPTS
+    if args.prompts:
+        with open(args.prompts, "r", encoding="utf-8") as f:
+            prompts = [line.strip() for line in f if line.strip()]
+    grid, extra_configs = DEFAULT_GRID, SETUP_CONFIGS
+    if args.grid:
+        with open(args.grid, "r", encoding="utf-8") as f:
+            grid, extra_configs = json.load(f), None
+
+    start = time.perf_counter()
+    table = run_sweep(
+        prompts, grid,
+        model_name=args.model,
+        max_workers=args.workers,
+        cache=None if args.no_cache else SweepCache(),
+        rate_limiter=get_shared_rate_limiter(args.rpm),
+        extra_configs=extra_configs,
+    )
+    print_table(table)
+    write_table(table, args.output)
+    print(f"\nWrote {len(table)} cells to {args.output} in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,236 @@
+import argparse
+import mmap
+import os
+import random
+import tempfile
+import time
+
+# --- Configuration ---
+# Chunks are bounded by an estimated token count (~4 bytes of English text per token),
+# which is close enough for text-embedding-004's 2048-token input limit.
+BYTES_PER_TOKEN = 4
+DEFAULT_MAX_TOKENS = 256
+DEFAULT_OVERLAP_TOKENS = 32
+STREAM_BLOCK_SIZE = 4 * 1024 * 1024 # Used when a file can't be memory-mapped
+
+# Preferred cut points, best first. A cut is only taken if it keeps the chunk at least
+# MIN_FILL of the maximum size, so we never emit tiny fragments.
+HEADING_MARK = b"\n#"
+PARAGRAPH_MARKS = (b"\n\n", b"\f") # \f = page break in PDF-extracted text
+SENTENCE_MARKS = (b". ", b"? ", b"! ", b".\n", b"?\n", b"!\n")
+MIN_FILL = 0.5
+
+
+def _utf8_safe(buf, pos, floor):
+    """Moves pos back so it doesn't split a multi-byte UTF-8 character."""
+    while pos > floor and (buf[pos] & 0xC0) == 0x80:
+        pos -= 1
+    return pos
+
+
+def _find_cut(buf, start, limit, min_end):
+    """
+    Picks where a chunk starting at `start` should end, at or before `limit`.
+    Prefers headings, then paragraph breaks, then sentence ends, then spaces.
+    All searches are bytes.rfind calls, so they run at C speed.
+
+    Returns:
+        tuple: (end, at_heading) - no overlap is carried across a heading.
+    """
+    heading = buf.rfind(HEADING_MARK, min_end, limit)
+    if heading != -1:
+        return heading + 1, True # The heading starts the next chunk
+    best = max(buf.rfind(mark, min_end, limit) for mark in PARAGRAPH_MARKS)
+    if best != -1:
+        return best + 1, False
+    best = max(buf.rfind(mark, min_end, limit) for mark in SENTENCE_MARKS)
+    if best != -1:
+        return best + 2, False
+    space = buf.rfind(b" ", min_end, limit)
+    if space != -1:
+        return space + 1, False
+    return _utf8_safe(buf, limit, start + 1), False
+
+
+def _overlap_start(buf, end, overlap_bytes, floor):
+    """Start of the next chunk: `overlap_bytes` before `end`, moved forward to a word start."""
+    if overlap_bytes <= 0:
+        return end
+    start = max(floor, end - overlap_bytes)
+    space = buf.find(b" ", start, end)
+    return space + 1 if space != -1 else end
+
+
+def _heading_text(buf, heading_start):
+    """Decodes the Markdown heading line starting at heading_start ('# Title' -> 'Title')."""
+    line_end = buf.find(b"\n", heading_start, heading_start + 512)
+    if line_end == -1:
+        line_end = min(len(buf), heading_start + 512)
+    return bytes(buf[heading_start:line_end]).decode("utf-8", errors="ignore").lstrip("#").strip()
+
+
+def _chunk_buffer(buf, base_offset, start, final, max_bytes, overlap_bytes, source, state):
+    """
+    Yields chunks from buf[start:]. When `final` is False, stops once fewer than
+    max_bytes remain (the caller appends more data) and returns the resume position.
+
+    `state` carries chunk_index and the current heading across calls. Headings are
+    found by scanning each stretch of the buffer once, so the total work stays linear.
+    """
+    length = len(buf)
+    scanned = max(0, start - 1)
+    if base_offset == 0 and start == 0 and buf[:1] == b"#":
+        state["heading"] = _heading_text(buf, 0)
+    while start < length:
+        if not final and start + max_bytes > length:
+            # Record headings passed so far; the rest of the buffer is rescanned after the refill.
+            heading = buf.rfind(HEADING_MARK, scanned, start)
+            if heading != -1:
+                state["heading"] = _heading_text(buf, heading + 1)
+            break
+        limit = min(length, start + max_bytes)
+        at_heading = False
+        if limit == length and final:
+            end = length
+        else:
+            end, at_heading = _find_cut(buf, start, limit, start + int(max_bytes * MIN_FILL))
+
+        # Update the enclosing heading from the text between the last scan and this chunk's start.
+        heading = buf.rfind(HEADING_MARK, scanned, start + 2)
+        if heading != -1:
+            state["heading"] = _heading_text(buf, heading + 1)
+        scanned = start
+
+        text = bytes(buf[start:end]).decode("utf-8", errors="replace").strip()
+        if text:
+            yield {
+                "text": text,
+                "metadata": {
+                    "source": source,
+                    "chunk_index": state["chunk_index"],
+                    "start_offset": base_offset + start, # byte offsets into the file
+                    "end_offset": base_offset + end,
+                    "heading": state["heading"],
+                },
+            }
+            state["chunk_index"] += 1
+        if end >= length:
+            start = length
+            break
+        next_start = end if at_heading else _overlap_start(buf, end, overlap_bytes, start + 1)
+        start = next_start if next_start > start else end
+    return start
+
+
+def iter_chunks(path, max_tokens=DEFAULT_MAX_TOKENS, overlap_tokens=DEFAULT_OVERLAP_TOKENS):
+    """
+    Lazily splits a large text / Markdown / PDF-extracted file into overlapping,
+    token-bounded chunks without loading the whole file into memory.
+
+    Regular files are memory-mapped (the OS pages data in on demand); anything
+    that can't be mapped is read in STREAM_BLOCK_SIZE blocks instead.
+
+    Args:
+        path (str): File to chunk. For PDFs, extract text first (e.g. `pdftotext file.pdf`).
+        max_tokens (int): Upper bound on (estimated) tokens per chunk.
+        overlap_tokens (int): Approximate overlap carried into the next chunk
+                              (not carried across Markdown headings).
+
+    Yields:
+        dict: {"text": ..., "metadata": {"source", "chunk_index", "start_offset", "end_offset", "heading"}}
+    """
+    max_bytes = max_tokens * BYTES_PER_TOKEN
+    overlap_bytes = min(overlap_tokens * BYTES_PER_TOKEN, max_bytes // 2)
+    source = os.path.basename(path)
+    state = {"chunk_index": 0, "heading": ""}
+
+    with open(path, "rb") as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError): # Empty files and non-regular files can't be mapped
+            mapped = None
+        if mapped is not None:
+            with mapped:
+                yield from _chunk_buffer(mapped, 0, 0, True, max_bytes, overlap_bytes, source, state)
+            return
+
+        # Streaming fallback: keep only the unconsumed tail plus one block in memory.
+        # One byte before the resume point is kept so a "\n#" heading mark there is still seen.
+        buffer, base_offset, start = b"", 0, 0
+        while True:
+            block = f.read(STREAM_BLOCK_SIZE)
+            final = not block
+            keep_from = max(0, start - 1)
+            buffer = buffer[keep_from:] + block
+            base_offset += keep_from
+            start = yield from _chunk_buffer(buffer, base_offset, start - keep_from, final, max_bytes, overlap_bytes, source, state)
+            if final:
+                return
+
+
+def iter_chunks_batched(path, batch_size=100, **kwargs):
+    """Groups chunks into lists of batch_size, ready for one embed_content call each."""
+    batch = []
+    for chunk in iter_chunks(path, **kwargs):
+        batch.append(chunk)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# --- Benchmark ---
+def write_sample_file(path, size_mb, seed=0):
+    """Writes a synthetic Markdown file of roughly size_mb megabytes."""
+    rng = random.Random(seed)
+    words = ("the tower engineer paris japan currency island structure visited monument designed "
+             "built criticized artists height metres storey centerpiece fair lattice wrought iron").split()
+    target = size_mb * 1024 * 1024
+    written = 0
+    with open(path, "w", encoding="utf-8") as f:
+        section = 0
+        while written < target:
+            section += 1
+            parts = [f"\n# Section {section}\n\n"]
+            for _ in range(rng.randint(3, 8)):
+                sentences = [" ".join(rng.choice(words) for _ in range(rng.randint(6, 20))).capitalize() + "." for _ in range(rng.randint(2, 6))]
+                parts.append(" ".join(sentences) + "\n\n")
+            text = "".join(parts)
+            f.write(text)
+            written += len(text)
+
+
+def run_benchmark(size_mb=200, max_tokens=DEFAULT_MAX_TOKENS, overlap_tokens=DEFAULT_OVERLAP_TOKENS):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sample.md")
+        print(f"--- Writing {size_mb} MB sample file ---")
+        write_sample_file(path, size_mb)
+        size = os.path.getsize(path)
+
+        print(f"--- Chunking (max_tokens={max_tokens}, overlap_tokens={overlap_tokens}) ---")
+        start = time.perf_counter()
+        chunks = 0
+        for _ in iter_chunks(path, max_tokens=max_tokens, overlap_tokens=overlap_tokens):
+            chunks += 1
+        elapsed = time.perf_counter() - start
+        print(f"{chunks} chunks from {size / 1e6:.1f} MB in {elapsed:.2f}s -> {size / 1e6 / elapsed:.1f} MB/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chunk a large text/Markdown file, or benchmark the chunker.")
+    parser.add_argument("path", nargs="?", help="File to chunk (prints the first chunks)")
+    parser.add_argument("--max-tokens", type=int, default=DEFAULT_MAX_TOKENS)
+    parser.add_argument("--overlap-tokens", type=int, default=DEFAULT_OVERLAP_TOKENS)
+    parser.add_argument("--benchmark", type=int, metavar="MB", help="Benchmark on a synthetic file of this size")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        run_benchmark(args.benchmark, args.max_tokens, args.overlap_tokens)
+    elif args.path:
+        for chunk in iter_chunks(args.path, args.max_tokens, args.overlap_tokens):
+            print(chunk["metadata"], chunk["text"][:80].replace("\n", " "))
+            if chunk["metadata"]["chunk_index"] >= 9:
+                break
+    else:
+        parser.print_help()
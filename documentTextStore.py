@@ -0,0 +1,269 @@
+import argparse
+import hashlib
+import mmap
+import os
+import struct
+import threading
+
+# --- Configuration ---
+# Document text lives in an append-only data file (<path>.dat) with an id -> (offset, length)
+# index (<path>.idx); the Chroma collection keeps only ids, embeddings and metadata. A
+# collection using a text store records its path under TEXT_STORE_KEY in its metadata.
+# Reads go through an mmap of the data file, so only the pages of the texts actually
+# fetched (the final top-k) are touched, and the corpus is never loaded into the process.
+TEXT_STORE_KEY = "text_store"
+TEXT_HASH_KEY = "text_sha1" # Per-document metadata: hash of its text, so readers can spot changes without reading it
+TEXT_STORE_DIR = "texts" # Under the Chroma persist directory
+
+_INDEX_ENTRY = struct.Struct("<QIH") # offset, length, id length; followed by the id bytes
+
+
+def text_store_path(persist_path, collection_name):
+    return os.path.join(persist_path, TEXT_STORE_DIR, collection_name)
+
+
+class DocumentTextStore:
+    """
+    Append-only document text store with an in-memory id -> (offset, length) index.
+
+    Re-adding an id appends the new text and points the index at it. One writer per
+    store; any number of readers.
+
+    Args:
+        path (str): Path prefix of the '.dat' and '.idx' files (created if missing).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.data_path = path + ".dat"
+        self.index_path = path + ".idx"
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.index = {}
+        self.lock = threading.Lock()
+        self._map = None
+        self._load_index()
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, "r+b") as f:
+            data = f.read()
+            position = 0
+            while position + _INDEX_ENTRY.size <= len(data):
+                offset, length, id_length = _INDEX_ENTRY.unpack_from(data, position)
+                end = position + _INDEX_ENTRY.size + id_length
+                if end > len(data):
+                    break
+                self.index[data[position + _INDEX_ENTRY.size:end].decode("utf-8")] = (offset, length)
+                position = end
+            if position < len(data):
+                f.truncate(position) # Torn final entry from a crash; its text is simply unreferenced
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.index
+
+    def add(self, ids, texts):
+        """Appends texts (data first, then index, so the index never points past the data)."""
+        if len(ids) != len(texts):
+            raise ValueError("ids and texts must have the same length.")
+        with self.lock:
+            with open(self.data_path, "ab") as data_file:
+                offset = data_file.tell()
+                entries, chunks = [], []
+                for doc_id, text in zip(ids, texts):
+                    encoded = text.encode("utf-8")
+                    id_bytes = doc_id.encode("utf-8")
+                    entries.append((doc_id, offset, len(encoded), _INDEX_ENTRY.pack(offset, len(encoded), len(id_bytes)) + id_bytes))
+                    chunks.append(encoded)
+                    offset += len(encoded)
+                data_file.write(b"".join(chunks))
+                data_file.flush()
+                os.fsync(data_file.fileno())
+            with open(self.index_path, "ab") as index_file:
+                index_file.write(b"".join(entry for _, _, _, entry in entries))
+                index_file.flush()
+                os.fsync(index_file.fileno())
+            for doc_id, entry_offset, length, _ in entries:
+                self.index[doc_id] = (entry_offset, length)
+
+    def _mapped(self, end):
+        """The mmap of the data file, re-mapped if it has grown past `end` since it was mapped."""
+        if self._map is None or len(self._map) < end:
+            with open(self.data_path, "rb") as f:
+                # The old map is left to the garbage collector: views handed out may still use it.
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def view(self, doc_id):
+        """Zero-copy memoryview of a document's UTF-8 bytes, or None if the id is unknown."""
+        location = self.index.get(doc_id)
+        if location is None:
+            return None
+        offset, length = location
+        if length == 0:
+            return memoryview(b"")
+        with self.lock:
+            mapped = self._mapped(offset + length)
+        return memoryview(mapped)[offset:offset + length]
+
+    def get(self, ids):
+        """Texts for `ids` in order (None for unknown ids). Only these bytes are read."""
+        texts = []
+        for doc_id in ids:
+            view = self.view(doc_id)
+            texts.append(None if view is None else str(view, "utf-8"))
+        return texts
+
+    def close(self):
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                pass # Views are still alive; the map is closed when they are released
+            self._map = None
+
+
+# --- Collection helpers ---
+_open_stores = {}
+
+
+def open_text_store(path):
+    """One DocumentTextStore per path per process."""
+    if path not in _open_stores:
+        _open_stores[path] = DocumentTextStore(path)
+    return _open_stores[path]
+
+
+def collection_text_store(collection):
+    """The text store a collection's documents live in, or None if Chroma stores the text."""
+    path = (collection.metadata or {}).get(TEXT_STORE_KEY)
+    return open_text_store(path) if path else None
+
+
+def collection_documents(collection, ids=None):
+    """
+    Document texts of a collection, whether Chroma or a text store holds them.
+
+    Returns:
+        tuple: (ids, documents)
+    """
+    store = collection_text_store(collection)
+    if store is None:
+        data = collection.get(ids=ids, include=["documents"])
+        return data["ids"], data["documents"]
+    if ids is None:
+        ids = collection.get(include=[])["ids"]
+    return list(ids), store.get(ids)
+
+
+def text_hash(document):
+    return hashlib.sha1(document.encode("utf-8")).hexdigest()
+
+
+def add_documents(collection, ids, embeddings, documents, metadatas=None):
+    """
+    collection.add(...) that puts the text in the collection's text store if it has one,
+    and records each document's text hash under TEXT_HASH_KEY in its metadata.
+    """
+    metadatas = [dict(metadata or {}, **{TEXT_HASH_KEY: text_hash(document)})
+                 for metadata, document in zip(metadatas or [None] * len(documents), documents)]
+    store = collection_text_store(collection)
+    if store is not None:
+        store.add(ids, documents)
+    collection.add(ids=ids, embeddings=embeddings, documents=None if store is not None else documents, metadatas=metadatas)
+
+
+def fill_documents(results, store):
+    """Adds 'documents' to a query result (nested per query) from the text store; returns it."""
+    results["documents"] = [store.get(ids) for ids in results["ids"]]
+    return results
+
+
+# --- Benchmark ---
+def _synthetic_corpus(count, chars, seed=0):
+    import random
+    rng = random.Random(seed)
+    words = ["tower", "iron", "paris", "engineer", "currency", "island", "pacific", "lattice", "century", "monument", "visitors", "design"]
+    texts = []
+    for i in range(count):
+        text = f"Chunk {i}: "
+        while len(text) < chars:
+            text += rng.choice(words) + " "
+        texts.append(text[:chars])
+    return texts
+
+
+def run_benchmark(root, count=20000, chars=1000, dim=768, fetch_k=6, top_k=2, queries=50):
+    """
+    Same corpus in two collections: text inline in Chroma vs. in a text store.
+    Reports on-disk size, query payload size and the resident cost of the store.
+    """
+    import pickle
+    import shutil
+    import time
+    import tracemalloc
+    import chromadb
+    import numpy as np
+
+    shutil.rmtree(root, ignore_errors=True)
+    rng = np.random.default_rng(0)
+    texts = _synthetic_corpus(count, chars)
+    ids = [f"doc_{i}" for i in range(count)]
+    embeddings = rng.standard_normal((count, dim), dtype=np.float32)
+    query_embeddings = rng.standard_normal((queries, dim), dtype=np.float32)
+    print(f"--- {count} chunks x {chars} chars, dim {dim}, fetch_k {fetch_k}, top_k {top_k} ---")
+
+    for label, external in (("text in Chroma", False), ("text store", True)):
+        persist_path = os.path.join(root, "external" if external else "inline")
+        client = chromadb.PersistentClient(path=persist_path)
+        metadata = {TEXT_STORE_KEY: text_store_path(persist_path, "bench")} if external else None
+        collection = client.create_collection("bench", metadata=metadata)
+        store = collection_text_store(collection)
+        for i in range(0, count, 5000):
+            batch = slice(i, i + 5000)
+            if store is not None:
+                store.add(ids[batch], texts[batch])
+            collection.add(ids=ids[batch], embeddings=embeddings[batch], documents=None if external else texts[batch])
+
+        include = ["metadatas", "distances", "embeddings"] + ([] if external else ["documents"]) # Embeddings for MMR
+        payload = payload_without_embeddings = 0
+        fetch_seconds = 0.0
+        for query_embedding in query_embeddings:
+            results = collection.query(query_embeddings=[query_embedding], n_results=fetch_k, include=include)
+            size = len(pickle.dumps(results))
+            if external:
+                start = time.perf_counter()
+                top_texts = store.get(results["ids"][0][:top_k]) # Only the final top-k are read
+                fetch_seconds += time.perf_counter() - start
+                size += len(pickle.dumps(top_texts))
+            payload += size
+            payload_without_embeddings += size - len(pickle.dumps(results["embeddings"]))
+        disk = sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(persist_path) for f in files)
+        print(f"{label:>15}: {disk / 2**20:7.1f} MiB on disk, {payload / queries / 1024:6.1f} KiB per query "
+              f"({payload_without_embeddings / queries / 1024:.1f} KiB without the MMR embeddings)"
+              + (f", top-{top_k} text fetch {fetch_seconds / queries * 1e6:.0f} us" if external else ""))
+
+    # Resident cost of opening the store: only the index, not the text.
+    tracemalloc.start()
+    reopened = DocumentTextStore(text_store_path(os.path.join(root, "external"), "bench"))
+    index_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    corpus_bytes = sum(len(text) for text in texts)
+    print(f"Opening the store: {index_bytes / 2**20:.1f} MiB of index in memory for {corpus_bytes / 2**20:.1f} MiB of text "
+          f"({len(reopened)} documents)")
+    reopened.close()
+    shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure Chroma with document text inline vs. in an offset-indexed text store.")
+    parser.add_argument("--root", default="./text_store_benchmark")
+    parser.add_argument("--count", type=int, default=20000)
+    parser.add_argument("--chars", type=int, default=1000)
+    parser.add_argument("--fetch-k", type=int, default=6)
+    args = parser.parse_args()
+
+    run_benchmark(args.root, args.count, args.chars, fetch_k=args.fetch_k)
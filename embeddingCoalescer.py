@@ -0,0 +1,163 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+import argparse
+import asyncio
+import threading
+import time
+
+from usageMetrics import metered_embed_content
+
+# --- Configuration ---
+# Concurrent callers each embed one text; the coalescer queues them and sends one
+# batched embed_content call per MAX_BATCH texts or MAX_WAIT_MS, whichever comes first.
+# Batches never mix models or task types.
+EMBEDDING_MODEL_NAME = "text-embedding-004"
+MAX_BATCH = 64
+MAX_WAIT_MS = 5.0
+MAX_INFLIGHT_BATCHES = 8
+
+
+class EmbeddingCoalescer:
+    """
+    Args:
+        max_batch (int): Flush a queue as soon as it holds this many texts.
+        max_wait_ms (float): Flush a queue once its oldest text has waited this long.
+        max_inflight (int): Batched API calls allowed at the same time.
+    """
+
+    def __init__(self, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS, max_inflight=MAX_INFLIGHT_BATCHES):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queues = {} # (model, task_type) -> [(text, future, enqueued_at), ...]
+        self.condition = threading.Condition()
+        self.pool = ThreadPoolExecutor(max_workers=max_inflight, thread_name_prefix="embed-batch")
+        self.closed = False
+        self.stats = {"texts": 0, "batches": 0}
+        self.flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self.flusher.start()
+
+    def submit(self, text, model=EMBEDDING_MODEL_NAME, task_type="RETRIEVAL_QUERY"):
+        """Queues one text; returns a Future resolving to its embedding vector."""
+        future = Future()
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("EmbeddingCoalescer is closed.")
+            queue = self.queues.setdefault((model, task_type), [])
+            queue.append((text, future, time.perf_counter()))
+            if len(queue) == 1 or len(queue) >= self.max_batch:
+                self.condition.notify()
+        return future
+
+    def embed(self, text, model=EMBEDDING_MODEL_NAME, task_type="RETRIEVAL_QUERY"):
+        """Blocking single-text embed (drop-in for embed_content(content=text)['embedding'])."""
+        return self.submit(text, model, task_type).result()
+
+    async def embed_async(self, text, model=EMBEDDING_MODEL_NAME, task_type="RETRIEVAL_QUERY"):
+        return await asyncio.wrap_future(self.submit(text, model, task_type))
+
+    def _take_ready(self, now):
+        """Pops full or expired batches. Returns (batches, seconds until the next deadline)."""
+        ready, next_deadline = [], None
+        for key, queue in self.queues.items():
+            while queue and (len(queue) >= self.max_batch or now - queue[0][2] >= self.max_wait or self.closed):
+                ready.append((key, queue[:self.max_batch]))
+                del queue[:self.max_batch]
+            if queue:
+                deadline = queue[0][2] + self.max_wait - now
+                next_deadline = deadline if next_deadline is None else min(next_deadline, deadline)
+        return ready, next_deadline
+
+    def _flush_loop(self):
+        while True:
+            with self.condition:
+                ready, wait = self._take_ready(time.perf_counter())
+                if not ready:
+                    if self.closed:
+                        return
+                    self.condition.wait(timeout=wait)
+                    continue
+            for (model, task_type), batch in ready:
+                self.pool.submit(self._send, model, task_type, batch)
+
+    def _send(self, model, task_type, batch):
+        texts = [text for text, _, _ in batch]
+        try:
+            vectors = metered_embed_content(stage="embed_coalesced", model=model, content=texts, task_type=task_type)['embedding']
+            if len(vectors) != len(texts): # Can't tell which text a vector belongs to, so none is trusted
+                raise ValueError(f"embed_content returned {len(vectors)} vectors for {len(texts)} texts.")
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        with self.condition:
+            self.stats["texts"] += len(texts)
+            self.stats["batches"] += 1
+        for (_, future, _), vector in zip(batch, vectors):
+            future.set_result(vector)
+
+    def close(self):
+        """Flushes whatever is queued and stops the background thread."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.flusher.join()
+        self.pool.shutdown(wait=True)
+
+
+# --- Benchmark ---
+def _percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def _drive(embed_one, callers, requests_per_caller):
+    latencies = []
+    lock = threading.Lock()
+
+    def caller(caller_index):
+        for i in range(requests_per_caller):
+            start = time.perf_counter()
+            embed_one(f"query {caller_index}-{i}")
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=caller, args=(c,)) for c in range(callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(latencies), time.perf_counter() - start
+
+
+def run_benchmark(callers=64, requests_per_caller=20, latency="fixed:50", windows=(1.0, 5.0, 20.0)):
+    """Direct single-text calls vs. the coalescer at several batching windows, against the local stand-in."""
+    from geminiReplay import Cassette, GeminiReplay
+
+    print(f"--- {callers} concurrent callers x {requests_per_caller} single-text embeds, stand-in latency {latency} ---")
+    rows = [("direct", None)] + [(f"coalesced {w:g} ms", w) for w in windows]
+    for label, window in rows:
+        replay = GeminiReplay(cassette=Cassette(None), latency=latency, on_miss="synthetic", seed=0).install()
+        try:
+            if window is None:
+                latencies, wall = _drive(
+                    lambda text: metered_embed_content(stage="embed_query", model=EMBEDDING_MODEL_NAME, content=text, task_type="RETRIEVAL_QUERY"),
+                    callers, requests_per_caller)
+            else:
+                coalescer = EmbeddingCoalescer(max_wait_ms=window)
+                latencies, wall = _drive(coalescer.embed, callers, requests_per_caller)
+                coalescer.close()
+        finally:
+            replay.uninstall()
+        total = callers * requests_per_caller
+        print(f"{label:>16}: {total / wall:7.0f} texts/s, {replay.stats['calls']:5d} API calls, "
+              f"p50 {_percentile(latencies, 0.5) * 1000:.1f} ms, p99 {_percentile(latencies, 0.99) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark micro-batched embedding against direct single-text calls.")
+    parser.add_argument("--callers", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=20, help="Embeds per caller")
+    parser.add_argument("--latency", default="fixed:50", help="Stand-in latency spec")
+    parser.add_argument("--windows", default="1,5,20", help="Batching windows to compare, in ms")
+    args = parser.parse_args()
+
+    run_benchmark(args.callers, args.requests, args.latency, [float(w) for w in args.windows.split(",")])
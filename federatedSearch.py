@@ -0,0 +1,215 @@
+import google.generativeai as genai
+from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import argparse
+import heapq
+import os
+import threading
+import time
+
+import chromadb
+
+from usageMetrics import metered_embed_content
+from documentTextStore import collection_text_store, fill_documents
+from reindexEmbeddings import live_collection_name, collection_embedding_model
+
+# --- Configuration ---
+EMBEDDING_MODEL_NAME = "text-embedding-004"
+DEFAULT_TIMEOUT = 2.0 # seconds per source
+MAX_IN_FLIGHT = 2 # Queries per source still running (e.g. hung past their timeout) before that source is skipped
+DEFAULT_SOURCES = [
+    ("eiffel_japan", "./chroma_db_store", "rag_eiffel_japan_collection"),
+    ("scientists", "./scientist_db_store", "pioneering_scientists_collection"),
+]
+
+
+def distance_to_similarity(distance, space):
+    """
+    Maps a Chroma distance onto cosine similarity so stores using different spaces
+    can be merged. Gemini embeddings are unit length, so for "l2" (squared L2)
+    d = 2 - 2*cos; for "cosine" and "ip" Chroma returns 1 - cos.
+    """
+    if space == "l2":
+        return 1.0 - distance / 2.0
+    return 1.0 - distance
+
+
+def _collection_space(collection):
+    configuration = getattr(collection, "configuration", None) or {}
+    hnsw = configuration.get("hnsw") if isinstance(configuration, dict) else None
+    if hnsw and hnsw.get("space"):
+        return hnsw["space"]
+    return (collection.metadata or {}).get("hnsw:space", "l2")
+
+
+class Source:
+    """
+    One persisted store + collection, opened once. `collection_name` is the logical
+    name: after a re-index the live (aliased) collection and its embedding model are used.
+    """
+
+    def __init__(self, name, persist_path, collection_name, timeout=DEFAULT_TIMEOUT):
+        self.name = name
+        self.timeout = timeout
+        self.client = chromadb.PersistentClient(path=persist_path)
+        self.collection = self.client.get_collection(name=live_collection_name(persist_path, collection_name))
+        self.embedding_model = collection_embedding_model(self.collection, EMBEDDING_MODEL_NAME)
+        self.space = _collection_space(self.collection)
+        self.text_store = collection_text_store(self.collection)
+
+    def query(self, query_embedding, k, where=None):
+        """query_embedding: a vector, or {embedding model: vector} as built by FederatedRetriever.embed_query."""
+        if isinstance(query_embedding, dict):
+            query_embedding = query_embedding[self.embedding_model]
+        results = self.collection.query(query_embeddings=[query_embedding], n_results=k, where=where)
+        if self.text_store:
+            fill_documents(results, self.text_store)
+        return [
+            {
+                "source": self.name,
+                "id": doc_id,
+                "document": document,
+                "metadata": metadata,
+                "similarity": distance_to_similarity(distance, self.space),
+            }
+            for doc_id, document, metadata, distance in zip(
+                results["ids"][0], results["documents"][0], results["metadatas"][0], results["distances"][0]
+            )
+        ]
+
+
+class FederatedRetriever:
+    """
+    Queries several sources concurrently with the same query embedding and merges
+    their hits into one global top-k by (normalized) similarity.
+
+    A source that misses its timeout is left out of that answer; its query keeps
+    running in that source's own pool but nobody waits for it. Each source has its
+    own pool and at most max_in_flight queries running, so a hung source is skipped
+    (reported missing) instead of starving the others.
+    """
+
+    def __init__(self, sources, max_in_flight=MAX_IN_FLIGHT):
+        self.sources = list(sources)
+        self.max_in_flight = max_in_flight
+        self.pools = {source.name: ThreadPoolExecutor(max_workers=max_in_flight) for source in self.sources}
+        self.in_flight = {source.name: 0 for source in self.sources}
+        self.stats = {"queries": 0, "timeouts": {}, "errors": {}, "skipped": {}}
+        self._lock = threading.Lock() # Guards in_flight and stats; queries may come from several threads
+
+    @classmethod
+    def from_specs(cls, specs=DEFAULT_SOURCES, timeout=DEFAULT_TIMEOUT):
+        return cls([Source(name, path, collection, timeout) for name, path, collection in specs])
+
+    def embed_query(self, query):
+        """Embeds the query once per embedding model the sources use; pass the result to query()."""
+        return {
+            model: metered_embed_content(stage="embed_query", model=model, content=query, task_type="RETRIEVAL_QUERY")['embedding']
+            for model in sorted({source.embedding_model for source in self.sources})
+        }
+
+    def query(self, query_embedding, k=2, where=None):
+        """
+        Args:
+            query_embedding: {embedding model: vector} from embed_query(), or one vector
+                             if every source uses the same model.
+
+        Returns:
+            tuple: (global top-k hits best first, list of sources that timed out or failed)
+        """
+        self._count("queries")
+        start = time.perf_counter()
+        futures, missing = [], []
+        for source in self.sources:
+            future = self._submit(source, query_embedding, k, where)
+            if future is None:
+                self._count("skipped", source.name)
+                missing.append(source.name)
+            else:
+                futures.append((source, future))
+        hits = []
+        for source, future in futures:
+            remaining = source.timeout - (time.perf_counter() - start)
+            try:
+                hits.extend(future.result(timeout=max(0.0, remaining)))
+            except FutureTimeoutError:
+                self._count("timeouts", source.name)
+                missing.append(source.name)
+            except Exception as e:
+                print(f"Warning: source '{source.name}' failed: {e}")
+                self._count("errors", source.name)
+                missing.append(source.name)
+        return heapq.nlargest(k, hits, key=lambda hit: hit["similarity"]), missing
+
+    def _submit(self, source, query_embedding, k, where):
+        """Starts the source's query in its own pool, or returns None if it is saturated."""
+        with self._lock:
+            if self.in_flight[source.name] >= self.max_in_flight:
+                return None
+            self.in_flight[source.name] += 1
+        future = self.pools[source.name].submit(source.query, query_embedding, k, where)
+        future.add_done_callback(lambda _: self._finished(source.name))
+        return future
+
+    def _finished(self, name):
+        with self._lock:
+            self.in_flight[name] -= 1
+
+    def _count(self, key, name=None):
+        with self._lock:
+            if name is None:
+                self.stats[key] += 1
+            else:
+                self.stats[key][name] = self.stats[key].get(name, 0) + 1
+
+    def close(self):
+        for pool in self.pools.values():
+            pool.shutdown(wait=False)
+
+
+# --- Benchmark ---
+def _time_ms(call, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        call()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2], timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+
+
+def run_benchmark(retriever, query_embeddings, k=2, repeats=50):
+    """Median / p99 latency of each source on its own versus the federated query."""
+    print(f"\n--- Federated vs Single-Store Latency ({len(query_embeddings)} queries x {repeats}) ---")
+    for source in retriever.sources:
+        p50, p99 = _time_ms(lambda: [source.query(q, k) for q in query_embeddings], repeats)
+        print(f"{source.name:>16}: p50 {p50 / len(query_embeddings):.2f} ms/query, p99 {p99 / len(query_embeddings):.2f} ms/query")
+    p50, p99 = _time_ms(lambda: [retriever.query(q, k) for q in query_embeddings], repeats)
+    print(f"{'federated':>16}: p50 {p50 / len(query_embeddings):.2f} ms/query, p99 {p99 / len(query_embeddings):.2f} ms/query")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query several persisted Chroma stores as one.")
+    parser.add_argument("queries", nargs="*", default=["How tall is the Eiffel Tower?", "Who was the first computer programmer?"])
+    parser.add_argument("--k", type=int, default=2)
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, help="Per-source timeout in seconds")
+    parser.add_argument("--benchmark", action="store_true")
+    args = parser.parse_args()
+
+    load_dotenv()
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if api_key:
+        genai.configure(api_key=api_key)
+
+    retriever = FederatedRetriever.from_specs(timeout=args.timeout)
+    query_embeddings = [retriever.embed_query(query) for query in args.queries]
+    for query, query_embedding in zip(args.queries, query_embeddings):
+        hits, missing = retriever.query(query_embedding, args.k)
+        print(f"\n--- {query} ---")
+        for hit in hits:
+            print(f"[{hit['source']}] {hit['similarity']:.4f} {hit['document'][:80]}")
+        if missing:
+            print(f"(no answer in time from: {', '.join(missing)})")
+    if args.benchmark:
+        run_benchmark(retriever, query_embeddings, args.k)
+    retriever.close()
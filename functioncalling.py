@@ -2,6 +2,7 @@ import google.generativeai as genai
 from dotenv import load_dotenv
 import os
 import json
+from modelRouter import ModelRouter
 
 # --- (Assume get_current_weather function is here) ---
 def get_current_weather(location: str, unit: str = "celsius"):
@@ -40,12 +41,13 @@ try:
         raise ValueError("GOOGLE_API_KEY not found.")
     genai.configure(api_key=api_key)
 
-    model = genai.GenerativeModel(
-        'gemini-1.5-flash-latest',
+    # Every fallback model gets the same tools
+    router = ModelRouter(model_factory=lambda model_name: genai.GenerativeModel(
+        model_name,
         tools=[weather_tool]
-    )
+    ))
 
-    chat = model.start_chat(enable_automatic_function_calling=False)
+    chat = router.start_chat(enable_automatic_function_calling=False)
     print("Function Calling Chat. Ask about the weather. Type 'quit' to end.")
     print("-" * 30)
 
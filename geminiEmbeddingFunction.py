@@ -0,0 +1,121 @@
+import google.generativeai as genai
+from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+import chromadb
+from chromadb import Documents, EmbeddingFunction, Embeddings
+from chromadb.utils.embedding_functions import register_embedding_function
+
+from usageMetrics import metered_embed_content
+
+# --- Configuration ---
+EMBEDDING_MODEL_NAME = "text-embedding-004"
+API_BATCH_LIMIT = 100 # Texts per embed_content request accepted by the API
+DEFAULT_MAX_CONCURRENCY = 4
+
+
+@register_embedding_function # So collections created with it can be reopened (and rebuilt) from their stored config
+class GeminiEmbeddingFunction(EmbeddingFunction):
+    """
+    Chroma embedding function backed by genai.embed_content.
+
+    Unlike the notebook version (a class-level document_mode flag flipped between
+    calls), each instance is fixed to one task type and can't be changed after
+    construction, so one process can ingest and query concurrently:
+
+        documents_fn = GeminiEmbeddingFunction.for_documents()
+        collection = client.get_or_create_collection("docs", embedding_function=documents_fn)
+        collection.add(documents=..., ids=...)          # RETRIEVAL_DOCUMENT
+        collection.query(query_texts=[...])             # RETRIEVAL_QUERY via embed_query
+
+    Inputs are split into API-sized batches, embedded with at most max_concurrency
+    requests in flight (each retried on 429/503 by metered_embed_content), and the
+    vectors are returned in input order.
+    """
+
+    def __init__(self, task_type="RETRIEVAL_DOCUMENT", model=EMBEDDING_MODEL_NAME, batch_size=API_BATCH_LIMIT,
+                 max_concurrency=DEFAULT_MAX_CONCURRENCY, rate_limiter=None):
+        if not 1 <= batch_size <= API_BATCH_LIMIT:
+            raise ValueError(f"batch_size must be between 1 and {API_BATCH_LIMIT}.")
+        object.__setattr__(self, "task_type", task_type)
+        object.__setattr__(self, "model", model)
+        object.__setattr__(self, "batch_size", batch_size)
+        object.__setattr__(self, "max_concurrency", max_concurrency)
+        object.__setattr__(self, "rate_limiter", rate_limiter)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable; create a new instance instead.")
+
+    @classmethod
+    def for_documents(cls, **kwargs):
+        return cls(task_type="RETRIEVAL_DOCUMENT", **kwargs)
+
+    @classmethod
+    def for_queries(cls, **kwargs):
+        return cls(task_type="RETRIEVAL_QUERY", **kwargs)
+
+    def _embed_batch(self, texts, task_type):
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        return metered_embed_content(
+            stage=f"chroma_{task_type.lower()}",
+            model=self.model,
+            content=list(texts),
+            task_type=task_type
+        )['embedding']
+
+    def _embed(self, texts, task_type):
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) <= 1:
+            results = [self._embed_batch(batch, task_type) for batch in batches]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as pool:
+                results = list(pool.map(lambda batch: self._embed_batch(batch, task_type), batches)) # map keeps input order
+        return [vector for batch_vectors in results for vector in batch_vectors]
+
+    def __call__(self, input: Documents) -> Embeddings:
+        return self._embed(list(input), self.task_type)
+
+    def embed_query(self, input: Documents) -> Embeddings:
+        """Chroma uses this for query_texts, so queries are embedded as queries even with a document instance."""
+        return self._embed(list(input), "RETRIEVAL_QUERY")
+
+    # --- Chroma configuration persistence ---
+    @staticmethod
+    def name():
+        return "gemini_generativeai_batched"
+
+    def get_config(self):
+        return {"task_type": self.task_type, "model": self.model, "batch_size": self.batch_size, "max_concurrency": self.max_concurrency}
+
+    @staticmethod
+    def build_from_config(config):
+        return GeminiEmbeddingFunction(**config)
+
+
+def register():
+    """
+    Makes GeminiEmbeddingFunction known to Chroma. The decorator already does this on
+    import; scripts that only need the registration (to reopen or rebuild collections
+    created with it) call this so the dependency is explicit.
+    """
+    return GeminiEmbeddingFunction
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if api_key:
+        genai.configure(api_key=api_key)
+
+    documents = [
+        "The Eiffel Tower is a wrought-iron lattice tower on the Champ de Mars in Paris, France.",
+        "The official currency of Japan is the Yen.",
+        "Japan is an island country in East Asia, located in the northwest Pacific Ocean.",
+    ]
+    client = chromadb.Client()
+    collection = client.get_or_create_collection("embedding_function_demo", embedding_function=GeminiEmbeddingFunction.for_documents())
+    collection.add(documents=documents, ids=[str(i) for i in range(len(documents))])
+    results = collection.query(query_texts=["What currency is used in Japan?"], n_results=1)
+    print(results["documents"][0])
@@ -0,0 +1,311 @@
+import google.generativeai as genai
+from google.generativeai.types import content_types, generation_types
+from google.api_core import exceptions as google_exceptions
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+import time
+
+# --- Configuration ---
+# Record/replay stand-in for the Gemini API. install() patches
+#   genai.embed_content
+#   genai.GenerativeModel.generate_content   (ChatSession.send_message goes through this too)
+# so every script, tool and benchmark can run offline from a cassette file.
+DEFAULT_CASSETTE_PATH = "./gemini_cassette.json"
+SYNTHETIC_EMBEDDING_DIM = 768
+
+_original_embed_content = genai.embed_content
+_original_generate_content = genai.GenerativeModel.generate_content
+
+
+# --- Latency models ---
+def make_latency_sampler(spec, seed=None):
+    """
+    Builds a function returning a simulated latency (seconds) for a call.
+
+    Args:
+        spec (str): One of
+            "recorded"                 - use the latency captured while recording
+            "fixed:<ms>"               - constant latency
+            "lognormal:<median_ms>,<sigma>" - heavy-ish tail, typical for LLM APIs
+            "pareto:<min_ms>,<alpha>"  - very heavy tail (alpha ~1.5-2.5)
+            "none"                     - no added latency
+        seed (int): Optional random seed for reproducible runs.
+
+    Returns:
+        callable: sampler(recorded_seconds) -> seconds
+    """
+    rng = random.Random(seed)
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",")] if args else []
+    if kind == "none":
+        return lambda recorded: 0.0
+    if kind == "recorded":
+        return lambda recorded: recorded or 0.0
+    if kind == "fixed":
+        return lambda recorded: values[0] / 1000
+    if kind == "lognormal":
+        median_ms, sigma = values
+        return lambda recorded: rng.lognormvariate(math.log(median_ms / 1000), sigma)
+    if kind == "pareto":
+        min_ms, alpha = values
+        return lambda recorded: (min_ms / 1000) * rng.paretovariate(alpha)
+    raise ValueError(f"Unknown latency spec '{spec}'.")
+
+
+# --- Serialization ---
+def _contents_key(contents):
+    """Stable JSON for whatever was passed as contents (str, list, dicts or Content protos)."""
+    normalized = content_types.to_contents(contents)
+    return [type(content).to_dict(content) for content in normalized]
+
+
+def _request_options_key(model, kwargs):
+    """
+    Everything besides the contents that shapes a generate_content response: the call's
+    generation_config / safety_settings / tools / tool_config merged with the model's own
+    settings and system instruction, exactly as the SDK builds the request.
+    """
+    request = model._prepare_request(
+        contents=[],
+        generation_config=kwargs.get("generation_config"),
+        safety_settings=kwargs.get("safety_settings"),
+        tools=kwargs.get("tools"),
+        tool_config=kwargs.get("tool_config"),
+    )
+    options = type(request).to_dict(request)
+    for field in ("model", "contents"):
+        options.pop(field, None)
+    return options
+
+
+def request_key(kind, model, payload, **options):
+    blob = json.dumps({"kind": kind, "model": model, "payload": payload, **options}, sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def _response_to_dicts(response):
+    """GenerateContentResponse -> list of chunk dicts (one dict for non-streaming calls)."""
+    return [chunk.to_dict() for chunk in response]
+
+
+def _response_from_dicts(chunks, stream, chunk_delay=0.0):
+    protos = [genai.protos.GenerateContentResponse(chunk) for chunk in chunks]
+    if not stream:
+        return generation_types.GenerateContentResponse.from_response(protos[0])
+
+    def paced():
+        for i, proto in enumerate(protos):
+            if i and chunk_delay:
+                time.sleep(chunk_delay)
+            yield proto
+    return generation_types.GenerateContentResponse.from_iterator(paced())
+
+
+def synthetic_embedding(text, dim=SYNTHETIC_EMBEDDING_DIM):
+    """Deterministic unit vector derived from the text hash (same text -> same vector)."""
+    rng = random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+    vector = [rng.gauss(0, 1) for _ in range(dim)]
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+def synthetic_generation(prompt_chars, text="This is a replayed answer from the local Gemini stand-in."):
+    return [{
+        "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finish_reason": 1, "index": 0}],
+        "usage_metadata": {
+            "prompt_token_count": max(1, prompt_chars // 4),
+            "candidates_token_count": max(1, len(text) // 4),
+            "total_token_count": max(1, prompt_chars // 4) + max(1, len(text) // 4),
+        },
+    }]
+
+
+# --- Cassette ---
+class Cassette:
+    """
+    Recorded interactions: {request_key: [{"response": ..., "latency": seconds}, ...]}.
+    Several recordings of the same request are replayed round-robin.
+    """
+
+    def __init__(self, path=DEFAULT_CASSETTE_PATH):
+        self.path = path
+        self.entries = {}
+        self.cursors = {}
+        self.lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def add(self, key, response, latency):
+        with self.lock:
+            self.entries.setdefault(key, []).append({"response": response, "latency": latency})
+
+    def next(self, key):
+        with self.lock:
+            recordings = self.entries.get(key)
+            if not recordings:
+                return None
+            cursor = self.cursors.get(key, 0)
+            self.cursors[key] = cursor + 1
+            return recordings[cursor % len(recordings)]
+
+    def save(self):
+        with self.lock:
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f)
+
+
+# --- The stand-in ---
+class GeminiReplay:
+    """
+    mode="record": call the real API and append every response to the cassette.
+    mode="replay": answer from the cassette with simulated latency and injected errors.
+
+    Args:
+        cassette (Cassette): Where interactions are stored.
+        mode (str): "record" or "replay".
+        latency (str): Latency spec for replay (see make_latency_sampler).
+        error_rate_429 (float): Probability a replayed call raises ResourceExhausted.
+        error_rate_503 (float): Probability a replayed call raises ServiceUnavailable.
+        on_miss (str): "error" raises KeyError for unrecorded requests, "synthetic"
+                       answers with deterministic fake embeddings / text instead.
+        seed (int): Random seed for latency and fault injection.
+    """
+
+    def __init__(self, cassette=None, mode="replay", latency="recorded", error_rate_429=0.0, error_rate_503=0.0,
+                 on_miss="error", seed=None):
+        if mode not in ("record", "replay"):
+            raise ValueError("mode must be 'record' or 'replay'.")
+        self.cassette = cassette if cassette is not None else Cassette()
+        self.mode = mode
+        self.sample_latency = make_latency_sampler(latency, seed)
+        self.error_rate_429 = error_rate_429
+        self.error_rate_503 = error_rate_503
+        self.on_miss = on_miss
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.stats = {"calls": 0, "hits": 0, "misses": 0, "injected_429": 0, "injected_503": 0}
+        self.stats_lock = threading.Lock() # Replayed calls come from many threads (load tests, sweeps)
+
+    def _count(self, key):
+        with self.stats_lock:
+            self.stats[key] += 1
+
+    def _inject_fault(self):
+        with self.random_lock:
+            roll = self.random.random()
+        if roll < self.error_rate_429:
+            self._count("injected_429")
+            raise google_exceptions.ResourceExhausted("Injected 429 from GeminiReplay")
+        if roll < self.error_rate_429 + self.error_rate_503:
+            self._count("injected_503")
+            raise google_exceptions.ServiceUnavailable("Injected 503 from GeminiReplay")
+
+    def _lookup(self, key, synthesize):
+        self._count("calls")
+        entry = self.cassette.next(key)
+        if entry is not None:
+            self._count("hits")
+            return entry
+        self._count("misses")
+        if self.on_miss == "synthetic":
+            return {"response": synthesize(), "latency": None}
+        raise KeyError(f"No recorded response for request {key[:12]}; re-record the cassette or use on_miss='synthetic'.")
+
+    # --- embed_content ---
+    def embed_content(self, model, content, task_type=None, **kwargs):
+        key = request_key("embed", model, content, task_type=task_type, **kwargs)
+        if self.mode == "record":
+            start = time.perf_counter()
+            result = _original_embed_content(model=model, content=content, task_type=task_type, **kwargs)
+            self.cassette.add(key, dict(result), time.perf_counter() - start)
+            return result
+
+        def synthesize():
+            dim = kwargs.get("output_dimensionality") or SYNTHETIC_EMBEDDING_DIM
+            if isinstance(content, list):
+                return {"embedding": [synthetic_embedding(text, dim) for text in content]}
+            return {"embedding": synthetic_embedding(content, dim)}
+
+        entry = self._lookup(key, synthesize)
+        time.sleep(self.sample_latency(entry["latency"]))
+        self._inject_fault()
+        return dict(entry["response"])
+
+    # --- generate_content (and therefore ChatSession.send_message) ---
+    def generate_content(self, model, contents=None, *, stream=False, **kwargs):
+        key = request_key("generate", model.model_name, _contents_key(contents), stream=bool(stream), request=_request_options_key(model, kwargs))
+        if self.mode == "record":
+            start = time.perf_counter()
+            response = _original_generate_content(model, contents, stream=stream, **kwargs)
+            # Iterating a stream consumes it; the SDK then re-yields the cached chunks to the caller.
+            self.cassette.add(key, _response_to_dicts(response), time.perf_counter() - start)
+            return response
+
+        entry = self._lookup(key, lambda: synthetic_generation(len(json.dumps(_contents_key(contents)))))
+        total = self.sample_latency(entry["latency"])
+        chunks = entry["response"]
+        self._inject_fault()
+        if stream and len(chunks) > 1:
+            # First chunk arrives after a share of the latency, the rest trickle in.
+            time.sleep(total * 0.3)
+            return _response_from_dicts(chunks, True, chunk_delay=total * 0.7 / (len(chunks) - 1))
+        time.sleep(total)
+        return _response_from_dicts(chunks, stream)
+
+    # --- Patching ---
+    def install(self):
+        """Routes the SDK entry points through this stand-in."""
+        replay = self
+
+        def patched_generate_content(model_self, contents=None, *args, **kwargs):
+            return replay.generate_content(model_self, contents, *args, **kwargs)
+
+        genai.embed_content = self.embed_content
+        genai.GenerativeModel.generate_content = patched_generate_content
+        return self
+
+    def uninstall(self):
+        genai.embed_content = _original_embed_content
+        genai.GenerativeModel.generate_content = _original_generate_content
+        if self.mode == "record":
+            self.cassette.save()
+
+    def __enter__(self):
+        return self.install()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.uninstall()
+        return False
+
+
+def install_from_env():
+    """
+    Enables the stand-in when GEMINI_REPLAY_MODE is set, so existing scripts can be
+    recorded or replayed without code changes:
+        GEMINI_REPLAY_MODE=record|replay
+        GEMINI_CASSETTE=./gemini_cassette.json
+        GEMINI_REPLAY_LATENCY=lognormal:800,0.6
+        GEMINI_REPLAY_ERRORS=0.01,0.005   (429 rate, 503 rate)
+        GEMINI_REPLAY_ON_MISS=error|synthetic
+    """
+    mode = os.getenv("GEMINI_REPLAY_MODE")
+    if not mode:
+        return None
+    error_429, _, error_503 = os.getenv("GEMINI_REPLAY_ERRORS", "0,0").partition(",")
+    replay = GeminiReplay(
+        cassette=Cassette(os.getenv("GEMINI_CASSETTE", DEFAULT_CASSETTE_PATH)),
+        mode=mode,
+        latency=os.getenv("GEMINI_REPLAY_LATENCY", "recorded"),
+        error_rate_429=float(error_429 or 0),
+        error_rate_503=float(error_503 or 0),
+        on_miss=os.getenv("GEMINI_REPLAY_ON_MISS", "error"),
+    ).install()
+    if mode == "record":
+        import atexit
+        atexit.register(replay.cassette.save)
+    return replay
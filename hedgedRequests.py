@@ -0,0 +1,184 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import argparse
+import collections
+import os
+import threading
+import time
+
+# --- Configuration ---
+# Hedging: if an idempotent call hasn't answered within the recent p95 latency, send an
+# identical second request and use whichever answers first. Opt in with
+#   HEDGE_PERCENTILE=0.95  (enables hedging in usageMetrics for embed / non-streaming generate)
+#   HEDGE_BUDGET=0.05      (at most 5% extra requests)
+# Chat turns are never hedged: ChatSession.send_message mutates the session history.
+# Latency is tracked per (model, stage, operation, batch-size bucket), so a large
+# embedding batch is only compared with batches of similar size.
+DEFAULT_PERCENTILE = 0.95
+DEFAULT_BUDGET = 0.05
+MIN_SAMPLES = 20 # No hedging until this many latencies have been observed for a key
+LATENCY_WINDOW = 500
+MIN_HEDGE_DELAY = 0.05 # seconds
+
+
+def size_bucket(count):
+    """Power-of-two bucket for a batch size (1, 2, 4, 8, ...), used in latency keys."""
+    return 1 << (max(1, count).bit_length() - 1)
+
+
+class LatencyTracker:
+    """Sliding window of recent latencies per key, e.g. (model, stage, operation, size bucket)."""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.window = window
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def observe(self, key, seconds):
+        with self.lock:
+            self.samples.setdefault(key, collections.deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, key, fraction):
+        with self.lock:
+            samples = sorted(self.samples.get(key, ()))
+        if len(samples) < MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+class Hedger:
+    """
+    Runs calls with an optional hedge.
+
+    Args:
+        percentile (float): Hedge once the first attempt is slower than this percentile
+                            of recently observed latency for the same key.
+        budget (float): Hedges allowed as a fraction of calls. Enforced on the running
+                        totals (hedges <= budget x calls at all times), so extra requests
+                        never exceed the budget; credit earned by fast calls still lets
+                        a short burst of slow ones be hedged.
+        max_workers (int): Threads used for the attempts.
+
+    The losing attempt can't be aborted mid-request (the SDK calls are blocking), so it
+    is cancelled if it hasn't started and otherwise left to finish with its result dropped.
+    """
+
+    def __init__(self, percentile=DEFAULT_PERCENTILE, budget=DEFAULT_BUDGET, max_workers=64):
+        self.percentile = percentile
+        self.budget = budget
+        self.tracker = LatencyTracker()
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+        self.lock = threading.Lock()
+        self.stats = {"calls": 0, "hedges": 0, "hedge_wins": 0, "budget_denied": 0}
+
+    def _take_budget(self):
+        with self.lock:
+            if self.stats["hedges"] + 1 <= self.budget * self.stats["calls"]:
+                self.stats["hedges"] += 1
+                return True
+            self.stats["budget_denied"] += 1
+            return False
+
+    def _timed(self, call):
+        start = time.perf_counter()
+        result = call()
+        return result, time.perf_counter() - start
+
+    def call(self, call, key):
+        """
+        Runs call() (hedged if it is slow) and returns its result.
+
+        Returns:
+            tuple: (result, hedged) where hedged tells whether a second request was sent.
+        """
+        with self.lock:
+            self.stats["calls"] += 1
+        delay = self.tracker.percentile(key, self.percentile)
+        start = time.perf_counter()
+        first = self.pool.submit(self._timed, call)
+        if delay is None:
+            result, latency = first.result()
+            self.tracker.observe(key, latency)
+            return result, False
+
+        done, _ = wait([first], timeout=max(MIN_HEDGE_DELAY, delay))
+        if done or not self._take_budget():
+            result, latency = first.result()
+            self.tracker.observe(key, latency)
+            return result, False
+
+        second = self.pool.submit(self._timed, call)
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                for loser in pending:
+                    loser.cancel()
+                result, _ = future.result()
+                # The latency the caller saw, not the winning attempt's own duration.
+                self.tracker.observe(key, time.perf_counter() - start)
+                if future is second:
+                    with self.lock:
+                        self.stats["hedge_wins"] += 1
+                return result, True
+        raise error
+
+
+def hedger_from_env():
+    """Returns a Hedger if HEDGE_PERCENTILE is set, else None."""
+    percentile = os.getenv("HEDGE_PERCENTILE")
+    if not percentile:
+        return None
+    return Hedger(percentile=float(percentile), budget=float(os.getenv("HEDGE_BUDGET", DEFAULT_BUDGET)))
+
+
+# --- Benchmark (against the heavy-tailed local stand-in) ---
+def _percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def run_benchmark(requests=400, concurrency=8, latency="pareto:200,1.5", percentile=DEFAULT_PERCENTILE, budget=DEFAULT_BUDGET, seed=0):
+    import google.generativeai as genai
+    from geminiReplay import Cassette, GeminiReplay
+
+    prompt = "How tall is the Eiffel Tower?"
+    model = genai.GenerativeModel('gemini-1.5-flash-latest')
+    print(f"--- Hedging benchmark: {requests} requests, concurrency {concurrency}, latency {latency} ---")
+    for hedged in (False, True):
+        replay = GeminiReplay(cassette=Cassette(None), latency=latency, on_miss="synthetic", seed=seed).install()
+        hedger = Hedger(percentile=percentile, budget=budget) if hedged else None
+
+        def one(_):
+            start = time.perf_counter()
+            if hedger:
+                hedger.call(lambda: model.generate_content(prompt), key=(model.model_name, "benchmark", "generate", 1))
+            else:
+                model.generate_content(prompt)
+            return time.perf_counter() - start
+
+        try:
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                latencies = sorted(pool.map(one, range(requests)))
+        finally:
+            replay.uninstall()
+        label = f"hedged (p{percentile * 100:g}, budget {budget:.0%})" if hedged else "baseline"
+        extra = replay.stats["calls"] / requests - 1
+        print(f"{label:>28}: p50 {_percentile(latencies, 0.5) * 1000:.0f} ms, p99 {_percentile(latencies, 0.99) * 1000:.0f} ms, "
+              f"max {latencies[-1] * 1000:.0f} ms, extra requests {extra:.1%}")
+        if hedger:
+            print(f"{'':>28}  {hedger.stats}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure p99 reduction from hedged requests against the local Gemini stand-in.")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", default="pareto:200,1.5", help="Stand-in latency spec (heavy-tailed)")
+    parser.add_argument("--percentile", type=float, default=DEFAULT_PERCENTILE)
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET)
+    args = parser.parse_args()
+
+    run_benchmark(args.requests, args.concurrency, args.latency, args.percentile, args.budget)
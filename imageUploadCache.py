@@ -0,0 +1,198 @@
+import google.generativeai as genai
+import datetime
+import hashlib
+import io
+import json
+import os
+import time
+
+# --- Configuration ---
+# Uploaded files live on the Gemini Files API for 48 hours. We keep a small
+# safety margin so we never hand out a handle that expires mid-conversation.
+IMAGE_CACHE_PATH = "./.image_upload_cache.json"
+DEFAULT_FILE_TTL = datetime.timedelta(hours=48)
+EXPIRY_SAFETY_MARGIN = datetime.timedelta(minutes=10)
+
+
+def image_to_bytes(img):
+    """
+    Serializes a PIL image (or raw bytes) once so it can be hashed and uploaded.
+
+    Args:
+        img: A PIL.Image.Image, or bytes that are already encoded.
+
+    Returns:
+        tuple: (image_bytes, mime_type)
+    """
+    if isinstance(img, (bytes, bytearray)):
+        return bytes(img), "image/jpeg"
+
+    image_format = (img.format or "PNG").upper()
+    if image_format == "JPG":
+        image_format = "JPEG"
+    buffer = io.BytesIO()
+    img.save(buffer, format=image_format)
+    return buffer.getvalue(), f"image/{image_format.lower()}"
+
+
+def image_hash(img):
+    """SHA-256 of the encoded image; the key of ImageUploadCache."""
+    return hashlib.sha256(image_to_bytes(img)[0]).hexdigest()
+
+
+def file_handle_part(handle):
+    """
+    Builds the chat part that references an uploaded file by URI.
+    Only this tiny reference is stored in chat.history, not the image bytes.
+    """
+    return {"file_data": {"file_uri": handle["uri"], "mime_type": handle["mime_type"]}}
+
+
+# --- Uploaders ---
+def gemini_file_uploader(image_bytes, mime_type, display_name):
+    """
+    Uploads bytes through the Gemini Files API and waits until the file is usable.
+
+    Returns:
+        dict: A handle with 'name', 'uri', 'mime_type' and 'expires_at' (ISO string).
+    """
+    uploaded = genai.upload_file(io.BytesIO(image_bytes), mime_type=mime_type, display_name=display_name)
+    # Images are normally ACTIVE right away, but larger media may still be processing.
+    while uploaded.state.name == "PROCESSING":
+        time.sleep(1)
+        uploaded = genai.get_file(uploaded.name)
+    if uploaded.state.name != "ACTIVE":
+        raise ValueError(f"Uploaded file '{uploaded.name}' ended in state {uploaded.state.name}.")
+
+    expires_at = getattr(uploaded, "expiration_time", None)
+    if not expires_at:
+        expires_at = datetime.datetime.now(datetime.timezone.utc) + DEFAULT_FILE_TTL
+    return {
+        "name": uploaded.name,
+        "uri": uploaded.uri,
+        "mime_type": mime_type,
+        "expires_at": expires_at.isoformat(),
+    }
+
+
+class LocalFileUploader:
+    """
+    Offline stand-in for the Files API. Keeps bytes in memory and hands out
+    'local://' URIs, so the caching logic can be exercised without an API key.
+    """
+
+    def __init__(self, ttl=DEFAULT_FILE_TTL):
+        self.ttl = ttl
+        self.files = {}
+        self.upload_count = 0
+
+    def __call__(self, image_bytes, mime_type, display_name):
+        self.upload_count += 1
+        name = f"files/local-{self.upload_count}"
+        self.files[name] = image_bytes
+        expires_at = datetime.datetime.now(datetime.timezone.utc) + self.ttl
+        return {
+            "name": name,
+            "uri": f"local://{name}",
+            "mime_type": mime_type,
+            "expires_at": expires_at.isoformat(),
+        }
+
+
+# --- Content-hash -> handle cache ---
+class ImageUploadCache:
+    """
+    Uploads each distinct image once and reuses its file handle afterwards.
+
+    Handles are keyed by the SHA-256 of the encoded image, so the same picture
+    opened twice (or in another run, when persisted) maps to the same upload.
+    Expired (or nearly expired) handles are dropped and re-uploaded.
+    """
+
+    def __init__(self, uploader=None, cache_path=IMAGE_CACHE_PATH, safety_margin=EXPIRY_SAFETY_MARGIN):
+        self.uploader = uploader or gemini_file_uploader
+        self.cache_path = cache_path
+        self.safety_margin = safety_margin
+        self.handles = {}
+        self.uploads = 0
+        self.hits = 0
+        if self.cache_path and os.path.exists(self.cache_path):
+            try:
+                with open(self.cache_path, "r", encoding="utf-8") as f:
+                    self.handles = json.load(f)
+            except (OSError, ValueError):
+                self.handles = {}
+
+    def _is_fresh(self, handle):
+        expires_at = datetime.datetime.fromisoformat(handle["expires_at"])
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return expires_at - self.safety_margin > now
+
+    def _save(self):
+        if not self.cache_path:
+            return
+        with open(self.cache_path, "w", encoding="utf-8") as f:
+            json.dump(self.handles, f, indent=2)
+
+    def get_or_upload(self, img, display_name=None):
+        """
+        Returns a file handle for the image, uploading it only if needed.
+
+        Args:
+            img: A PIL image or encoded image bytes.
+            display_name (str): Optional name shown in the Files API.
+
+        Returns:
+            dict: The cached handle ('name', 'uri', 'mime_type', 'expires_at').
+        """
+        image_bytes, mime_type = image_to_bytes(img)
+        content_hash = hashlib.sha256(image_bytes).hexdigest() # Same as image_hash(img), without encoding twice
+
+        handle = self.handles.get(content_hash)
+        if handle and self._is_fresh(handle):
+            self.hits += 1
+            return handle
+
+        handle = self.uploader(image_bytes, mime_type, display_name or content_hash[:16])
+        self.uploads += 1
+        self.handles[content_hash] = handle
+        self._save()
+        return handle
+
+    def part_for(self, img, display_name=None):
+        """Convenience wrapper returning the chat part for an image."""
+        return file_handle_part(self.get_or_upload(img, display_name))
+
+    def purge_expired(self):
+        """Drops expired handles from the cache. Returns how many were removed."""
+        expired = [h for h, handle in self.handles.items() if not self._is_fresh(handle)]
+        for content_hash in expired:
+            del self.handles[content_hash]
+        if expired:
+            self._save()
+        return len(expired)
+
+
+def replace_file_uris(history, uri_map):
+    """
+    Points file_data parts at new URIs (old uri -> new uri), in place, e.g. after an
+    expired upload was re-uploaded. Returns how many parts were changed.
+    """
+    replaced = 0
+    for content in history:
+        for part in content.parts:
+            if part.file_data.file_uri in uri_map:
+                part.file_data.file_uri = uri_map[part.file_data.file_uri]
+                replaced += 1
+    return replaced
+
+
+def history_payload_bytes(history):
+    """
+    Approximates how many bytes the chat history adds to every request
+    by serializing each Content proto (this is what gets re-sent each turn).
+    """
+    total = 0
+    for content in history:
+        total += len(type(content).serialize(content))
+    return total
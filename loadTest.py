@@ -0,0 +1,226 @@
+import google.generativeai as genai
+from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import chromadb
+import os
+import threading
+import time
+
+from geminiReplay import Cassette, GeminiReplay, DEFAULT_CASSETTE_PATH
+from usageMetrics import metered_embed_content, metered_generate_content, start_metrics_server
+from modelRouter import ModelRouter
+
+# --- Configuration ---
+EMBEDDING_MODEL_NAME = "text-embedding-004"
+GENERATIVE_MODEL_NAME = 'gemini-1.5-flash-latest'
+TOP_K = 2
+
+# Same knowledge base and questions as RAGwithchromaDB.py.
+KNOWLEDGE_BASE = [
+    "The Eiffel Tower is a wrought-iron lattice tower on the Champ de Mars in Paris, France.",
+    "It is named after the engineer Gustave Eiffel, whose company designed and built the tower.",
+    "Constructed from 1887 to 1889 as the centerpiece of the 1889 World's Fair, it was initially criticized by some of France's leading artists and intellectuals for its design.",
+    "The tower is 330 metres (1,083 ft) tall, about the same height as an 81-storey building, and is the tallest structure in Paris.",
+    "Millions of people ascend it every year, making it one of the most visited paid monuments in the world.",
+    "The official currency of Japan is the Yen.",
+    "Japan is an island country in East Asia, located in the northwest Pacific Ocean."
+]
+QUERIES = [
+    "How tall is the Eiffel Tower?",
+    "What currency is used in Japan?",
+    "Who designed the Eiffel Tower?",
+    "What is the capital of Germany?",
+]
+QNA_TURNS_PER_SESSION = 5 # Chat sessions are restarted after this many turns, like users leaving
+
+
+def build_collection():
+    """In-memory Chroma collection with the knowledge base, embedded through the (replayed) API."""
+    client = chromadb.Client()
+    collection = client.get_or_create_collection(name="load_test_collection")
+    embeddings = metered_embed_content(
+        stage="embed_documents",
+        model=EMBEDDING_MODEL_NAME,
+        content=KNOWLEDGE_BASE,
+        task_type="RETRIEVAL_DOCUMENT"
+    )['embedding']
+    collection.add(embeddings=embeddings, documents=KNOWLEDGE_BASE, ids=[f"doc_{i}" for i in range(len(KNOWLEDGE_BASE))])
+    return collection
+
+
+def retrieve_context(collection, query):
+    query_embedding = metered_embed_content(
+        stage="embed_query",
+        model=EMBEDDING_MODEL_NAME,
+        content=query,
+        task_type="RETRIEVAL_QUERY"
+    )['embedding']
+    results = collection.query(query_embeddings=[query_embedding], n_results=TOP_K)
+    return "\n".join(results.get('documents', [[]])[0]) or "No specific context found."
+
+
+def make_rag_workload(collection):
+    """One RAGwithchromaDB.py query: embed, retrieve, pack prompt, generate."""
+    model = genai.GenerativeModel(GENERATIVE_MODEL_NAME)
+
+    def run(request_index):
+        query = QUERIES[request_index % len(QUERIES)]
+        context = retrieve_context(collection, query)
+        prompt = f"Answer the user's question based ONLY on the following context.\n\nContext:\n{context}\n\nUser Question: {query}\n\nAnswer:\n"
+        return metered_generate_content(model, prompt, stage="generate_answer").text
+    return run
+
+
+def make_qna_workload(collection):
+    """One run_qna_bot turn: a plain chat turn, then the RAG-augmented follow-up (context kept out of history)."""
+    router = ModelRouter(routes=[(GENERATIVE_MODEL_NAME, 60.0)])
+    local = threading.local() # One chat session per worker thread
+
+    def run(request_index):
+        if getattr(local, "turns", QNA_TURNS_PER_SESSION) >= QNA_TURNS_PER_SESSION:
+            local.chat = router.start_chat()
+            local.turns = 0
+        local.turns += 1
+        query = QUERIES[request_index % len(QUERIES)]
+        local.chat.send_message(query, stage="chat_tool_turn")
+        context = retrieve_context(collection, query)
+        rag_input = f"Please answer the following user question based ONLY on the provided context.\n\nContext from Documents:\n{context}\n\nOriginal User Question: {query}\n\nAnswer:"
+        return local.chat.send_message(rag_input, stage="generate_answer", history_content=query).text
+    return run
+
+
+def measure_history_growth(collection, turns, ephemeral):
+    """Prompt tokens per RAG turn in one long chat session, with or without ephemeral context."""
+    chat = ModelRouter(routes=[(GENERATIVE_MODEL_NAME, 60.0)]).start_chat()
+    prompt_tokens = []
+    for turn in range(turns):
+        query = QUERIES[turn % len(QUERIES)]
+        context = retrieve_context(collection, query)
+        rag_input = f"Please answer the following user question based ONLY on the provided context.\n\nContext from Documents:\n{context}\n\nOriginal User Question: {query}\n\nAnswer:"
+        response = chat.send_message(rag_input, stage="generate_answer", history_content=query if ephemeral else None)
+        prompt_tokens.append(response.usage_metadata.prompt_token_count)
+    return prompt_tokens
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def run_load(workload, qps, duration, concurrency):
+    """
+    Open-loop load: requests are scheduled at a fixed rate regardless of how fast
+    earlier ones finish, and latency is measured from the *scheduled* start, so
+    queueing delay is included (no coordinated omission).
+
+    Returns:
+        dict: throughput, latency percentiles, errors and client CPU cost.
+    """
+    total_requests = max(1, int(qps * duration))
+    interval = 1.0 / qps
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def timed(request_index, scheduled):
+        try:
+            workload(request_index)
+            with lock:
+                latencies.append(time.perf_counter() - scheduled)
+        except Exception as e:
+            with lock:
+                errors.append(f"{type(e).__name__}: {e}")
+
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for request_index in range(total_requests):
+            scheduled = start + request_index * interval
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(timed, request_index, scheduled)
+    wall = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+
+    latencies.sort()
+    completed = len(latencies)
+    return {
+        "requests": total_requests,
+        "completed": completed,
+        "errors": len(errors),
+        "throughput_rps": completed / wall,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p90_ms": percentile(latencies, 0.90) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": (latencies[-1] if latencies else 0.0) * 1000,
+        "client_cpu_s": cpu,
+        "cpu_ms_per_request": cpu * 1000 / total_requests,
+        "cpu_utilization": cpu / wall,
+        "sample_errors": errors[:3],
+    }
+
+
+def print_report(name, report):
+    print(f"\n--- Load Test: {name} ---")
+    print(f"Requests: {report['requests']} (completed {report['completed']}, errors {report['errors']})")
+    print(f"Throughput: {report['throughput_rps']:.1f} req/s")
+    print(f"Latency: p50 {report['p50_ms']:.1f} ms, p90 {report['p90_ms']:.1f} ms, p99 {report['p99_ms']:.1f} ms, max {report['max_ms']:.1f} ms")
+    print(f"Client CPU: {report['client_cpu_s']:.2f} s total, {report['cpu_ms_per_request']:.2f} ms/request, {report['cpu_utilization']:.0%} of one core")
+    for error in report["sample_errors"]:
+        print(f"  e.g. {error}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drive RAG / Q&A workloads against the Gemini stand-in at a target QPS.")
+    parser.add_argument("--workload", choices=["rag", "qna"], default="rag")
+    parser.add_argument("--qps", type=float, default=20)
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of load")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--mode", choices=["replay", "record", "live"], default="replay")
+    parser.add_argument("--cassette", default=DEFAULT_CASSETTE_PATH)
+    parser.add_argument("--latency", default="lognormal:600,0.5", help="Replay latency spec, e.g. fixed:300 or pareto:200,1.8")
+    parser.add_argument("--error-429", type=float, default=0.0)
+    parser.add_argument("--error-503", type=float, default=0.0)
+    parser.add_argument("--on-miss", choices=["error", "synthetic"], default="synthetic")
+    parser.add_argument("--history-growth", type=int, metavar="TURNS", help="Instead of a load test, compare prompt tokens per turn with and without ephemeral RAG context")
+    args = parser.parse_args()
+
+    load_dotenv()
+    if args.mode != "replay":
+        api_key = os.getenv("GOOGLE_API_KEY")
+        if not api_key:
+            raise ValueError("GOOGLE_API_KEY not found.")
+        genai.configure(api_key=api_key)
+
+    start_metrics_server() # Only if METRICS_PORT is set
+    replay = None
+    if args.mode != "live":
+        replay = GeminiReplay(
+            cassette=Cassette(args.cassette),
+            mode=args.mode,
+            latency=args.latency,
+            error_rate_429=args.error_429,
+            error_rate_503=args.error_503,
+            on_miss=args.on_miss,
+        ).install()
+
+    try:
+        collection = build_collection()
+        if args.history_growth:
+            persisted = measure_history_growth(collection, args.history_growth, ephemeral=False)
+            ephemeral = measure_history_growth(collection, args.history_growth, ephemeral=True)
+            print(f"\n--- Prompt tokens per RAG turn over {args.history_growth} turns ---")
+            print(f"Context kept in history: {persisted}")
+            print(f"Ephemeral context:       {ephemeral}")
+            print(f"Total prompt tokens: {sum(persisted)} -> {sum(ephemeral)} ({1 - sum(ephemeral) / sum(persisted):.0%} saved)")
+        else:
+            workload = make_rag_workload(collection) if args.workload == "rag" else make_qna_workload(collection)
+            report = run_load(workload, args.qps, args.duration, args.concurrency)
+            print_report(f"{args.workload} @ {args.qps} QPS ({args.mode})", report)
+            if replay:
+                print(f"Stand-in stats: {replay.stats}")
+    finally:
+        if replay:
+            replay.uninstall()
@@ -0,0 +1,70 @@
+import time
+
+import numpy as np
+
+# --- Configuration ---
+# Maximal Marginal Relevance: pick chunks that are relevant to the query but not
+# redundant with chunks already picked. lambda_mult=1.0 is plain similarity ranking,
+# lower values favour diversity.
+DEFAULT_FETCH_K = 8 # Candidates over-fetched from the vector store
+DEFAULT_LAMBDA = 0.5
+
+
+def _normalize(matrix):
+    matrix = np.atleast_2d(np.asarray(matrix, dtype=np.float32))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def mmr_select(query_embedding, candidate_embeddings, k, lambda_mult=DEFAULT_LAMBDA):
+    """
+    Greedy MMR over the candidates.
+
+    The query/candidate and candidate/candidate similarities are computed with two
+    matrix products up front; each of the k selection steps is then a vectorized
+    update of the "most similar already-selected chunk" vector.
+
+    Returns:
+        list: Indices into candidate_embeddings, in selection order.
+    """
+    if len(candidate_embeddings) == 0 or k <= 0: # Checked first: _normalize([]) has shape (1, 0)
+        return []
+    candidates = _normalize(candidate_embeddings)
+    relevance = candidates @ _normalize(query_embedding)[0]
+    pairwise = candidates @ candidates.T
+
+    k = min(k, len(candidates))
+    selected = [int(np.argmax(relevance))]
+    redundancy = pairwise[selected[0]].copy()
+    available = np.ones(len(candidates), dtype=bool)
+    available[selected[0]] = False
+    for _ in range(k - 1):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(redundancy, pairwise[best], out=redundancy)
+    return selected
+
+
+def mmr_rerank_results(results, query_embedding, k, lambda_mult=DEFAULT_LAMBDA):
+    """
+    Re-ranks one query's Chroma results (queried with include=[..., "embeddings"]).
+
+    Returns:
+        tuple: (results dict with the same keys, each list cut to the k MMR picks,
+                rerank time in milliseconds)
+    """
+    start = time.perf_counter()
+    embeddings = results.get("embeddings")
+    candidates = embeddings[0] if embeddings is not None and len(embeddings) else []
+    order = mmr_select(query_embedding, candidates, k, lambda_mult)
+    reranked = {}
+    for key in ("ids", "documents", "metadatas", "distances"):
+        values = results.get(key)
+        if values is not None and len(values) and values[0] is not None:
+            reranked[key] = [[values[0][i] for i in order]]
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    return reranked, elapsed_ms
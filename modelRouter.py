@@ -0,0 +1,298 @@
+import google.generativeai as genai
+from google.generativeai.types import content_types, generation_types
+from google.api_core import exceptions as google_exceptions
+import collections
+import threading
+import time
+
+from usageMetrics import METRICS, metered_generate_content, metered_send_message
+
+# --- Configuration ---
+# (model name, latency SLO in seconds), in order of preference. Traffic goes to the first
+# model whose circuit is closed; a model that breaches its SLO or keeps erroring is taken
+# out of rotation for COOLDOWN_SECONDS and then probed with a single live request.
+DEFAULT_ROUTES = [
+    ("gemini-1.5-flash-latest", 8.0),
+    ("gemini-1.5-flash-8b", 8.0),
+    ("gemini-1.5-pro-latest", 15.0),
+]
+WINDOW = 20 # Recent calls per model used for the SLO / error-rate checks
+MIN_SAMPLES = 5
+SLO_PERCENTILE = 0.9 # p90 latency must stay under the SLO
+MAX_ERROR_RATE = 0.5
+COOLDOWN_SECONDS = 30.0
+TIMEOUT_FACTOR = 3 # Per-request timeout = SLO * TIMEOUT_FACTOR, so a hung call can fail over.
+# Non-streaming calls only: on a stream the timeout would cap the whole answer, not the wait for it.
+# Router calls are not retried (neither by the metered helpers nor by the SDK's own 503
+# retry): a rate-limited or unavailable model fails over at once instead of sleeping.
+
+# Only these errors mean the model (not the request) is the problem, so only they count
+# against its breaker and fail over: timeouts, 429 and 5xx. Safety blocks and other 4xx
+# errors would fail the same way on every model, so they are raised to the caller at once.
+FAILOVER_ERRORS = (
+    google_exceptions.ServerError, # 5xx, including 504 DeadlineExceeded
+    google_exceptions.TooManyRequests, # 429 / ResourceExhausted
+    google_exceptions.RetryError, # The SDK's own retries gave up (e.g. on repeated timeouts)
+    TimeoutError,
+    ConnectionError,
+)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+def _router_kwargs(kwargs, timeout):
+    """No retries, and (non-streaming) a per-request timeout, unless the caller passed its own request_options."""
+    kwargs = dict(kwargs, retries=0)
+    if "request_options" not in kwargs:
+        kwargs["request_options"] = {"retry": None} if kwargs.get("stream") else {"timeout": timeout, "retry": None}
+    return kwargs
+
+
+class CircuitBreaker:
+    """Rolling latency / error window for one model, with closed -> open -> half-open states."""
+
+    def __init__(self, model_name, latency_slo, cooldown=COOLDOWN_SECONDS):
+        self.model_name = model_name
+        self.latency_slo = latency_slo
+        self.cooldown = cooldown
+        self.calls = collections.deque(maxlen=WINDOW) # (latency, ok)
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """True if a request may go to this model (in half-open state: only one probe at a time)."""
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self.probe_in_flight:
+                self.probe_in_flight = True
+                METRICS.inc("genai_circuit_probes_total", self.model_name, "router", "route")
+                return True
+            return False
+
+    def record(self, latency, ok):
+        with self.lock:
+            if self.state == HALF_OPEN:
+                self.probe_in_flight = False
+                if ok and latency <= self.latency_slo:
+                    self.state = CLOSED
+                    self.calls.clear()
+                    METRICS.inc("genai_circuit_closed_total", self.model_name, "router", "route")
+                else:
+                    self._open()
+                return
+            self.calls.append((latency, ok))
+            if self.state == CLOSED and self._breached():
+                self._open()
+
+    def release(self):
+        """Ends a half-open probe without a verdict (the request failed for reasons of its own)."""
+        with self.lock:
+            if self.state == HALF_OPEN:
+                self.probe_in_flight = False
+
+    def _breached(self):
+        if len(self.calls) < MIN_SAMPLES:
+            return False
+        errors = sum(1 for _, ok in self.calls if not ok)
+        latencies = sorted(latency for latency, ok in self.calls if ok)
+        slow = bool(latencies) and latencies[min(len(latencies) - 1, int(len(latencies) * SLO_PERCENTILE))] > self.latency_slo
+        return errors / len(self.calls) > MAX_ERROR_RATE or slow
+
+    def _open(self):
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        METRICS.inc("genai_circuit_opened_total", self.model_name, "router", "route")
+
+
+class ModelRouter:
+    """
+    Sends each request to the preferred healthy model and fails over down the list.
+
+    Args:
+        routes (list): [(model_name, latency_slo_seconds), ...] in order of preference.
+        model_factory (callable): model_name -> GenerativeModel, so every fallback gets
+                                  the same tools / safety settings / generation config.
+    """
+
+    def __init__(self, routes=DEFAULT_ROUTES, model_factory=genai.GenerativeModel, cooldown=COOLDOWN_SECONDS):
+        self.routes = list(routes)
+        self.model_factory = model_factory
+        self.breakers = {name: CircuitBreaker(name, slo, cooldown) for name, slo in self.routes}
+        self.models = {}
+
+    def model(self, name):
+        if name not in self.models:
+            self.models[name] = self.model_factory(name)
+        return self.models[name]
+
+    def call(self, attempt, stage):
+        """
+        Runs attempt(model_name, timeout) on the first healthy model, failing over on
+        FAILOVER_ERRORS; any other error (safety block, invalid request) is raised at once.
+        Health is checked lazily, so a half-open model is only probed when traffic reaches it.
+
+        Returns:
+            tuple: (result, model_name that answered)
+        """
+        tried = []
+        for name, _ in self.routes:
+            if not self.breakers[name].allow():
+                continue
+            tried.append(name)
+            ok, outcome = self._attempt(name, attempt, stage, failover=len(tried) > 1)
+            if ok:
+                return outcome, name
+            last_error = outcome
+        if not tried:
+            # Every circuit open: still try them all in order rather than refuse to answer.
+            for i, (name, _) in enumerate(self.routes):
+                ok, outcome = self._attempt(name, attempt, stage, failover=i > 0)
+                if ok:
+                    return outcome, name
+                last_error = outcome
+        raise last_error
+
+    def _attempt(self, name, attempt, stage, failover):
+        breaker = self.breakers[name]
+        if failover:
+            METRICS.inc("genai_route_failovers_total", name, stage, "route")
+        METRICS.inc("genai_route_requests_total", name, stage, "route")
+        start = time.perf_counter()
+        try:
+            result = attempt(name, breaker.latency_slo * TIMEOUT_FACTOR)
+        except FAILOVER_ERRORS as e:
+            breaker.record(time.perf_counter() - start, False)
+            return False, e
+        except Exception:
+            breaker.release() # Not the model's fault: no failover, no mark against it
+            raise
+        breaker.record(time.perf_counter() - start, True)
+        return True, result
+
+    def generate_content(self, contents, stage="generate", **kwargs):
+        """metered_generate_content on the best available model."""
+        response, _ = self.call(
+            lambda name, timeout: metered_generate_content(self.model(name), contents, stage=stage, **_router_kwargs(kwargs, timeout)),
+            stage,
+        )
+        return response
+
+    def start_chat(self, history=None, **chat_kwargs):
+        return RoutedChat(self, history, **chat_kwargs)
+
+    def states(self):
+        return {name: breaker.state for name, breaker in self.breakers.items()}
+
+
+class RoutedChat:
+    """
+    A chat session that can move between models: when the router picks a different
+    model, a new ChatSession is started on it with the conversation history so far.
+    """
+
+    def __init__(self, router, history=None, **chat_kwargs):
+        self.router = router
+        self.chat_kwargs = chat_kwargs
+        self.model_name = router.routes[0][0]
+        self.chat = router.model(self.model_name).start_chat(history=history or [], **chat_kwargs)
+        self.turn_history = list(self.chat.history) # History before the current turn, for rewind()
+
+    @property
+    def history(self):
+        return self.chat.history
+
+    @property
+    def last(self):
+        """The last response not yet folded into the history (e.g. a stream that broke), else None."""
+        return self.chat.last
+
+    def rewind(self):
+        """ChatSession.rewind, which also works on a stream that was abandoned part-way."""
+        try:
+            return self.chat.rewind()
+        except generation_types.IncompleteIterationError:
+            self.chat.history = self.turn_history # Back to where the turn started
+
+    def _chat_for(self, name):
+        if name != self.model_name:
+            self.chat = self.router.model(name).start_chat(history=list(self.chat.history), **self.chat_kwargs)
+            self.model_name = name
+        return self.chat
+
+    def send_message(self, content, stage="chat", history_content=None, **kwargs):
+        """
+        metered_send_message on the best available model. For streams, only the call (up to the first chunk) is
+        timed, and no request timeout is set, so a long healthy answer is never cut off.
+
+        Args:
+            history_content: If given, stored in the history for this turn instead of `content`.
+                             Used to send retrieved context with one request only (the history
+                             keeps just the question), so later turns don't re-send it. For
+                             streams the swap happens when the stream ends; if it broke (error,
+                             safety stop) the turn is rewound instead.
+
+        The SDK can't stream with automatic function calling, so a streamed turn on such a
+        chat is sent with function calling turned off (tool_config mode NONE).
+        """
+        stream = kwargs.get("stream")
+        no_tools = stream and self.chat_kwargs.get("enable_automatic_function_calling")
+        if no_tools:
+            kwargs.setdefault("tool_config", {"function_calling_config": {"mode": "NONE"}})
+        self.turn_history = list(self.history)
+        turn_start = len(self.turn_history)
+
+        def attempt(name, timeout):
+            chat = self._chat_for(name)
+            if not no_tools:
+                return metered_send_message(chat, content, stage=stage, **_router_kwargs(kwargs, timeout))
+            chat.enable_automatic_function_calling = False # Only checked when the request is sent
+            try:
+                return metered_send_message(chat, content, stage=stage, **_router_kwargs(kwargs, timeout))
+            finally:
+                chat.enable_automatic_function_calling = True
+
+        response, _ = self.router.call(attempt, stage)
+        if history_content is None:
+            return response
+        if stream:
+            return _HistoryRewritingStream(response, lambda: self._finish_streamed_turn(turn_start, history_content))
+        self._replace_user_turn(turn_start, history_content)
+        return response
+
+    def _finish_streamed_turn(self, turn_start, history_content):
+        try:
+            self.chat.history # Folds the streamed answer into the history, or raises if it broke
+        except (generation_types.BrokenResponseError, generation_types.IncompleteIterationError):
+            self.rewind() # Drop the broken turn (with its context) rather than wedge the session
+            return
+        self._replace_user_turn(turn_start, history_content)
+
+    def _replace_user_turn(self, turn_start, history_content):
+        history = list(self.chat.history)
+        replacement = content_types.to_content(history_content)
+        replacement.role = "user"
+        history[turn_start] = replacement # The user turn we just sent; tool calls/answer follow it
+        self.chat.history = history
+
+
+class _HistoryRewritingStream:
+    """A streamed turn that is finished off (history swap, or rewind if it broke) when the stream ends, however it ends."""
+
+    def __init__(self, response, on_done):
+        self._response = response
+        self._on_done = on_done
+
+    def __iter__(self):
+        try:
+            for chunk in self._response:
+                yield chunk
+        finally: # Also on errors and when the reader stops early
+            self._on_done()
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
@@ -2,6 +2,9 @@ import google.generativeai as genai
 from dotenv import load_dotenv
 import os
 from PIL import Image # For loading images
+from imageUploadCache import ImageUploadCache, history_payload_bytes, image_hash, replace_file_uris
+from usageMetrics import metered_send_message, print_usage
+from chatSessionStore import SessionStore
 
 load_dotenv()
 
@@ -32,6 +35,13 @@ try:
     # 2. Text Prompt
     text_prompt = "Describe this image in detail. What do you see? and after that you have to ask user 'What kind of story should we create based on this image? (e.g., adventure, mystery, funny)' then User provides an opening line or a suggestion. you continue the story a paragraph.User adds to the story gives a new direction. and then will have to Repeat a few turns with user."
     
+    # 3. Upload-once mode
+    # When True, the image is uploaded once through the Files API and the chat
+    # history only keeps a small file reference. Otherwise the raw image sits in
+    # the history and is re-sent with every story-continuation turn.
+    use_file_upload = True
+    image_cache = ImageUploadCache() if use_file_upload else None
+
     model_name = 'gemini-1.5-flash-latest'
     model = genai.GenerativeModel(model_name)
 
@@ -45,12 +55,40 @@ try:
     # where elements can be text strings or image objects (from PIL).
     # The order can matter: often text first, then image, or interleaved.
     # The SDK handles converting the PIL Image object into the format the API needs.
-    chat = model.start_chat()
-    # You can also use streaming for multimodal if desired:
-    response_stream = chat.send_message([text_prompt, img], stream=True)
-    for chunk in response_stream:
-        print(chunk.text, end="", flush=True)
-    print()
+    # The story is persisted per CHAT_SESSION_ID; a restarted script continues it without
+    # describing the image again. An uploaded image's handle expires after 48 hours, so the
+    # session also records the image's content hash and the URI its history refers to; on
+    # resume the image is re-resolved (re-uploaded if expired) and the history repointed.
+    session_store = SessionStore()
+    session_id = os.getenv("CHAT_SESSION_ID", "image-story")
+    chat = session_store.session(session_id, model.start_chat)
+    response_stream = None
+    if chat.history:
+        print(f"Resuming the story ({len(chat.history)} messages so far).")
+        session_images = session_store.read_metadata(session_id).get("images", {}) # content hash -> file uri
+        if use_file_upload and session_images:
+            content_hash = image_hash(img)
+            if content_hash in session_images:
+                fresh_uri = image_cache.part_for(img, display_name=os.path.basename(image_path))['file_data']['file_uri']
+                if fresh_uri != session_images[content_hash]:
+                    history = list(chat.history)
+                    replace_file_uris(history, {session_images[content_hash]: fresh_uri})
+                    chat.replace_history(history)
+                    session_store.write_metadata(session_id, {"images": dict(session_images, **{content_hash: fresh_uri})})
+                    print(f"Image handle expired; re-uploaded as {fresh_uri}.")
+            else:
+                print(f"Warning: '{image_path}' is not the image this story started from; its upload may have expired.")
+    else:
+        # You can also use streaming for multimodal if desired:
+        image_part = image_cache.part_for(img, display_name=os.path.basename(image_path)) if use_file_upload else img
+        if use_file_upload:
+            print(f"Image handle: {image_part['file_data']['file_uri']} (uploads: {image_cache.uploads}, cache hits: {image_cache.hits})")
+            session_store.write_metadata(session_id, {"images": {image_hash(img): image_part['file_data']['file_uri']}})
+        response_stream = metered_send_message(chat, [text_prompt, image_part], stage="describe_image", stream=True)
+        for chunk in response_stream:
+            print(chunk.text, end="", flush=True)
+        print()
+        chat.flush()
 
     while True:
 
@@ -58,20 +96,18 @@ try:
         if user_input.lower() in ["quit", "exit"]:
             print("Exiting chat.")
             break
-        response_stream = chat.send_message(user_input, stream=True)
+        response_stream = metered_send_message(chat, user_input, stage="story_turn", stream=True)
         print(f"AI: " , end="")
         for chunk in response_stream:
             print(f"{chunk.text}", end="", flush=True)
         print()
+        chat.flush()
+        print(f"(history payload re-sent next turn: {history_payload_bytes(chat.history)} bytes)")
 
 
-    print("\n--- Usage Metadata (Tokens) ---")
-    if response_stream.usage_metadata:
-      print(f"Prompt tokens: {response_stream.usage_metadata.prompt_token_count}")
-      print(f"Candidates tokens: {response_stream.usage_metadata.candidates_token_count}")
-      print(f"Total tokens: {response_stream.usage_metadata.total_token_count}")
-    else:
-      print("Usage metadata not available.")
+    # Usage of the last fully streamed turn; every turn is also recorded in usageMetrics.METRICS.
+    if response_stream is not None:
+        print_usage(response_stream, "last turn")
 
 
 except Exception as e:
@@ -1,6 +1,7 @@
 import google.generativeai as genai
 from dotenv import load_dotenv
 import os
+from modelRouter import ModelRouter
 # No json import needed if functions return dicts
 
 # --- Define your Python functions ---
@@ -52,12 +53,13 @@ try:
     genai.configure(api_key=api_key)
 
     # --- Pass the Python function objects directly to the 'tools' parameter ---
-    model = genai.GenerativeModel(
-        'gemini-1.5-flash-latest',
+    # Every fallback model gets the same tools
+    router = ModelRouter(model_factory=lambda model_name: genai.GenerativeModel(
+        model_name,
         tools=[get_current_weather, get_meeting_details] # List of Python functions
-    )
+    ))
 
-    chat = model.start_chat(enable_automatic_function_calling=True)
+    chat = router.start_chat(enable_automatic_function_calling=True)
 
     print("AUTOMATIC Function Calling Chat (Weather & Meetings - Official Method). Type 'quit' to end.")
     print("-" * 30)
@@ -0,0 +1,223 @@
+import argparse
+import re
+import time
+import zlib
+
+import numpy as np
+
+# --- Configuration ---
+# Near-duplicate chunks are found with MinHash signatures over word shingles and LSH
+# banding: chunks sharing any band of their signature become candidates, and a
+# candidate counts as a duplicate if its estimated Jaccard similarity reaches
+# SIMILARITY_THRESHOLD. With 16 bands of 8 rows, pairs at 0.8 similarity collide with
+# probability ~0.97 and pairs at 0.5 with ~0.06, so only a few candidates are checked.
+NUM_PERM = 128
+NUM_BANDS = 16
+SHINGLE_WORDS = 3
+SIMILARITY_THRESHOLD = 0.8
+MAX_RECORDED_SOURCES = 20 # Duplicate sources kept in a canonical chunk's metadata
+DUPLICATE_SOURCES_KEY = "duplicate_sources"
+DUPLICATE_COUNT_KEY = "duplicate_count"
+
+_WORD = re.compile(r"\w+")
+_HASH_SHIFT = np.uint64(32)
+
+
+class NearDuplicateIndex:
+    """
+    Streaming near-duplicate detector: each chunk is compared only with the canonical
+    chunks already in its LSH buckets, so the cost grows linearly with the corpus.
+    The first chunk of a cluster is its canonical chunk.
+
+    Args:
+        threshold (float): Estimated Jaccard similarity at which a chunk is a duplicate.
+        num_perm (int): MinHash signature length.
+        bands (int): LSH bands (num_perm must be divisible by it).
+        shingle_words (int): Words per shingle.
+    """
+
+    def __init__(self, threshold=SIMILARITY_THRESHOLD, num_perm=NUM_PERM, bands=NUM_BANDS, shingle_words=SHINGLE_WORDS, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands.")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_words = shingle_words
+        rng = np.random.default_rng(seed)
+        # Multiply-shift hashing: h(x) = (a * x + b) >> 32 with odd 64-bit a
+        self.a = (rng.integers(1, 2**63, num_perm, dtype=np.uint64) | np.uint64(1)).reshape(-1, 1)
+        self.b = rng.integers(0, 2**63, num_perm, dtype=np.uint64).reshape(-1, 1)
+        self.band_mix = rng.integers(1, 2**63, self.rows, dtype=np.uint64) | np.uint64(1) # Folds a band's rows into one int key
+        self.buckets = [{} for _ in range(bands)] # band key -> [canonical positions]
+        self.signatures = [] # Signature per canonical chunk
+        self.canonical_ids = []
+        self.duplicates = {} # canonical id -> [duplicate ids]
+        self._word_hashes = {}
+        self.stats = {"chunks": 0, "duplicates": 0, "candidates_checked": 0}
+
+    def _shingle_hashes(self, text):
+        words = _WORD.findall(text.lower())
+        hashes = list(map(self._word_hashes.get, words))
+        if None in hashes:
+            if len(self._word_hashes) > 1_000_000:
+                self._word_hashes.clear()
+            for word in words:
+                if word not in self._word_hashes:
+                    self._word_hashes[word] = zlib.crc32(word.encode("utf-8"))
+            hashes = list(map(self._word_hashes.get, words))
+        words = np.array(hashes or [0], dtype=np.uint64)
+        count = len(words) - self.shingle_words + 1
+        if count < 1:
+            return words
+        shingles = words[:count].copy()
+        for i in range(1, self.shingle_words):
+            shingles = (shingles * np.uint64(1000003) + words[i:count + i]) & np.uint64(0xFFFFFFFF)
+        return np.unique(shingles)
+
+    def signatures_for(self, texts):
+        """MinHash signatures, one row of num_perm uint32 values per text (vectorized per batch)."""
+        if not texts:
+            return np.empty((0, self.num_perm), dtype=np.uint32)
+        shingle_sets = [self._shingle_hashes(text) for text in texts]
+        lengths = np.array([len(s) for s in shingle_sets])
+        shingles = np.concatenate(shingle_sets).reshape(1, -1)
+        # (num_perm, total shingles): each permutation's hashes are contiguous for reduceat
+        hashed = ((self.a * shingles + self.b) >> _HASH_SHIFT).astype(np.uint32)
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        return np.minimum.reduceat(hashed, starts, axis=1).T.copy()
+
+    def add_batch(self, texts, ids):
+        """
+        Adds chunks in order.
+
+        Returns:
+            list: For each chunk, None if it is canonical (new), else the id of the
+                  canonical chunk it duplicates.
+        """
+        signatures = self.signatures_for(texts)
+        band_keys = (signatures.reshape(len(texts), self.bands, self.rows).astype(np.uint64) * self.band_mix).sum(axis=2, dtype=np.uint64).tolist()
+        results = []
+        for i, doc_id in enumerate(ids):
+            self.stats["chunks"] += 1
+            keys = band_keys[i]
+            candidates = {position for band, key in enumerate(keys) for position in self.buckets[band].get(key, ())}
+            match = None
+            for position in sorted(candidates): # Oldest canonical chunk first
+                self.stats["candidates_checked"] += 1
+                if np.count_nonzero(self.signatures[position] == signatures[i]) >= self.threshold * self.num_perm:
+                    match = position
+                    break
+            if match is not None:
+                canonical_id = self.canonical_ids[match]
+                self.duplicates.setdefault(canonical_id, []).append(doc_id)
+                self.stats["duplicates"] += 1
+                results.append(canonical_id)
+                continue
+            position = len(self.canonical_ids)
+            self.canonical_ids.append(doc_id)
+            self.signatures.append(signatures[i])
+            for band, key in enumerate(keys):
+                self.buckets[band].setdefault(key, []).append(position)
+            results.append(None)
+        return results
+
+    def duplicate_metadata(self, canonical_id):
+        """Metadata fields recording which chunks were folded into canonical_id."""
+        sources = self.duplicates.get(canonical_id, [])
+        if not sources:
+            return {}
+        return {DUPLICATE_COUNT_KEY: len(sources), DUPLICATE_SOURCES_KEY: ";".join(sources[:MAX_RECORDED_SOURCES])}
+
+
+def deduplicate_chunks(documents, metadatas, ids, sources=None, index=None):
+    """
+    Keeps one canonical chunk per near-duplicate cluster before embedding.
+
+    Args:
+        sources (list): Names recorded for duplicates (e.g. "file#chunk"); defaults to ids.
+        index (NearDuplicateIndex): Pass one to deduplicate across several calls.
+
+    Returns:
+        tuple: (documents, metadatas, ids) of the canonical chunks, with the sources of their
+               duplicates recorded under DUPLICATE_SOURCES_KEY / DUPLICATE_COUNT_KEY.
+    """
+    if not documents:
+        return [], [], []
+    index = index or NearDuplicateIndex()
+    sources = sources or ids
+    matches = index.add_batch(documents, sources)
+    kept = [i for i, match in enumerate(matches) if match is None]
+    kept_metadatas = [dict(metadatas[i] or {}, **index.duplicate_metadata(sources[i])) or None for i in kept]
+    return [documents[i] for i in kept], kept_metadatas, [ids[i] for i in kept]
+
+
+def print_deduplication(before, after, dim=768, batch_size=100):
+    """Embedding calls and index size saved by dropping near-duplicates."""
+    removed = before - after
+    calls_saved = -(-before // batch_size) - -(-after // batch_size)
+    print(f"Deduplication: {before} chunks -> {after} canonical ({removed} near-duplicates, {removed / max(1, before):.1%}); "
+          f"{removed} fewer texts to embed ({calls_saved} fewer batched calls), "
+          f"~{removed * dim * 4 / 2**20:.1f} MiB less vector data")
+
+
+# --- Benchmark ---
+def _synthetic_chunks(count, words_per_chunk, duplicate_rate, seed=0):
+    """Base chunks plus near-duplicates (a few words changed) and exact boilerplate copies."""
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array([f"w{i}" for i in range(20000)])
+    base_count = max(1, int(count * (1 - duplicate_rate)))
+    chunks = []
+    for i in range(count):
+        if i < base_count:
+            words = vocabulary[rng.integers(0, len(vocabulary), words_per_chunk)]
+        else:
+            source = chunks[rng.integers(0, base_count)].split()
+            words = np.array(source)
+            edits = rng.integers(0, 2) # Exact boilerplate repeats and one-word edits (Jaccard ~0.9)
+            words[rng.integers(0, len(words), edits)] = vocabulary[rng.integers(0, len(vocabulary), edits)]
+        chunks.append(" ".join(words))
+    order = rng.permutation(count)
+    return [chunks[i] for i in order]
+
+
+def run_benchmark(count=1_000_000, words_per_chunk=60, duplicate_rate=0.3, batch_size=10_000, dim=768):
+    print(f"--- {count} chunks of {words_per_chunk} words, {duplicate_rate:.0%} near-duplicates ---")
+    start = time.perf_counter()
+    chunks = _synthetic_chunks(count, words_per_chunk, duplicate_rate)
+    print(f"Generated corpus in {time.perf_counter() - start:.1f}s")
+
+    index = NearDuplicateIndex()
+    start = time.perf_counter()
+    for i in range(0, count, batch_size):
+        index.add_batch(chunks[i:i + batch_size], [str(j) for j in range(i, min(count, i + batch_size))])
+    elapsed = time.perf_counter() - start
+    canonical = len(index.canonical_ids)
+    expected = int(count * duplicate_rate)
+    print(f"MinHash + LSH: {elapsed:.1f}s ({count / elapsed:,.0f} chunks/s), {index.stats['duplicates']} duplicates found "
+          f"(~{expected} planted), {index.stats['candidates_checked'] / count:.2f} candidate checks per chunk")
+    print_deduplication(count, canonical, dim)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Near-duplicate chunk elimination with MinHash/LSH, or its benchmark.")
+    parser.add_argument("path", nargs="?", help="Text/Markdown file: chunk it and report near-duplicates")
+    parser.add_argument("--threshold", type=float, default=SIMILARITY_THRESHOLD)
+    parser.add_argument("--benchmark", type=int, metavar="CHUNKS", help="Benchmark on this many synthetic chunks (e.g. 1000000)")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        run_benchmark(args.benchmark)
+    elif args.path:
+        from documentChunker import iter_chunks_batched
+        index = NearDuplicateIndex(threshold=args.threshold)
+        total = 0
+        for batch in iter_chunks_batched(args.path, batch_size=1000):
+            ids = [f"{chunk['metadata']['source']}#{chunk['metadata']['chunk_index']}" for chunk in batch]
+            index.add_batch([chunk["text"] for chunk in batch], ids)
+            total += len(batch)
+        print_deduplication(total, len(index.canonical_ids))
+        for canonical_id, duplicates in list(index.duplicates.items())[:10]:
+            print(f"{canonical_id}: {len(duplicates)} duplicates, e.g. {duplicates[:3]}")
+    else:
+        parser.print_help()
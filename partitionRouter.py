@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from cachedContext import corpus_marker
+from mmrRerank import _normalize
+
+# --- Configuration ---
+# Routes a query to the metadata partition(s) it most likely belongs to (e.g. topic
+# "eiffel" / "japan"), using one centroid embedding per partition, and only searches
+# those partitions via a Chroma `where` filter. Low-confidence queries search everything.
+DEFAULT_MIN_SIMILARITY = 0.35 # Below this the best centroid is not trusted -> global search
+DEFAULT_MARGIN = 0.05 # Partitions within this similarity of the best one are searched too
+DEFAULT_MAX_PARTITIONS = 2
+
+
+def centroids_path(persist_path, collection_name, field):
+    return os.path.join(persist_path, f"{collection_name}_{field}_centroids.json")
+
+
+def content_marker(collection):
+    """corpus_marker (ids + text hashes) combined with the collection's embedding model."""
+    embedding_model = (collection.metadata or {}).get("embedding_model", "")
+    return hashlib.sha256(f"{corpus_marker(collection)}\x00{embedding_model}".encode("utf-8")).hexdigest()
+
+
+class PartitionRouter:
+    """
+    Args:
+        field (str): Metadata field the collection is partitioned by.
+        centroids (dict): {partition_value: centroid vector}.
+        sizes (dict): {partition_value: number of documents}, used to report search work.
+        min_similarity (float): Minimum query/centroid cosine similarity to route at all.
+        margin (float): Extra partitions are searched if they score within this of the best.
+        max_partitions (int): Upper bound on partitions searched for a routed query.
+        marker (str): content_marker of the collection the centroids were built from.
+    """
+
+    def __init__(self, field, centroids, sizes=None, min_similarity=DEFAULT_MIN_SIMILARITY,
+                 margin=DEFAULT_MARGIN, max_partitions=DEFAULT_MAX_PARTITIONS, marker=None):
+        self.field = field
+        self.marker = marker
+        self.partitions = list(centroids)
+        self.centroid_matrix = _normalize([centroids[p] for p in self.partitions])
+        self.sizes = sizes or {}
+        self.min_similarity = min_similarity
+        self.margin = margin
+        self.max_partitions = max_partitions
+        self.stats = {"routed": 0, "global": 0, "documents_searched": 0, "documents_total": 0}
+
+    # --- Building (at ingest time) ---
+    @classmethod
+    def from_embeddings(cls, field, embeddings, metadatas, **kwargs):
+        """Averages the (normalized) document embeddings of each partition."""
+        vectors = _normalize(embeddings)
+        groups = {}
+        for vector, metadata in zip(vectors, metadatas):
+            value = (metadata or {}).get(field)
+            if value is not None:
+                groups.setdefault(value, []).append(vector)
+        centroids = {value: np.mean(group, axis=0) for value, group in groups.items()}
+        sizes = {value: len(group) for value, group in groups.items()}
+        return cls(field, centroids, sizes, **kwargs)
+
+    @classmethod
+    def from_collection(cls, collection, field, **kwargs):
+        data = collection.get(include=["embeddings", "metadatas"])
+        return cls.from_embeddings(field, data["embeddings"], data["metadatas"], **kwargs)
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                "field": self.field,
+                "centroids": {p: self.centroid_matrix[i].tolist() for i, p in enumerate(self.partitions)},
+                "sizes": self.sizes,
+                "marker": self.marker,
+            }, f)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["field"], data["centroids"], data["sizes"], marker=data.get("marker"), **kwargs)
+
+    @classmethod
+    def load_or_build(cls, collection, field, path, **kwargs):
+        """
+        Loads saved centroids, rebuilding them if the collection's content (ids, text
+        hashes or embedding model) has changed since; a same-size edit is caught too.
+        """
+        marker = content_marker(collection)
+        if os.path.exists(path):
+            router = cls.load(path, **kwargs)
+            if router.field == field and router.marker == marker:
+                return router
+        router = cls.from_collection(collection, field, **kwargs)
+        router.marker = marker
+        router.save(path)
+        return router
+
+    # --- Routing ---
+    def route(self, query_embedding):
+        """
+        Returns:
+            tuple: (list of partition values, or None for a global search; best similarity)
+        """
+        if not self.partitions: # No document carries the partition field: always search globally
+            return None, 0.0
+        similarities = self.centroid_matrix @ _normalize(query_embedding)[0]
+        order = np.argsort(-similarities)
+        best = float(similarities[order[0]])
+        if best < self.min_similarity:
+            return None, best
+        chosen = [self.partitions[i] for i in order[:self.max_partitions] if similarities[i] >= best - self.margin]
+        if len(chosen) == len(self.partitions):
+            return None, best # Searching every partition is just a global search
+        return chosen, best
+
+    def where_filter(self, partitions):
+        if len(partitions) == 1:
+            return {self.field: partitions[0]}
+        return {self.field: {"$in": partitions}}
+
+    def query(self, collection, query_embedding, n_results, **kwargs):
+        """
+        collection.query(...) restricted to the routed partition(s).
+
+        Returns:
+            tuple: (Chroma results, route info dict with partitions, confidence and search fraction)
+        """
+        partitions, confidence = self.route(query_embedding)
+        total = sum(self.sizes.values()) or collection.count()
+        if partitions is None:
+            searched = total
+            self.stats["global"] += 1
+        else:
+            kwargs["where"] = self.where_filter(partitions)
+            searched = sum(self.sizes.get(p, 0) for p in partitions)
+            self.stats["routed"] += 1
+        self.stats["documents_searched"] += searched
+        self.stats["documents_total"] += total
+
+        results = collection.query(query_embeddings=[query_embedding], n_results=max(1, min(n_results, searched)), **kwargs)
+        return results, {"partitions": partitions or "all", "confidence": confidence, "search_fraction": searched / total if total else 1.0}
+
+    def print_stats(self):
+        queries = self.stats["routed"] + self.stats["global"]
+        if not queries:
+            return
+        fraction = self.stats["documents_searched"] / max(1, self.stats["documents_total"])
+        print(f"\n--- Partition Routing ({self.field}) ---")
+        print(f"Routed: {self.stats['routed']}/{queries} queries, global fallback: {self.stats['global']}")
+        print(f"Documents searched: {fraction:.0%} of a global search")
@@ -0,0 +1,213 @@
+import atexit
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+
+# --- Configuration ---
+# Tracing is off unless TRACE_PATH is set (or a Tracer is enabled in code).
+#   TRACE_PATH        -> Chrome trace JSON written on exit (open in chrome://tracing or Perfetto)
+#   TRACE_SAMPLE_RATE -> fraction of root spans (requests) to keep, default 1.0
+TRACE_PATH = os.getenv("TRACE_PATH")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+
+
+class Span:
+    """One timed operation. Attributes are free-form key/values (top_k, prompt_chars, tokens...)."""
+
+    __slots__ = ("tracer", "name", "trace_id", "span_id", "parent_id", "start", "end_time", "attributes", "thread_id", "pushed")
+
+    def __init__(self, tracer, name, trace_id, parent_id, attributes, pushed):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.thread_id = threading.get_ident()
+        self.pushed = pushed
+        self.end_time = None
+        self.start = time.perf_counter()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self):
+        if self.end_time is None:
+            self.end_time = time.perf_counter()
+            self.tracer._finish(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.attributes["error"] = f"{exc_type.__name__}: {exc}"
+        self.end()
+        return False
+
+
+class _NoopSpan:
+    """Returned when tracing is disabled or the request was not sampled."""
+
+    trace_id = None
+
+    def set(self, **attributes):
+        pass
+
+    def end(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    """
+    Nested spans per thread. A root span decides sampling for its whole trace;
+    children of an unsampled (or disabled) root are the shared no-op span.
+    """
+
+    def __init__(self, enabled=False, sample_rate=1.0, max_spans=100_000):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.max_spans = max_spans
+        self.finished = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.origin = time.perf_counter()
+
+    def _stack(self):
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def span(self, name, push=True, **attributes):
+        """
+        Starts a span; use as a context manager. With push=False the span is not made
+        current (for work that finishes later in the same thread, e.g. a stream) and
+        must be closed with span.end().
+        """
+        if not self.enabled:
+            return NOOP_SPAN
+        stack = self._stack()
+        if stack:
+            parent = stack[-1]
+            if parent is NOOP_SPAN:
+                if push:
+                    stack.append(NOOP_SPAN)
+                    return _PoppingNoop(stack)
+                return NOOP_SPAN
+            span = Span(self, name, parent.trace_id, parent.span_id, attributes, push)
+        elif self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            if push:
+                stack.append(NOOP_SPAN)
+                return _PoppingNoop(stack)
+            return NOOP_SPAN
+        else:
+            span = Span(self, name, uuid.uuid4().hex[:16], None, attributes, push)
+        if push:
+            stack.append(span)
+        return span
+
+    def current_trace_id(self):
+        stack = getattr(self.local, "stack", None)
+        return stack[-1].trace_id if stack else None
+
+    def _finish(self, span):
+        if span.pushed:
+            stack = self._stack()
+            if stack and stack[-1] is span:
+                stack.pop()
+        with self.lock:
+            if len(self.finished) < self.max_spans:
+                self.finished.append(span)
+
+    # --- Export ---
+    def to_chrome_trace(self):
+        """Complete ('X') events in the Chrome trace-event format; trace ids go in args."""
+        with self.lock:
+            spans = list(self.finished)
+        events = []
+        for span in spans:
+            events.append({
+                "name": span.name,
+                "ph": "X",
+                "ts": (span.start - self.origin) * 1e6,
+                "dur": (span.end_time - span.start) * 1e6,
+                "pid": os.getpid(),
+                "tid": span.thread_id,
+                "args": dict(span.attributes, trace_id=span.trace_id, span_id=span.span_id, parent_id=span.parent_id),
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_chrome_trace(), f, default=str)
+
+
+class _PoppingNoop(_NoopSpan):
+    """No-op placeholder pushed for unsampled traces so children stay unsampled."""
+
+    def __init__(self, stack):
+        self.stack = stack
+
+    def end(self):
+        if self.stack and self.stack[-1] is NOOP_SPAN:
+            self.stack.pop()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end()
+        return False
+
+
+TRACER = Tracer(enabled=bool(TRACE_PATH), sample_rate=TRACE_SAMPLE_RATE)
+if TRACE_PATH:
+    atexit.register(lambda: TRACER.write(TRACE_PATH))
+
+
+def print_trace(trace_file, trace_id=None):
+    """
+    Prints the span tree of one trace (or the slowest root trace when no id is given)
+    from a file written by Tracer.write.
+    """
+    with open(trace_file, "r", encoding="utf-8") as f:
+        events = json.load(f)["traceEvents"]
+    if trace_id is None:
+        roots = [e for e in events if e["args"]["parent_id"] is None]
+        if not roots:
+            print("No traces recorded.")
+            return
+        trace_id = max(roots, key=lambda e: e["dur"])["args"]["trace_id"]
+
+    spans = sorted((e for e in events if e["args"]["trace_id"] == trace_id), key=lambda e: e["ts"])
+    children = {}
+    for e in spans:
+        children.setdefault(e["args"]["parent_id"], []).append(e)
+
+    def show(parent_id, depth):
+        for e in children.get(parent_id, []):
+            attributes = {k: v for k, v in e["args"].items() if k not in ("trace_id", "span_id", "parent_id")}
+            print(f"{'  ' * depth}{e['name']}: {e['dur'] / 1000:.1f} ms {attributes if attributes else ''}")
+            show(e["args"]["span_id"], depth + 1)
+
+    print(f"--- Trace {trace_id} ---")
+    show(None, 0)
+
+
+if __name__ == "__main__":
+    # Usage: python pipelineTracing.py trace.json [trace_id]
+    if len(sys.argv) < 2:
+        print("Usage: python pipelineTracing.py <trace.json> [trace_id]")
+    else:
+        print_trace(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
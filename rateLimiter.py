@@ -0,0 +1,50 @@
+import threading
+import time
+
+# --- Configuration ---
+# Requests per minute shared by every tool in this process (sweeps, harnesses, ...).
+# Paid-tier keys allow ~1000-2000 RPM on flash models; lower this (e.g. --rpm 15) on free-tier keys.
+DEFAULT_REQUESTS_PER_MINUTE = 1000
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket. Each API call takes one token; tokens refill
+    continuously at requests_per_minute / 60 per second, up to `burst`.
+    """
+
+    def __init__(self, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, burst=None):
+        self.rate = requests_per_minute / 60.0
+        self.capacity = burst or max(1, int(self.rate))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a request may be sent."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+_shared_limiter = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_rate_limiter(requests_per_minute=None):
+    """
+    Returns the process-wide limiter, creating it on first use.
+    Passing requests_per_minute (re)configures it.
+    """
+    global _shared_limiter
+    with _shared_lock:
+        if _shared_limiter is None or requests_per_minute is not None:
+            _shared_limiter = RateLimiter(requests_per_minute or DEFAULT_REQUESTS_PER_MINUTE)
+        return _shared_limiter
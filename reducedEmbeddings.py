@@ -0,0 +1,244 @@
+import google.generativeai as genai
+from dotenv import load_dotenv
+import argparse
+import numpy as np
+import os
+import time
+
+from documentChunker import iter_chunks
+from usageMetrics import metered_embed_content
+
+# --- Configuration ---
+EMBEDDING_MODEL_NAME = "text-embedding-004"
+FULL_DIM = 768
+REDUCED_DIMS = [256, 128, 64]
+EMBED_BATCH_SIZE = 100
+
+
+def normalize_rows(matrix):
+    """L2-normalizes each row so dot product == cosine similarity."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+# --- PCA projection (fitted locally, saved next to the collection) ---
+class PCAProjection:
+    """
+    Linear projection learned from the document embeddings.
+    Stored as mean + components so queries are projected exactly like the documents.
+    """
+
+    def __init__(self, mean, components):
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.components = np.asarray(components, dtype=np.float32) # (dim, FULL_DIM)
+
+    @property
+    def dim(self):
+        return self.components.shape[0]
+
+    @classmethod
+    def fit(cls, embeddings, dim):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if dim > min(embeddings.shape):
+            raise ValueError(f"Need at least {dim} documents to fit a {dim}-dim PCA (got {embeddings.shape[0]}).")
+        mean = embeddings.mean(axis=0)
+        # Rows of vt are the principal directions, strongest first.
+        _, _, vt = np.linalg.svd(embeddings - mean, full_matrices=False)
+        return cls(mean, vt[:dim])
+
+    def project(self, embeddings):
+        return normalize_rows((np.asarray(embeddings, dtype=np.float32) - self.mean) @ self.components.T)
+
+    def save(self, path):
+        np.savez(path, mean=self.mean, components=self.components)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data["mean"], data["components"])
+
+
+def pca_path(persist_path, collection_name, dim):
+    return os.path.join(persist_path, f"{collection_name}_pca_{dim}.npz")
+
+
+# --- Embedding with reduced dimensionality ---
+class ReducedEmbedder:
+    """
+    Produces document and query embeddings at a reduced size, consistently.
+
+    method="api": ask the API for output_dimensionality=dim (text-embedding-004 truncates
+                  its Matryoshka-style vector), then re-normalize.
+    method="pca": embed at full size and project with a PCA fitted on the documents.
+    """
+
+    def __init__(self, dim, method="api", model=EMBEDDING_MODEL_NAME, projection=None):
+        if method not in ("api", "pca"):
+            raise ValueError("method must be 'api' or 'pca'.")
+        self.dim = dim
+        self.method = method
+        self.model = model
+        self.projection = projection
+
+    def collection_metadata(self):
+        """Recorded on the Chroma collection so queries can't use a mismatched size."""
+        return {"embedding_model": self.model, "embedding_dim": self.dim, "reduction": self.method, "hnsw:space": "cosine"}
+
+    def _embed(self, texts, task_type):
+        kwargs = {"output_dimensionality": self.dim} if self.method == "api" and self.dim < FULL_DIM else {}
+        vectors = []
+        for i in range(0, len(texts), EMBED_BATCH_SIZE):
+            vectors.extend(metered_embed_content(
+                stage=f"embed_{task_type.lower()}",
+                model=self.model,
+                content=texts[i:i + EMBED_BATCH_SIZE],
+                task_type=task_type,
+                **kwargs
+            )['embedding'])
+        return np.asarray(vectors, dtype=np.float32)
+
+    def embed_documents(self, texts, fit=False):
+        """Embeds documents; with method='pca' and fit=True, (re)fits the projection on them."""
+        vectors = self._embed(texts, "RETRIEVAL_DOCUMENT")
+        if self.method == "api":
+            return normalize_rows(vectors)
+        if fit or self.projection is None:
+            self.projection = PCAProjection.fit(vectors, self.dim)
+        return self.projection.project(vectors)
+
+    def embed_query(self, text):
+        vector = self._embed([text], "RETRIEVAL_QUERY")
+        if self.method == "api":
+            return normalize_rows(vector)[0]
+        if self.projection is None:
+            raise ValueError("PCA projection not fitted/loaded; embed the documents first or load the saved projection.")
+        return self.projection.project(vector)[0]
+
+
+def create_reduced_collection(client, base_name, texts, ids, embedder, persist_path, metadatas=None):
+    """
+    Builds '<base_name>_<dim>' with reduced embeddings, or adds to it. For PCA the
+    projection is fitted only when the collection is new (empty) and saved next to it;
+    documents added later are projected with the saved one, so stored rows and queries
+    always share a basis.
+    """
+    name = f"{base_name}_{embedder.dim}"
+    collection = client.get_or_create_collection(name=name, metadata=embedder.collection_metadata())
+    path = pca_path(persist_path, base_name, embedder.dim)
+    fit = collection.count() == 0
+    if embedder.method == "pca" and not fit:
+        if not os.path.exists(path):
+            raise ValueError(f"'{name}' has documents but no saved projection at {path}; rebuild the collection.")
+        embedder.projection = PCAProjection.load(path)
+    embeddings = embedder.embed_documents(texts, fit=fit)
+    if embedder.method == "pca" and fit:
+        embedder.projection.save(path)
+    collection.upsert(ids=ids, embeddings=embeddings.tolist(), documents=texts, metadatas=metadatas)
+    return collection
+
+
+def open_reduced_collection(client, base_name, dim, persist_path):
+    """Opens a reduced collection and returns (collection, embedder) configured from its metadata."""
+    collection = client.get_collection(name=f"{base_name}_{dim}")
+    metadata = collection.metadata or {}
+    projection = None
+    if metadata.get("reduction") == "pca":
+        projection = PCAProjection.load(pca_path(persist_path, base_name, dim))
+    embedder = ReducedEmbedder(dim, method=metadata.get("reduction", "api"),
+                               model=metadata.get("embedding_model", EMBEDDING_MODEL_NAME), projection=projection)
+    return collection, embedder
+
+
+# --- Evaluation ---
+def exact_top_k(doc_matrix, query_matrix, k):
+    """Brute-force cosine top-k (both inputs normalized). Returns an index array per query."""
+    scores = query_matrix @ doc_matrix.T
+    k = min(k, doc_matrix.shape[0])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+
+def recall_at_k(truth, found):
+    hits = sum(len(set(t) & set(f)) for t, f in zip(truth.tolist(), found.tolist()))
+    return hits / truth.size
+
+
+def evaluate_dimensions(doc_embeddings, query_embeddings, dims=REDUCED_DIMS, k=10, repeats=5):
+    """
+    Compares reduced embeddings against full-size search.
+
+    Truncation (what output_dimensionality does) and PCA are both evaluated locally
+    from the same full-size vectors, so no extra API calls are needed.
+
+    Returns:
+        list: Rows with method, dim, recall@k, per-query search latency and index memory.
+    """
+    docs = normalize_rows(doc_embeddings)
+    queries = normalize_rows(query_embeddings)
+    truth = exact_top_k(docs, queries, k)
+
+    def measure(method, dim, doc_matrix, query_matrix):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            found = exact_top_k(doc_matrix, query_matrix, k)
+        latency_ms = (time.perf_counter() - start) * 1000 / (repeats * len(query_matrix))
+        return {
+            "method": method,
+            "dim": dim,
+            f"recall@{k}": round(recall_at_k(truth, found), 4),
+            "search_ms_per_query": round(latency_ms, 4),
+            "index_mb": round(doc_matrix.nbytes / 1e6, 2),
+        }
+
+    rows = [measure("full", docs.shape[1], docs, queries)]
+    for dim in dims:
+        rows.append(measure("truncate", dim, normalize_rows(docs[:, :dim]), normalize_rows(queries[:, :dim])))
+        if dim <= min(docs.shape):
+            projection = PCAProjection.fit(docs, dim)
+            rows.append(measure("pca", dim, projection.project(docs), projection.project(queries)))
+    return rows
+
+
+def print_evaluation(rows):
+    print("\n--- Reduced Dimensionality Trade-off ---")
+    columns = list(rows[0].keys())
+    print(" | ".join(columns))
+    for row in rows:
+        print(" | ".join(str(row[c]) for c in columns))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate recall/latency/memory of reduced embedding sizes.")
+    parser.add_argument("--corpus", help="Text/Markdown file to chunk and embed as documents")
+    parser.add_argument("--queries", help="Text file with one query per line (defaults to a sample of chunks)")
+    parser.add_argument("--npz", help="Precomputed embeddings: .npz with 'documents' and 'queries' arrays")
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.npz:
+        data = np.load(args.npz)
+        doc_vectors, query_vectors = data["documents"], data["queries"]
+    elif args.corpus:
+        load_dotenv()
+        api_key = os.getenv("GOOGLE_API_KEY")
+        if not api_key:
+            raise ValueError("GOOGLE_API_KEY not found.")
+        genai.configure(api_key=api_key)
+
+        chunks = [chunk["text"] for chunk in iter_chunks(args.corpus)]
+        if args.queries:
+            with open(args.queries, "r", encoding="utf-8") as f:
+                query_texts = [line.strip() for line in f if line.strip()]
+        else:
+            query_texts = chunks[::max(1, len(chunks) // 100)][:100]
+        full = ReducedEmbedder(FULL_DIM)
+        print(f"--- Embedding {len(chunks)} chunks and {len(query_texts)} queries at full size ---")
+        doc_vectors = full._embed(chunks, "RETRIEVAL_DOCUMENT")
+        query_vectors = full._embed(query_texts, "RETRIEVAL_QUERY")
+    else:
+        parser.error("Provide --corpus or --npz.")
+
+    print_evaluation(evaluate_dimensions(doc_vectors, query_vectors, k=args.k))
@@ -0,0 +1,211 @@
+import google.generativeai as genai
+from dotenv import load_dotenv
+import argparse
+import hashlib
+import json
+import os
+import re
+import time
+
+import chromadb
+
+from rateLimiter import RateLimiter
+from usageMetrics import metered_embed_content
+from documentTextStore import collection_text_store
+
+# --- Configuration ---
+# Scripts open a collection by its logical name; collection_aliases.json (next to
+# chroma.sqlite3) says which physical collection is live. A re-index builds a shadow
+# collection with the new embedding model and then flips the alias in one os.replace.
+# Scripts resolve the alias when they open the collection (at startup), so a running bot
+# keeps serving the old collection until it is restarted; the old one is kept for that
+# (and for rollback).
+ALIAS_FILE = "collection_aliases.json"
+EMBEDDING_MODEL_KEY = "embedding_model" # Collection metadata key
+SOURCE_HASH_KEY = "reindex_source_hash" # Per-document metadata: hash of the live text + metadata it was embedded from
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_REQUESTS_PER_MINUTE = 60 # Leave headroom for the live bots sharing the key
+
+
+# --- Aliases ---
+def _alias_path(persist_path):
+    return os.path.join(persist_path, ALIAS_FILE)
+
+
+def _read_aliases(persist_path):
+    path = _alias_path(persist_path)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def live_collection_name(persist_path, logical_name):
+    """Physical collection currently serving `logical_name` (itself if never re-indexed)."""
+    return _read_aliases(persist_path).get(logical_name, logical_name)
+
+
+def set_live_collection(persist_path, logical_name, physical_name):
+    """Atomically points `logical_name` at `physical_name` (write temp file, then os.replace)."""
+    aliases = _read_aliases(persist_path)
+    aliases[logical_name] = physical_name
+    tmp_path = _alias_path(persist_path) + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(aliases, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, _alias_path(persist_path))
+
+
+def reset_live_collection(persist_path, logical_name):
+    """Drops the alias after `logical_name` itself has been (re)created as the live collection."""
+    if live_collection_name(persist_path, logical_name) != logical_name:
+        set_live_collection(persist_path, logical_name, logical_name)
+
+
+def collection_embedding_model(collection, default):
+    """
+    The model a collection's documents were embedded with. Query embeddings must use
+    the same model; collections created before this was recorded fall back to `default`.
+    """
+    return (collection.metadata or {}).get(EMBEDDING_MODEL_KEY, default)
+
+
+def shadow_collection_name(logical_name, model):
+    return f"{logical_name}__{re.sub(r'[^A-Za-z0-9_-]', '_', model.replace('models/', ''))}"
+
+
+def source_hash(document, metadata):
+    """Hash of a live document's text and metadata, so a shadow copy can tell when it went stale."""
+    metadata = {key: value for key, value in (metadata or {}).items() if key != SOURCE_HASH_KEY}
+    return hashlib.sha1(json.dumps([document, metadata], sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+# --- Re-indexing ---
+class ShadowReindexer:
+    """
+    Copies the live collection into a shadow collection embedded with `new_model`,
+    throttled so the live bots keep their share of the quota.
+
+    Resumable: each shadow document records the hash of the live text and metadata it
+    was embedded from, and documents whose hash still matches are skipped, so an
+    interrupted run just picks up where it stopped. Catch-up passes repeat until the
+    shadow matches the live collection: documents added or updated meanwhile are
+    (re-)embedded and documents deleted from live are deleted from the shadow.
+    """
+
+    def __init__(self, client, persist_path, logical_name, new_model, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE,
+                 batch_size=DEFAULT_BATCH_SIZE):
+        self.client = client
+        self.persist_path = persist_path
+        self.logical_name = logical_name
+        self.new_model = new_model
+        self.batch_size = batch_size
+        self.rate_limiter = RateLimiter(requests_per_minute)
+        self.stats = {"embedded": 0, "skipped": 0, "deleted": 0, "requests": 0}
+
+    def _copy_pass(self, live, shadow):
+        """One pass over the live collection; returns how many documents were (re-)embedded."""
+        embedded = 0
+        offset = 0
+        text_store = collection_text_store(live) # The shadow shares it (same metadata, same ids)
+        while True:
+            page = live.get(include=["documents", "metadatas"], limit=self.batch_size, offset=offset)
+            ids = page["ids"]
+            if not ids:
+                return embedded
+            offset += len(ids)
+            documents = text_store.get(ids) if text_store else page["documents"]
+            hashes = [source_hash(document, metadata) for document, metadata in zip(documents, page["metadatas"])]
+            copied = shadow.get(ids=ids, include=["metadatas"])
+            current = {doc_id: (metadata or {}).get(SOURCE_HASH_KEY) for doc_id, metadata in zip(copied["ids"], copied["metadatas"])}
+            stale = [i for i, doc_id in enumerate(ids) if current.get(doc_id) != hashes[i]] # Missing or changed in live
+            self.stats["skipped"] += len(ids) - len(stale)
+            if not stale:
+                continue
+            stale_documents = [documents[i] for i in stale]
+            self.rate_limiter.acquire()
+            embeddings = metered_embed_content(
+                stage="reindex_documents",
+                model=self.new_model,
+                content=stale_documents,
+                task_type="RETRIEVAL_DOCUMENT"
+            )['embedding']
+            self.stats["requests"] += 1
+            shadow.upsert(
+                ids=[ids[i] for i in stale],
+                embeddings=embeddings,
+                documents=None if text_store else stale_documents,
+                metadatas=[dict(page["metadatas"][i] or {}, **{SOURCE_HASH_KEY: hashes[i]}) for i in stale],
+            )
+            embedded += len(stale)
+            self.stats["embedded"] += len(stale)
+            print(f"  {shadow.count()}/{live.count()} documents in '{shadow.name}'")
+
+    def _delete_pass(self, live, shadow):
+        """Deletes shadow documents that no longer exist in live; returns how many."""
+        live_ids = set(live.get(include=[])["ids"])
+        removed = [doc_id for doc_id in shadow.get(include=[])["ids"] if doc_id not in live_ids]
+        for i in range(0, len(removed), self.batch_size):
+            shadow.delete(ids=removed[i:i + self.batch_size])
+        self.stats["deleted"] += len(removed)
+        return len(removed)
+
+    def run(self, flip=True):
+        """
+        Builds (or resumes) the shadow collection and, if it matches the live collection,
+        makes it live. Scripts already running keep the collection they opened at startup.
+
+        Returns:
+            str: Name of the shadow collection.
+        """
+        live = self.client.get_collection(live_collection_name(self.persist_path, self.logical_name))
+        if collection_embedding_model(live, None) == self.new_model:
+            print(f"'{self.logical_name}' is already embedded with {self.new_model}.")
+            return live.name
+
+        shadow_name = shadow_collection_name(self.logical_name, self.new_model)
+        metadata = dict(live.metadata or {})
+        metadata.update({EMBEDDING_MODEL_KEY: self.new_model, "reindexed_from": live.name})
+        shadow = self.client.get_or_create_collection(shadow_name, metadata=metadata)
+        print(f"--- Re-indexing '{live.name}' -> '{shadow_name}' with {self.new_model} ---")
+
+        start = time.perf_counter()
+        while self._copy_pass(live, shadow) + self._delete_pass(live, shadow): # Catch up on changes made meanwhile
+            pass
+        print(f"Shadow build took {time.perf_counter() - start:.1f}s ({self.stats})")
+
+        live_ids = set(live.get(include=[])["ids"])
+        shadow_ids = set(shadow.get(include=[])["ids"])
+        if live_ids != shadow_ids:
+            raise RuntimeError(f"Shadow collection differs from live ({len(live_ids - shadow_ids)} missing, "
+                               f"{len(shadow_ids - live_ids)} extra); not flipping.")
+        if flip:
+            set_live_collection(self.persist_path, self.logical_name, shadow_name)
+            print(f"'{self.logical_name}' now served by '{shadow_name}' (previous: '{live.name}', kept for rollback).")
+        return shadow_name
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-embed a collection with a new model in the background, then flip atomically.")
+    parser.add_argument("--store", default="./chroma_db_store")
+    parser.add_argument("--collection", default="rag_eiffel_japan_collection", help="Logical collection name used by the scripts")
+    parser.add_argument("--model", help="New embedding model, e.g. text-embedding-005")
+    parser.add_argument("--rpm", type=float, default=DEFAULT_REQUESTS_PER_MINUTE, help="Embedding requests per minute for the copy")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--no-flip", action="store_true", help="Build the shadow collection but keep serving the old one")
+    parser.add_argument("--rollback-to", help="Point the logical name back at this physical collection and exit")
+    args = parser.parse_args()
+
+    if args.rollback_to:
+        set_live_collection(args.store, args.collection, args.rollback_to)
+        print(f"'{args.collection}' now served by '{args.rollback_to}'.")
+    elif not args.model:
+        parser.error("--model is required unless --rollback-to is given.")
+    else:
+        load_dotenv()
+        api_key = os.getenv("GOOGLE_API_KEY")
+        if api_key:
+            genai.configure(api_key=api_key)
+        client = chromadb.PersistentClient(path=args.store)
+        ShadowReindexer(client, args.store, args.collection, args.model, args.rpm, args.batch_size).run(flip=not args.no_flip)
@@ -0,0 +1,189 @@
+import google.generativeai as genai
+from google.generativeai.types.safety_types import to_easy_safety_dict
+from collections import namedtuple
+import hashlib
+import json
+import os
+import random
+import re
+import time
+
+from safetyHarness import summarize_response, enum_name
+
+# --- Configuration ---
+PREFILTER_CACHE_PATH = "./.blocked_prompt_fingerprints.json"
+DEFAULT_REFUSAL = "I'm sorry, but I can't help with that request."
+DEFAULT_AUDIT_RATE = 0.0 # Fraction of locally-blocked prompts still sent upstream for comparison
+
+# Known-blocked probes, grouped by the harm category the server reports for them.
+# Kept deliberately narrow: only terms with no everyday or historical meaning (a
+# "make ... bomb" rule also refused bath bombs and questions about the atomic bomb).
+# Anything not matched here still goes to the model.
+DEFAULT_BLOCK_PATTERNS = {
+    "DANGEROUS_CONTENT": [
+        r"\bmolotov\s+cocktails?\b",
+        r"\bpipe\s*bombs?\b",
+    ],
+}
+
+ScreenDecision = namedtuple("ScreenDecision", ["blocked", "layer", "category", "elapsed_us"])
+
+
+def normalize_prompt(prompt):
+    """Lowercases and strips punctuation/extra whitespace so trivial variants share a fingerprint."""
+    return " ".join(re.sub(r"[^\w\s]", " ", prompt.lower()).split())
+
+
+def safety_settings_key(safety_settings):
+    """Short stable hash of a model's safety settings ("default" when none are set)."""
+    if not safety_settings:
+        return "default"
+    pairs = sorted((int(category), int(threshold)) for category, threshold in to_easy_safety_dict(safety_settings).items())
+    return hashlib.sha1(json.dumps(pairs).encode("utf-8")).hexdigest()[:12]
+
+
+def prompt_fingerprint(prompt, settings_key="default"):
+    """Normalized-prompt hash, scoped to the safety settings the block was observed under."""
+    return hashlib.sha1(f"{settings_key}\x00{normalize_prompt(prompt)}".encode("utf-8")).hexdigest()
+
+
+def blocked_category(e):
+    """
+    What to learn from an SDK exception: the prompt block reason, "SAFETY" for an answer
+    stopped by the safety filters, or None for anything else (RECITATION, OTHER, errors).
+    """
+    if isinstance(e, genai.types.BlockedPromptException):
+        response = e.args[0] if e.args else None
+        feedback = getattr(response, "prompt_feedback", None)
+        return enum_name(feedback.block_reason) if feedback and feedback.block_reason else "SAFETY"
+    if isinstance(e, genai.types.StopCandidateException):
+        candidate = e.args[0] if e.args else None
+        if enum_name(getattr(candidate, "finish_reason", "")) == "SAFETY":
+            return "SAFETY"
+    return None
+
+
+class SafetyPrefilter:
+    """
+    Local screening stage in front of generation.
+
+    Two layers decide before any API call:
+      1. 'pattern'     - one precompiled regex built from the known-blocked patterns.
+      2. 'fingerprint' - prompts the server has already blocked before (normalized hash).
+    Prompts that pass both go upstream ('upstream' layer), and any server-side block
+    is learned into the fingerprint cache for next time. Learned blocks are keyed by
+    the safety settings too: a prompt blocked at BLOCK_MEDIUM_AND_ABOVE may be allowed
+    at BLOCK_ONLY_HIGH, so models with different settings can share one cache file.
+
+    In audit mode a sampled fraction of locally-blocked prompts is still sent upstream,
+    so the confusion counts in `stats` show how well we agree with the server.
+
+    Args:
+        safety_settings: The guarded model's safety settings (any form the SDK accepts).
+    """
+
+    def __init__(self, patterns=None, refusal=DEFAULT_REFUSAL, audit_rate=DEFAULT_AUDIT_RATE,
+                 cache_path=PREFILTER_CACHE_PATH, seed=None, safety_settings=None):
+        patterns = DEFAULT_BLOCK_PATTERNS if patterns is None else patterns
+        # One alternation with a named group per category, so a single scan finds the category too.
+        groups = [f"(?P<{category}>{'|'.join(expressions)})" for category, expressions in patterns.items() if expressions]
+        self.pattern = re.compile("|".join(groups), re.IGNORECASE) if groups else None
+        self.refusal = refusal
+        self.audit_rate = audit_rate
+        self.cache_path = cache_path
+        self.random = random.Random(seed)
+        self.settings_key = safety_settings_key(safety_settings)
+        self.fingerprints = {}
+        self.stats = {
+            "pattern": 0, "fingerprint": 0, "upstream": 0, "audited": 0,
+            # Agreement with the server, counted for every prompt that reached it.
+            "local_blocked_server_blocked": 0, "local_blocked_server_allowed": 0,
+            "local_allowed_server_blocked": 0, "local_allowed_server_allowed": 0,
+        }
+        if self.cache_path and os.path.exists(self.cache_path):
+            try:
+                with open(self.cache_path, "r", encoding="utf-8") as f:
+                    self.fingerprints = json.load(f)
+            except (OSError, ValueError):
+                self.fingerprints = {}
+
+    def screen(self, prompt):
+        """
+        Decides locally whether a prompt is known to be blocked.
+
+        Returns:
+            ScreenDecision: blocked flag, deciding layer, harm category and time spent (µs).
+        """
+        start = time.perf_counter()
+        if self.pattern:
+            match = self.pattern.search(prompt)
+            if match:
+                return ScreenDecision(True, "pattern", match.lastgroup, (time.perf_counter() - start) * 1e6)
+        category = self.fingerprints.get(prompt_fingerprint(prompt, self.settings_key))
+        if category is not None:
+            return ScreenDecision(True, "fingerprint", category, (time.perf_counter() - start) * 1e6)
+        return ScreenDecision(False, "upstream", None, (time.perf_counter() - start) * 1e6)
+
+    def remember_blocked(self, prompt, category="SAFETY"):
+        """Adds a server-blocked prompt to the fingerprint cache."""
+        fingerprint = prompt_fingerprint(prompt, self.settings_key)
+        if fingerprint in self.fingerprints:
+            return
+        self.fingerprints[fingerprint] = category
+        if self.cache_path:
+            with open(self.cache_path, "w", encoding="utf-8") as f:
+                json.dump(self.fingerprints, f)
+
+    def _record_agreement(self, decision, server_blocked):
+        local = "local_blocked" if decision.blocked else "local_allowed"
+        server = "server_blocked" if server_blocked else "server_allowed"
+        self.stats[f"{local}_{server}"] += 1
+
+    def guard(self, prompt, call):
+        """
+        Screens a prompt and only invokes `call()` (the real API request) when needed.
+
+        Args:
+            prompt (str): The user prompt.
+            call (callable): Zero-argument function performing the generation.
+
+        Returns:
+            tuple: (response, decision). response is None when answered locally;
+                   use `self.refusal` as the reply in that case.
+        """
+        decision = self.screen(prompt)
+        if decision.blocked:
+            self.stats[decision.layer] += 1
+            if not (self.audit_rate and self.random.random() < self.audit_rate):
+                return None, decision
+            self.stats["audited"] += 1
+        else:
+            self.stats["upstream"] += 1
+
+        try:
+            response = call()
+        except Exception as e:
+            category = blocked_category(e)
+            if category:
+                self._record_agreement(decision, True)
+                self.remember_blocked(prompt, category)
+            raise
+
+        summary = summarize_response(response)
+        self._record_agreement(decision, summary["blocked"])
+        if summary["blocked"]:
+            self.remember_blocked(prompt, summary["prompt_block_reason"] or "SAFETY")
+        return response, decision
+
+    def agreement_rate(self):
+        """Share of upstream-checked prompts where the local verdict matched the server's."""
+        agree = self.stats["local_blocked_server_blocked"] + self.stats["local_allowed_server_allowed"]
+        total = agree + self.stats["local_blocked_server_allowed"] + self.stats["local_allowed_server_blocked"]
+        return agree / total if total else None
+
+    def print_stats(self):
+        print("\n--- Safety Prefilter Stats ---")
+        for key, value in self.stats.items():
+            print(f"  {key}: {value}")
+        rate = self.agreement_rate()
+        print(f"  agreement with server: {rate:.1%}" if rate is not None else "  agreement with server: n/a")
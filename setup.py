@@ -1,6 +1,7 @@
 import google.generativeai as genai
 from dotenv import load_dotenv
 import os
+from usageMetrics import metered_generate_content, print_usage
 
 load_dotenv()
 
@@ -27,8 +28,10 @@ try:
 
     print(f"--- Generating with custom config: Temp={generation_config.temperature}, TopP={generation_config.top_p}, TopK={generation_config.top_k}, MaxTokens={generation_config.max_output_tokens} ---")
 
-    response = model.generate_content(
+    response = metered_generate_content(
+        model,
         prompt,
+        stage="high_temp_candidates",
         generation_config=generation_config # Pass the config here
     )
 
@@ -42,13 +45,7 @@ try:
     print('-'*10)
 
     
-    print("\n--- Usage Metadata (Tokens) ---")
-    if response.usage_metadata: # Check if usage_metadata exists
-      print(f"Prompt tokens: {response.usage_metadata.prompt_token_count}")
-      print(f"Candidates tokens: {response.usage_metadata.candidates_token_count}")
-      print(f"Total tokens: {response.usage_metadata.total_token_count}")
-    else:
-      print("Usage metadata not available.")
+    print_usage(response)
 
 
     # --- Experiment: Now try with a very different configuration ---
@@ -60,21 +57,17 @@ try:
     )
 
     print(f"\n--- Generating with LOW TEMP config: Temp={low_temp_config.temperature}, TopP={low_temp_config.top_p}, TopK={low_temp_config.top_k} ---")
-    response_low_temp = model.generate_content(
+    response_low_temp = metered_generate_content(
+        model,
         prompt, # Same prompt
+        stage="low_temp",
         generation_config=low_temp_config
     )
 
     print("\n--- Story (Low Temp) ---")
     print(response_low_temp.text)
 
-    print("\n--- Usage Metadata (Tokens) - Low Temp ---")
-    if response_low_temp.usage_metadata:
-        print(f"Prompt tokens: {response_low_temp.usage_metadata.prompt_token_count}")
-        print(f"Candidates tokens: {response_low_temp.usage_metadata.candidates_token_count}")
-        print(f"Total tokens: {response_low_temp.usage_metadata.total_token_count}")
-    else:
-        print("Usage metadata not available for low temp response.")
+    print_usage(response_low_temp, "Low Temp")
 
 
 except Exception as e:
@@ -0,0 +1,238 @@
+import argparse
+import contextlib
+import heapq
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# --- Configuration ---
+# Exact (brute-force) cosine search, split across worker processes. Each worker owns one
+# contiguous shard of the normalized embedding matrix in shared memory; query batches are
+# written once to a shared query buffer and every worker scores them against its shard.
+DEFAULT_TOP_K = 5
+MAX_QUERY_BATCH = 256
+RESPONSE_TIMEOUT = 60.0 # seconds a query batch may take before the search gives up
+LIVENESS_POLL = 0.5 # seconds between worker liveness checks while waiting
+BLAS_THREAD_VARS = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS")
+
+
+@contextlib.contextmanager
+def _single_threaded_blas():
+    """Workers are started with one BLAS thread each, so N workers use N cores, not N x cores."""
+    previous = {name: os.environ.get(name) for name in BLAS_THREAD_VARS}
+    os.environ.update({name: "1" for name in BLAS_THREAD_VARS})
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def _shard_worker(shard_name, rows, dim, offset, query_name, requests, responses):
+    """Scores broadcast query batches against one shard and returns its local top-k."""
+    shard_memory = shared_memory.SharedMemory(name=shard_name)
+    query_memory = shared_memory.SharedMemory(name=query_name)
+    shard = np.ndarray((rows, dim), dtype=np.float32, buffer=shard_memory.buf)
+    query_buffer = np.ndarray((MAX_QUERY_BATCH, dim), dtype=np.float32, buffer=query_memory.buf)
+    try:
+        while True:
+            message = requests.get()
+            if message is None:
+                break
+            batch_id, count, k = message
+            scores = query_buffer[:count] @ shard.T
+            k = max(1, min(k, rows))
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            responses.put((batch_id, np.take_along_axis(scores, top, axis=1), top + offset))
+    finally:
+        del shard, query_buffer
+        shard_memory.close()
+        query_memory.close()
+
+
+class ShardedIndex:
+    """
+    Exact top-k cosine search over an in-memory embedding matrix, parallelized across processes.
+
+    Args:
+        embeddings (array-like): (n, dim) document embeddings (normalized internally).
+        num_workers (int): Number of shards / worker processes (defaults to all cores).
+        response_timeout (float): Seconds to wait for the shards to answer a query batch.
+
+    Use as a context manager, or call close(), so the shared memory is released.
+    search() is serialized by a lock, since all queries share one query buffer.
+    """
+
+    def __init__(self, embeddings, num_workers=None, response_timeout=RESPONSE_TIMEOUT):
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self.size, self.dim = matrix.shape
+        self.num_workers = max(1, min(num_workers or os.cpu_count() or 1, self.size))
+        self.response_timeout = response_timeout
+        self.batch_id = 0
+        self.lock = threading.Lock()
+        self.broken = None # Set once a shard failed; the index can't answer reliably after that
+        self.shards, self.requests, self.workers = [], [], []
+        self.query_memory = self.query_buffer = None
+
+        context = mp.get_context("spawn")
+        self.responses = context.Queue()
+        try:
+            self.query_memory = shared_memory.SharedMemory(create=True, size=MAX_QUERY_BATCH * self.dim * 4)
+            self.query_buffer = np.ndarray((MAX_QUERY_BATCH, self.dim), dtype=np.float32, buffer=self.query_memory.buf)
+            bounds = np.linspace(0, self.size, self.num_workers + 1, dtype=int)
+            with _single_threaded_blas():
+                for start, end in zip(bounds[:-1], bounds[1:]):
+                    memory = shared_memory.SharedMemory(create=True, size=max(1, (end - start) * self.dim * 4))
+                    self.shards.append(memory)
+                    shard = np.ndarray((end - start, self.dim), dtype=np.float32, buffer=memory.buf)
+                    shard[:] = matrix[start:end] / norms[start:end]
+                    del shard
+                    requests = context.Queue()
+                    worker = context.Process(
+                        target=_shard_worker,
+                        args=(memory.name, int(end - start), self.dim, int(start), self.query_memory.name, requests, self.responses),
+                        daemon=True,
+                    )
+                    worker.start()
+                    self.requests.append(requests)
+                    self.workers.append(worker)
+        except BaseException:
+            self.close() # Don't leak the shared memory segments created so far
+            raise
+
+    def _search_batch(self, queries, k):
+        count = len(queries)
+        self.query_buffer[:count] = queries
+        self.batch_id += 1
+        for requests in self.requests:
+            requests.put((self.batch_id, count, k))
+
+        per_shard = []
+        deadline = time.monotonic() + self.response_timeout
+        while len(per_shard) < len(self.workers):
+            try:
+                batch_id, scores, ids = self.responses.get(timeout=LIVENESS_POLL)
+            except queue.Empty:
+                dead = [i for i, worker in enumerate(self.workers) if not worker.is_alive()]
+                if dead:
+                    self.broken = f"shard worker(s) {dead} exited"
+                elif time.monotonic() > deadline:
+                    self.broken = f"no response from the shards within {self.response_timeout:.0f}s"
+                if self.broken:
+                    raise RuntimeError(f"Sharded search failed: {self.broken}.")
+                continue
+            if batch_id != self.batch_id:
+                raise RuntimeError(f"Out-of-order shard response (got batch {batch_id}, expected {self.batch_id}).")
+            per_shard.append((scores, ids))
+
+        results = []
+        for row in range(count):
+            candidates = (
+                (float(score), int(doc_id))
+                for scores, ids in per_shard
+                for score, doc_id in zip(scores[row], ids[row])
+            )
+            results.append(heapq.nlargest(k, candidates))
+        return results
+
+    def search(self, query_embeddings, k=DEFAULT_TOP_K):
+        """
+        Args:
+            query_embeddings (array-like): One query vector or a (m, dim) batch.
+            k (int): Results per query.
+
+        Returns:
+            list: For each query, [(cosine_similarity, document_index), ...] best first.
+        """
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        if k < 1:
+            return [[] for _ in queries]
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        queries = queries / norms
+        results = []
+        with self.lock:
+            if self.broken:
+                raise RuntimeError(f"Sharded search unavailable: {self.broken}.")
+            for i in range(0, len(queries), MAX_QUERY_BATCH):
+                results.extend(self._search_batch(queries[i:i + MAX_QUERY_BATCH], k))
+        return results
+
+    def close(self):
+        for requests in self.requests:
+            requests.put(None)
+        for worker in self.workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+        self.query_buffer = None
+        for memory in self.shards + ([self.query_memory] if self.query_memory else []):
+            memory.close()
+            memory.unlink()
+        self.shards, self.requests, self.workers = [], [], []
+        self.query_memory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+# --- Benchmark ---
+def exact_search(embeddings, queries, k):
+    """Single-process reference: full matrix product + argsort."""
+    docs = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    scores = queries @ docs.T
+    top = np.argsort(-scores, axis=1)[:, :k]
+    return np.take_along_axis(scores, top, axis=1)
+
+
+def run_benchmark(num_docs=200000, dim=768, num_queries=2048, k=DEFAULT_TOP_K, max_workers=None, batch_size=64, seed=0):
+    rng = np.random.default_rng(seed)
+    print(f"--- Generating {num_docs} x {dim} corpus and {num_queries} queries ---")
+    embeddings = rng.standard_normal((num_docs, dim), dtype=np.float32)
+    queries = rng.standard_normal((num_queries, dim), dtype=np.float32)
+    reference = exact_search(embeddings, queries[:batch_size], k)
+
+    max_workers = max_workers or os.cpu_count() or 1
+    baseline = None
+    print(f"{'workers':>7} | {'queries/s':>10} | {'speedup':>7} | exact")
+    for workers in range(1, max_workers + 1):
+        with ShardedIndex(embeddings, num_workers=workers) as index:
+            index.search(queries[:batch_size], k) # Warm-up: first batch pays for worker start-up
+            start = time.perf_counter()
+            for i in range(0, num_queries, batch_size):
+                results = index.search(queries[i:i + batch_size], k)
+                if i == 0:
+                    found = np.array([[score for score, _ in row] for row in results])
+                    exact = np.allclose(found, reference, atol=1e-4)
+            elapsed = time.perf_counter() - start
+        throughput = num_queries / elapsed
+        baseline = baseline or throughput
+        print(f"{workers:>7} | {throughput:>10.1f} | {throughput / baseline:>6.2f}x | {exact}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark multi-process exact search across 1..N workers.")
+    parser.add_argument("--docs", type=int, default=200000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=2048)
+    parser.add_argument("--k", type=int, default=DEFAULT_TOP_K)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--max-workers", type=int, help="Defaults to the number of cores")
+    args = parser.parse_args()
+
+    run_benchmark(args.docs, args.dim, args.queries, args.k, args.max_workers, args.batch_size)
@@ -1,6 +1,8 @@
 import google.generativeai as genai
 from dotenv import load_dotenv
 import os
+from modelRouter import ModelRouter
+from chatSessionStore import SessionStore
 
 load_dotenv()
 
@@ -16,13 +18,19 @@ try:
         max_output_tokens=2000 # Max tokens for the whole chat turn
     )
 
-    model = genai.GenerativeModel(
-        'gemini-1.5-flash-latest', # Or your preferred model
+    # gemini-1.5-flash-latest first, falling back to other models when it breaches its latency SLO
+    router = ModelRouter(model_factory=lambda model_name: genai.GenerativeModel(
+        model_name,
         generation_config=chat_generation_config
-    )
-
-    chat = model.start_chat(history=[])
-    print("Starting a new chat session with STREAMING. Type 'quit' or 'exit' to end.")
+    ))
+
+    # Persisted per CHAT_SESSION_ID, so restarting the script resumes the conversation
+    session_store = SessionStore()
+    chat = session_store.session(os.getenv("CHAT_SESSION_ID", "streaming-chat"), router.start_chat)
+    if chat.history:
+        print(f"Resuming chat session ({len(chat.history)} messages) with STREAMING. Type 'quit' or 'exit' to end.")
+    else:
+        print("Starting a new chat session with STREAMING. Type 'quit' or 'exit' to end.")
     print("-" * 30)
 
     while True:
@@ -54,6 +62,7 @@ try:
 
 
         print() # Move to the next line after the full response is streamed
+        chat.flush() # The streamed answer is in chat.history now; append this turn to the session log
         print("-" * 30)
 
         # Note: The chat.history is typically updated with the *full* response
@@ -3,6 +3,7 @@ from dotenv import load_dotenv
 import os
 import numpy as np # For cosine similarity later
 from sklearn.metrics.pairwise import cosine_similarity # A common way to calculate it
+from usageMetrics import metered_embed_content
 
 load_dotenv()
 
@@ -32,7 +33,8 @@ try:
 
     # When embedding a query for retrieval, use task_type="RETRIEVAL_QUERY"
     # When embedding documents to be retrieved, use task_type="RETRIEVAL_DOCUMENT"
-    query_embedding_response = genai.embed_content(
+    query_embedding_response = metered_embed_content(
+        stage="embed_query",
         model=embedding_model_name,
         content=query_text,
         task_type="RETRIEVAL_QUERY", # Crucial for RAG
@@ -61,7 +63,8 @@ try:
     # However, text-embedding-004 is generally good with batching content.
     
     # The API expects a list of contents for batching.
-    document_embeddings_response = genai.embed_content(
+    document_embeddings_response = metered_embed_content(
+        stage="embed_documents",
         model=embedding_model_name,
         content=documents_to_embed, # Pass the list directly
         task_type="RETRIEVAL_DOCUMENT"
@@ -0,0 +1,344 @@
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import atexit
+import bisect
+import json
+import os
+import sys
+import threading
+import time
+
+from pipelineTracing import TRACER
+from geminiReplay import install_from_env
+from hedgedRequests import hedger_from_env, size_bucket
+
+# --- Configuration ---
+# Every embedding / generation call in the project goes through the metered_* helpers
+# below, so token usage, latency, retries and errors end up in one registry.
+#   METRICS_SNAPSHOT_PATH -> JSON snapshot written when the process exits
+#   METRICS_PORT          -> serve Prometheus text on http://<METRICS_HOST>:<port>/metrics once
+#                            the entry script calls start_metrics_server() (nothing binds on import)
+#   METRICS_HOST          -> interface for that server; loopback unless set explicitly
+#   HEDGE_PERCENTILE      -> hedge slow embed / non-streaming generate calls (see hedgedRequests.py)
+SCRIPT_NAME = os.path.splitext(os.path.basename(sys.argv[0] or "interactive"))[0] or "interactive"
+DEFAULT_METRICS_HOST = "127.0.0.1"
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0] # seconds
+MAX_RETRIES = 3
+RETRY_BASE_DELAY = 1.0 # seconds, doubled after each retry
+RETRIABLE_ERRORS = (google_exceptions.ResourceExhausted, google_exceptions.ServiceUnavailable)
+_FinishReason = genai.protos.Candidate.FinishReason
+# A streamed chunk with any other finish reason (SAFETY, RECITATION, ...) ended the answer early
+# and has no text; mid-stream chunks are UNSPECIFIED.
+CLEAN_FINISH_REASONS = (_FinishReason.FINISH_REASON_UNSPECIFIED, _FinishReason.STOP, _FinishReason.MAX_TOKENS)
+
+LABEL_NAMES = ("script", "model", "stage", "operation")
+
+
+class MetricsRegistry:
+    """
+    Thread-safe counters and latency histograms keyed by
+    (script, model, stage, operation) labels.
+    """
+
+    def __init__(self, script=SCRIPT_NAME):
+        self.script = script
+        self.lock = threading.Lock()
+        self.counters = {} # (metric_name, labels) -> value
+        self.histograms = {} # labels -> {"buckets": [...], "sum": float, "count": int}
+
+    def _labels(self, model, stage, operation):
+        return (self.script, (model or "unknown").replace("models/", ""), stage, operation)
+
+    def inc(self, metric_name, model, stage, operation, value=1):
+        key = (metric_name, self._labels(model, stage, operation))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe_latency(self, model, stage, operation, seconds):
+        labels = self._labels(model, stage, operation)
+        with self.lock:
+            histogram = self.histograms.setdefault(labels, {"buckets": [0] * (len(LATENCY_BUCKETS) + 1), "sum": 0.0, "count": 0})
+            histogram["buckets"][bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            histogram["sum"] += seconds
+            histogram["count"] += 1
+
+    def record_usage(self, model, stage, operation, usage_metadata):
+        """Adds prompt / candidates / total token counts from a response's usage_metadata."""
+        if not usage_metadata:
+            return
+        self.inc("genai_prompt_tokens_total", model, stage, operation, usage_metadata.prompt_token_count or 0)
+        self.inc("genai_candidates_tokens_total", model, stage, operation, usage_metadata.candidates_token_count or 0)
+        self.inc("genai_total_tokens_total", model, stage, operation, usage_metadata.total_token_count or 0)
+
+    # --- Exporters ---
+    def snapshot(self):
+        """Returns all series as plain dicts (the JSON snapshot format)."""
+        with self.lock:
+            counters = [
+                {"name": name, "labels": dict(zip(LABEL_NAMES, labels)), "value": value}
+                for (name, labels), value in sorted(self.counters.items())
+            ]
+            histograms = [
+                {
+                    "name": "genai_request_latency_seconds",
+                    "labels": dict(zip(LABEL_NAMES, labels)),
+                    "buckets": dict(zip([str(b) for b in LATENCY_BUCKETS] + ["+Inf"], h["buckets"])),
+                    "sum": h["sum"],
+                    "count": h["count"],
+                }
+                for labels, h in sorted(self.histograms.items())
+            ]
+        return {"timestamp": time.time(), "counters": counters, "histograms": histograms}
+
+    def to_prometheus_text(self):
+        """Renders the registry in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = []
+        seen = set()
+        for series in snapshot["counters"]:
+            if series["name"] not in seen:
+                seen.add(series["name"])
+                lines.append(f"# TYPE {series['name']} counter")
+            lines.append(f"{series['name']}{{{_format_labels(series['labels'])}}} {series['value']}")
+        if snapshot["histograms"]:
+            lines.append("# TYPE genai_request_latency_seconds histogram")
+        for series in snapshot["histograms"]:
+            cumulative = 0
+            for bound, count in series["buckets"].items():
+                cumulative += count
+                lines.append(f"genai_request_latency_seconds_bucket{{{_format_labels(series['labels'], le=bound)}}} {cumulative}")
+            lines.append(f"genai_request_latency_seconds_sum{{{_format_labels(series['labels'])}}} {series['sum']}")
+            lines.append(f"genai_request_latency_seconds_count{{{_format_labels(series['labels'])}}} {series['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write_json_snapshot(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+    def serve_prometheus(self, port, host=DEFAULT_METRICS_HOST):
+        """Starts a daemon HTTP server exposing /metrics on host:port. Returns the server."""
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.to_prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args): # Keep the chat output clean
+                pass
+
+        server = HTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def _escape_label_value(value):
+    """Escapes a label value for the Prometheus text format (backslash, quote, newline)."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, **extra):
+    merged = dict(labels, **extra)
+    return ",".join(f'{key}="{_escape_label_value(value)}"' for key, value in merged.items())
+
+
+METRICS = MetricsRegistry()
+
+if os.getenv("METRICS_SNAPSHOT_PATH"):
+    atexit.register(lambda: METRICS.write_json_snapshot(os.getenv("METRICS_SNAPSHOT_PATH")))
+
+
+def start_metrics_server(port=None, host=None):
+    """
+    Serves METRICS as Prometheus text, if a port is given or METRICS_PORT is set.
+
+    Returns:
+        HTTPServer: The running server, or None when no port is configured.
+    """
+    port = port or os.getenv("METRICS_PORT")
+    if not port:
+        return None
+    return METRICS.serve_prometheus(int(port), host or os.getenv("METRICS_HOST") or DEFAULT_METRICS_HOST)
+
+
+# GEMINI_REPLAY_MODE=record|replay routes every metered call through the offline stand-in.
+install_from_env()
+
+HEDGER = hedger_from_env()
+
+
+# --- Metered call helpers ---
+def _call_with_retries(call, model, stage, operation, retries=MAX_RETRIES):
+    """Runs call(), retrying quota/unavailable errors up to `retries` times, and records latency/retries/errors."""
+    attempt = 0
+    while True:
+        start = time.perf_counter()
+        try:
+            result = call()
+            return result, time.perf_counter() - start
+        except RETRIABLE_ERRORS:
+            if attempt >= retries:
+                METRICS.inc("genai_errors_total", model, stage, operation)
+                METRICS.observe_latency(model, stage, operation, time.perf_counter() - start)
+                raise
+            METRICS.inc("genai_retries_total", model, stage, operation)
+            time.sleep(RETRY_BASE_DELAY * (2 ** attempt))
+            attempt += 1
+        except Exception:
+            METRICS.inc("genai_errors_total", model, stage, operation)
+            METRICS.observe_latency(model, stage, operation, time.perf_counter() - start)
+            raise
+
+
+def _maybe_hedged(call, model, stage, operation, size=1):
+    """
+    Wraps an idempotent call so it is hedged when HEDGE_PERCENTILE is set. Its latency is
+    compared with calls of the same stage and a similar size (e.g. texts in an embedding batch).
+    """
+    if HEDGER is None:
+        return call
+
+    def hedged():
+        result, was_hedged = HEDGER.call(call, key=(model, stage, operation, size_bucket(size)))
+        if was_hedged:
+            METRICS.inc("genai_hedged_requests_total", model, stage, operation)
+        return result
+    return hedged
+
+
+class MeteredStream:
+    """
+    Wraps a streaming response. Latency and token usage are recorded once the
+    stream ends, from *this* response's final usage_metadata: when it is exhausted,
+    when the consumer stops early (counted in genai_partial_streams_total) or when
+    it fails mid-stream (counted in genai_errors_total).
+    time_to_first_token (seconds since the request started) is set on the first chunk.
+    Other attributes (text, usage_metadata, candidates, ...) pass through.
+    """
+
+    def __init__(self, response, model, stage, operation, start, span):
+        self._response = response
+        self._labels = (model, stage, operation)
+        self._start = start
+        self._span = span
+        self._recorded = False
+        self.time_to_first_token = None
+
+    def __iter__(self):
+        completed = False
+        try:
+            for chunk in self._response:
+                if self.time_to_first_token is None:
+                    self.time_to_first_token = time.perf_counter() - self._start
+                    self._span.set(ttft_ms=round(self.time_to_first_token * 1000, 1))
+                yield chunk
+            completed = True
+        except Exception as e:
+            self._finish(error=e)
+            raise
+        finally:
+            self._finish(partial=not completed) # Also runs when the consumer stops early (GeneratorExit)
+
+    def _finish(self, error=None, partial=False):
+        if self._recorded:
+            return
+        self._recorded = True
+        METRICS.observe_latency(*self._labels, time.perf_counter() - self._start)
+        if error is not None:
+            METRICS.inc("genai_errors_total", *self._labels)
+            self._span.set(error=f"{type(error).__name__}: {error}")
+        elif partial:
+            METRICS.inc("genai_partial_streams_total", *self._labels)
+            self._span.set(partial=True)
+        try:
+            usage_metadata = self._response.usage_metadata
+        except Exception:
+            usage_metadata = None # A broken stream may not have aggregated a final response
+        METRICS.record_usage(*self._labels, usage_metadata)
+        _set_usage_attributes(self._span, usage_metadata)
+        self._span.end()
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+
+def _set_usage_attributes(span, usage_metadata):
+    if usage_metadata:
+        span.set(
+            prompt_tokens=usage_metadata.prompt_token_count,
+            candidates_tokens=usage_metadata.candidates_token_count,
+            total_tokens=usage_metadata.total_token_count,
+        )
+
+
+def _finish_generation(response, model, stage, operation, start, latency, stream, span):
+    METRICS.inc("genai_requests_total", model, stage, operation)
+    if stream:
+        # The span stays open until the stream has been read to the end.
+        return MeteredStream(response, model, stage, operation, start, span)
+    METRICS.observe_latency(model, stage, operation, latency)
+    METRICS.record_usage(model, stage, operation, response.usage_metadata)
+    _set_usage_attributes(span, response.usage_metadata)
+    span.end()
+    return response
+
+
+def _run_generation(call, model_name, stage, operation, stream, retries=MAX_RETRIES):
+    span = TRACER.span(stage, push=False, operation=operation, model=model_name, stream=bool(stream))
+    start = time.perf_counter()
+    try:
+        response, latency = _call_with_retries(call, model_name, stage, operation, retries)
+    except Exception as e:
+        span.set(error=f"{type(e).__name__}: {e}")
+        span.end()
+        raise
+    return _finish_generation(response, model_name, stage, operation, start, latency, stream, span)
+
+
+def metered_embed_content(stage="embed", **kwargs):
+    """
+    genai.embed_content(...) with metrics. Takes the same keyword arguments.
+    Embedding responses carry no token usage, so the number of texts is counted instead.
+    """
+    model = kwargs.get("model")
+    content = kwargs.get("content")
+    texts = len(content) if isinstance(content, list) else 1
+    with TRACER.span(stage, operation="embed", model=model, texts=texts):
+        call = _maybe_hedged(lambda: genai.embed_content(**kwargs), model, stage, "embed", size=texts)
+        result, latency = _call_with_retries(call, model, stage, "embed")
+    METRICS.inc("genai_requests_total", model, stage, "embed")
+    METRICS.inc("genai_embedded_texts_total", model, stage, "embed", texts)
+    METRICS.observe_latency(model, stage, "embed", latency)
+    return result
+
+
+def metered_generate_content(model, contents, stage="generate", retries=MAX_RETRIES, **kwargs):
+    """
+    model.generate_content(contents, ...) with metrics. Supports stream=True (streams are never hedged).
+    retries=0 leaves 429/503 handling to the caller (e.g. the model router's failover).
+    """
+    call = lambda: model.generate_content(contents, **kwargs)
+    if not kwargs.get("stream"):
+        call = _maybe_hedged(call, model.model_name, stage, "generate")
+    return _run_generation(call, model.model_name, stage, "generate", kwargs.get("stream"), retries)
+
+
+def metered_send_message(chat, content, stage="chat", retries=MAX_RETRIES, **kwargs):
+    """chat.send_message(content, ...) with metrics. Supports stream=True; retries as in metered_generate_content."""
+    return _run_generation(lambda: chat.send_message(content, **kwargs), chat.model.model_name, stage, "chat", kwargs.get("stream"), retries)
+
+
+def print_usage(response, label=""):
+    """Prints a response's token usage (replaces the ad hoc usage_metadata prints)."""
+    print(f"\n--- Usage Metadata (Tokens){' - ' + label if label else ''} ---")
+    if response.usage_metadata:
+        print(f"Prompt tokens: {response.usage_metadata.prompt_token_count}")
+        print(f"Candidates tokens: {response.usage_metadata.candidates_token_count}")
+        print(f"Total tokens: {response.usage_metadata.total_token_count}")
+    else:
+        print("Usage metadata not available.")